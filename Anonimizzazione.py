@@ -1,45 +1,218 @@
-import pandas as pd
 import os
+import sys
 import json
 import pathlib 
-import hashlib
 import creazione_df
+# I moduli di nuovo/ si importano tra loro come moduli di primo livello. In
+# coda a sys.path: creazione_df resta quello di questa cartella
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'nuovo'))
+import strumentazione
+from manifest import ManifestFile
+from sink_colonnare import scrivi_colonnare, svuota_colonnare
+from pseudonimi import RegistroPseudonimi, pseudonimi_colonna
+from indice_duplicati import IndiceDuplicati, identita_fattura
+from aggregati import AggregatiLinee
 
-def cifratura(stringa):
-        return hashlib.sha256(str(stringa).encode()).hexdigest()[:12]
+# Nome del CSV (e cessionario negli aggregati) delle fatture senza codice del cessionario
+CESSIONARIO_MANCANTE = 'cessionario_mancante'
 
-def anonimizza_fattura(df):
-        df["piva_anon"] = df['IdFiscaleIVA'].apply(lambda x: cifratura(x))
-        diz = dict(zip(df["piva_anon"], df['IdFiscaleIVA']))
-        df['IdFiscaleIVA'] = df["piva_anon"]
-        df = df.drop(columns=["piva_anon"])
+def anonimizza_fattura(df, memo=None):
+        with strumentazione.misura('pseudonimizzazione'):
+            pseudonimi, diz = pseudonimi_colonna(df['IdFiscaleIVA'], memo)
+            df['IdFiscaleIVA'] = pseudonimi
         return df, diz
 
 
-def xml_tocsvs(path_xml, output_folder):
-    df = pd.DataFrame()
-    diz={}
-    for file in os.listdir(path_xml): 
-        xml_path = os.path.join(path_xml, file)
+def _leggi_fattura(xml_path):
+    """dataframe_linee_da_xml con tempo di parsing e contatori nelle statistiche"""
+    with strumentazione.misura('parsing'):
         df_clean = creazione_df.dataframe_linee_da_xml(xml_path)
+    # Senza codice il CSV si chiamerebbe '.csv'
+    if not df_clean.empty:
+        df_clean['CodiceFiscaleCessionario'] = df_clean['CodiceFiscaleCessionario'].replace('', CESSIONARIO_MANCANTE)
+    strumentazione.conta('file')
+    strumentazione.conta('linee', len(df_clean))
+    strumentazione.conta('byte_letti', os.path.getsize(xml_path))
+    return df_clean
+
+
+def _duplicato(xml_path, duplicati):
+    """
+    Registra la fattura nell'IndiceDuplicati prima del parsing; True se un
+    altro file (la stessa fattura riconsegnata) l'aveva già registrata.
+    Le copie si contano in strumentazione (contatore 'duplicati') e il totale
+    si stampa una volta a fine esecuzione.
+    """
+    with strumentazione.misura('duplicati'):
+        with open(xml_path, 'rb') as f:
+            originale = duplicati.registra(identita_fattura(f.read()), xml_path)
+    if originale is None:
+        return False
+    strumentazione.conta('duplicati')
+    return True
+
+
+def scrivi_partizioni(df, output_folder, scritti=None):
+    """
+    Scrive le righe di df nei CSV per cessionario con un solo groupby.
+    `scritti` è l'insieme degli output già scritti in questa esecuzione: al primo
+    uso un file viene riscritto da capo, poi si appende. Con scritti=None si
+    appende sempre ai file esistenti (esecuzioni incrementali).
+    Restituisce un dict output -> numero di righe scritte.
+    """
+    righe = {}
+    if df.empty:
+        return righe
+    dati = df.drop(columns=['CodiceFiscaleCessionario'])
+    for cessionario, df_data_azienda in dati.groupby(df['CodiceFiscaleCessionario'], sort=False):
+        output = f'{cessionario}.csv'
+        path = pathlib.Path(output_folder) / output
+        if scritti is None:
+            nuovo_file = not path.exists() or path.stat().st_size == 0
+        else:
+            nuovo_file = output not in scritti
+            scritti.add(output)
+        with strumentazione.misura('scrittura_csv'):
+            df_data_azienda.to_csv(path, mode='w' if nuovo_file else 'a', header=nuovo_file, index=False)
+        righe[output] = len(df_data_azienda)
+    return righe
+
+
+def _registra_partizioni(manifest, xml_path, righe, output_folder):
+    """
+    Registra nel manifest le righe appena appese ai CSV (dict output -> n)
+    insieme alle nuove dimensioni dei CSV, in un'unica transazione
+    """
+    with manifest.transazione():
+        inizi = {output: (manifest.righe_output(output), n) for output, n in righe.items()}
+        manifest.registra(xml_path, inizi)
+        for output in righe:
+            manifest.segna_dimensione(output, (pathlib.Path(output_folder) / output).stat().st_size)
+
+
+def xml_tocsvs(path_xml, output_folder, incrementale=False, formato='csv'):
+    """
+    formato='parquet' o 'arrow' (richiedono pyarrow) scrive invece dei CSV un
+    dataset in output_folder/linee.<formato>, partizionato per cessionario e mese.
+    Le fatture già elaborate da un altro file dello stesso input
+    (output_folder/duplicati.db) vengono saltate, così le riconsegne non
+    gonfiano i CSV per cessionario.
+    Le tabelle aggregate in output_folder/aggregati.db (vedi nuovo/aggregati.py)
+    sono ricostruite file per file insieme ai CSV, e con l'output CSV anche il
+    manifest (output_folder/manifest.db), così le esecuzioni incrementali
+    successive partono da questa.
+    """
+    if incrementale:
+        if formato != 'csv':
+            raise ValueError("L'elaborazione incrementale supporta solo l'output CSV")
+        return xml_tocsvs_incrementale(path_xml, output_folder)
+    # Ogni file viene scritto subito nelle sue partizioni: niente concat del totale
+    pathlib.Path(output_folder).mkdir(parents=True, exist_ok=True)
+    cartella_colonnare = pathlib.Path(output_folder) / f'linee.{formato}'
+    if formato != 'csv':
+        svuota_colonnare(cartella_colonnare, formato)
+    registro = RegistroPseudonimi(pathlib.Path(output_folder) / 'pseudonimi.db')
+    # L'output viene riscritto da capo: indice dei duplicati e aggregati ripartono vuoti
+    duplicati = IndiceDuplicati(pathlib.Path(output_folder) / 'duplicati.db')
+    duplicati.svuota()
+    aggregati = AggregatiLinee(pathlib.Path(output_folder) / 'aggregati.db')
+    aggregati.svuota()
+    manifest = ManifestFile(pathlib.Path(output_folder) / 'manifest.db')
+    manifest.svuota()
+    scritti = set()
+    saltati = 0
+    # Stesso ordine di xml_tocsvs_incrementale
+    for file in sorted(os.listdir(path_xml)):
+        xml_path = os.path.join(path_xml, file)
+        if _duplicato(xml_path, duplicati):
+            saltati += 1
+            if formato == 'csv':
+                manifest.registra(xml_path, {})
+            continue
+        df_clean = _leggi_fattura(xml_path)
+        encrypted_xml, dic = anonimizza_fattura(df_clean)
+        with strumentazione.misura('registro'):
+            registro.aggiungi(dic)
+        with strumentazione.misura('aggregati'):
+            aggregati.aggiorna(encrypted_xml)
+        if formato == 'csv':
+            _registra_partizioni(manifest, xml_path, scrivi_partizioni(encrypted_xml, output_folder, scritti),
+                                 output_folder)
+        else:
+            with strumentazione.misura('scrittura_colonnare'):
+                scrivi_colonnare(encrypted_xml, cartella_colonnare, formato)
+    registro.esporta_csv(pathlib.Path(output_folder) / 'cifratura.csv')
+    registro.chiudi()
+    duplicati.chiudi()
+    aggregati.chiudi()
+    manifest.chiudi()
+    if saltati:
+        print(f"Duplicati saltati: {saltati}")
+
+
+def xml_tocsvs_incrementale(path_xml, output_folder):
+    """
+    Come xml_tocsvs ma elabora solo i file nuovi o modificati rispetto al
+    manifest in output_folder/manifest.db e appende le loro righe ai CSV per
+    cessionario. Le righe dei file modificati o eliminati vengono tolte dai CSV
+    e i file saltati come loro duplicati vengono rielaborati.
+    Le tabelle aggregate ricevono solo le righe nuove; quelle dei cessionari
+    a cui sono state tolte righe vengono ricalcolate dal loro CSV.
+    """
+    output_folder = pathlib.Path(output_folder)
+    output_folder.mkdir(parents=True, exist_ok=True)
+    manifest = ManifestFile(output_folder / 'manifest.db')
+    troncati = manifest.riconcilia(path for path in output_folder.glob('*.csv') if path.name != 'cifratura.csv')
+    paths = [os.path.join(path_xml, file) for file in sorted(os.listdir(path_xml))]
+    nuovi, modificati, eliminati = manifest.confronta(paths)
+    # Le copie saltate come duplicati dei file modificati o eliminati tornano da elaborare
+    duplicati = IndiceDuplicati(output_folder / 'duplicati.db')
+    attuali = set(paths).difference(nuovi, modificati)
+    copie = [path for path in duplicati.rimuovi(modificati + eliminati) if path in attuali]
+    aggregati = AggregatiLinee(output_folder / 'aggregati.db')
+    # Righe tolte dai CSV (troncate da riconcilia o dei file rimossi): quei cessionari si ricalcolano
+    ricalcolare = {pathlib.Path(percorso).name for percorso in troncati}
+    ricalcolare.update(manifest.rimuovi_dagli_output(modificati + eliminati + copie, output_folder))
+    for output in sorted(ricalcolare):
+        with strumentazione.misura('aggregati'):
+            aggregati.ricalcola_da_csv(pathlib.Path(output).stem, output_folder / output)
+
+    registro = RegistroPseudonimi(output_folder / 'pseudonimi.db')
+    if not len(registro) and (output_folder / 'cifratura.csv').exists():
+        registro.importa_csv(output_folder / 'cifratura.csv')
+
+    saltati = 0
+    for xml_path in nuovi + modificati + copie:
+        try:
+            if _duplicato(xml_path, duplicati):
+                saltati += 1
+                manifest.registra(xml_path, {})
+                continue
+            df_clean = _leggi_fattura(xml_path)
+        except Exception as e:
+            print(f"Errore su {xml_path}: {e}")
+            strumentazione.conta('errori')
+            duplicati.rimuovi([xml_path])
+            continue
         encrypted_xml, dic = anonimizza_fattura(df_clean)
-        df = pd.concat([df, encrypted_xml], ignore_index=True)
-        diz.update(dic)  
-
-    df_cifratura=pd.DataFrame(list(diz.items()), columns=['piva_anon', 'IdFiscaleIVA'])  
-    output_df_crifratura= pathlib.Path(output_folder) / 'cifratura.csv'
-    df_cifratura.to_csv(output_df_crifratura, index=False)
-
-    for cessionario in df['CodiceFiscaleCessionario'].unique(): 
-        df_data_azienda=df[df['CodiceFiscaleCessionario'] == cessionario]
-        path=pathlib.Path(output_folder)/cessionario+'.csv'
-        path.parent.mkdir(parents=True, exist_ok=True)
-        df_data_azienda.drop(columns=['CodiceFiscaleCessionario']).to_csv(path, index=False)
-        df_data_azienda = pd.DataFrame()
+        with strumentazione.misura('registro'):
+            registro.aggiungi(dic)
+        with strumentazione.misura('aggregati'):
+            aggregati.aggiorna(encrypted_xml)
+        _registra_partizioni(manifest, xml_path, scrivi_partizioni(encrypted_xml, output_folder), output_folder)
+
+    registro.esporta_csv(output_folder / 'cifratura.csv')
+    registro.chiudi()
+    duplicati.chiudi()
+    aggregati.chiudi()
+    manifest.chiudi()
+    print(f"Incrementale: {len(nuovi)} nuovi, {len(modificati)} modificati, {len(eliminati)} eliminati, "
+          f"{len(copie)} copie rielaborate, {saltati} duplicati saltati")
     
 
 if __name__ == "__main__":
     path_xml = 'path_to_your_xml_files'  # Replace with your XML files path
     output_folder = 'output_csvs'  # Replace with your desired output folder
     xml_tocsvs(path_xml, output_folder)
-    print(f"CSV files created in {output_folder} and anonymization mapping saved in cifratura.csv")
+    print(f"CSV files created in {output_folder} and anonymization mapping saved in pseudonimi.db")
+    strumentazione.STATISTICHE.salva_json(pathlib.Path(output_folder) / 'statistiche.json')
@@ -1,40 +1,88 @@
 import pandas as pd
-import json
 import pathlib 
-import hashlib
 import creazione_df
+import strumentazione
+from sink_colonnare import scrivi_colonnare, svuota_colonnare
+from pseudonimi import RegistroPseudonimi, pseudonimi_colonna
+from indice_duplicati import IndiceDuplicati
+from aggregati import AggregatiLinee
 
-input_dir = r"C:\Users\JadeOliverGuevarra\Documents\prova\pjwork\dframe\xml_prova"  # directory contenente XML e P7M
+input_dir = r"C:\Users\JadeOliverGuevarra\Documents\prova\pjwork\dframe\xml_prova"  # directory (o archivio .zip/.tar.gz) contenente XML e P7M
 output_dir = r"C:\Users\JadeOliverGuevarra\Documents\prova\pjwork\dframe\data"
+formato_output = "csv"  # oppure "parquet" / "arrow" (richiedono pyarrow), partizionati per mese
+righe_per_blocco = 100000  # righe estratte, anonimizzate e scritte per volta
+traccia_per_file = False  # aggiunge al JSON delle statistiche tempi e esito di ogni file
+salta_duplicati = True  # salta le fatture già elaborate da un altro file (.xml e .p7m, riconsegne)
 
-def cifratura(stringa):
-    return hashlib.sha256(str(stringa).encode()).hexdigest()[:12]
-
-def anonimizza_fattura(df):
-    df = df.copy()
-    df["piva_anon"] = df['IdFiscaleIVA'].apply(lambda x: cifratura(x))
-    diz = dict(zip(df["piva_anon"], df['IdFiscaleIVA']))
-    df['IdFiscaleIVA'] = df["piva_anon"]
-    df = df.drop(columns=["piva_anon"])
+def anonimizza_fattura(df, memo=None, copia=True):
+    """
+    Sostituisce IdFiscaleIVA con lo pseudonimo; restituisce anche il dict
+    pseudonimo -> partita IVA. Gli hash sono calcolati una volta per valore
+    distinto e ricordati tra una chiamata e l'altra (vedi pseudonimi.py).
+    Con copia=False modifica df sul posto (per i blocchi di iter_linee).
+    """
+    with strumentazione.misura('pseudonimizzazione'):
+        if copia:
+            df = df.copy()
+        pseudonimi, diz = pseudonimi_colonna(df['IdFiscaleIVA'], memo)
+        df['IdFiscaleIVA'] = pseudonimi
     return df, diz
 
-# Estrai tutte le linee da XML e P7M (batch)
-df = creazione_df.dataframe_linee_batch(input_dir)
-print(f"Righe estratte dal batch: {len(df)}")
-
-# Applica anonimizzazione su tutto il DataFrame
-if not df.empty:
-    df_anon, diz = anonimizza_fattura(df)
-    print(f"Righe dopo anonimizzazione: {len(df_anon)}")
-else:
-    print("Nessun dato valido estratto. Verrà creato un CSV vuoto.")
-    df_anon, diz = df, {}
+if __name__ == "__main__":
+    output_path_registro = pathlib.Path(output_dir) / 'output_group_1/group_1_bills_pseudonimi.db'
+    output_path_dict = pathlib.Path(output_dir) / 'output_group_1/group_1_bills_dictionary.json'
+    output_path_csv = pathlib.Path(output_dir) / 'output_group_1/group_1_bills_encrypted.csv'
+    output_path_dataset = output_path_csv.with_suffix(f".{formato_output}")
+    output_path_statistiche = pathlib.Path(output_dir) / 'output_group_1/group_1_bills_statistiche.json'
+    output_path_duplicati = pathlib.Path(output_dir) / 'output_group_1/group_1_bills_duplicati.db'
+    output_path_aggregati = pathlib.Path(output_dir) / 'output_group_1/group_1_bills_aggregati.db'
+    output_path_registro.parent.mkdir(parents=True, exist_ok=True)
+    if formato_output != "csv":
+        svuota_colonnare(output_path_dataset, formato_output)
 
-output_path_dict = pathlib.Path(output_dir) / 'output_group_1/group_1_bills_dictionary.json'
-output_path_csv = pathlib.Path(output_dir) / 'output_group_1/group_1_bills_encrypted.csv'
-output_path_dict.parent.mkdir(parents=True, exist_ok=True)
+    # Estrai (XML e P7M), anonimizza e scrivi un blocco alla volta: la memoria
+    # resta quella di un blocco qualunque sia la dimensione dell'archivio.
+    # Nel registro finiscono solo le coppie nuove; la re-identificazione passa da registro.valore()
+    statistiche = strumentazione.nuove_statistiche(traccia=traccia_per_file)
+    registro = RegistroPseudonimi(output_path_registro)
+    # L'output viene riscritto da capo: l'indice dei duplicati riparte vuoto,
+    # altrimenti le fatture registrate da un'esecuzione precedente verrebbero saltate
+    duplicati = IndiceDuplicati(output_path_duplicati) if salta_duplicati else None
+    if duplicati is not None:
+        duplicati.svuota()
+    # Tabelle aggregate per i cruscotti (vedi aggregati.py), ricostruite insieme all'output
+    aggregati = AggregatiLinee(output_path_aggregati)
+    aggregati.svuota()
+    righe = 0
+    for df in creazione_df.iter_linee(input_dir, chunk_rows=righe_per_blocco, duplicati=duplicati):
+        df_anon, diz = anonimizza_fattura(df, copia=False)
+        with strumentazione.misura('registro'):
+            registro.aggiungi(diz)
+        with strumentazione.misura('aggregati'):
+            aggregati.aggiorna(df_anon)
+        with strumentazione.misura('scrittura'):
+            if formato_output == "csv":
+                df_anon.to_csv(output_path_csv, mode='w' if righe == 0 else 'a', header=righe == 0, index=False)
+            else:
+                scrivi_colonnare(df_anon, output_path_dataset, formato_output)
+        righe += len(df_anon)
+    # Il JSON del dizionario resta disponibile per chi lo legge: è l'esportazione del registro
+    registro.esporta_json(output_path_dict)
+    registro.chiudi()
+    aggregati.chiudi()
+    if duplicati is not None:
+        duplicati.chiudi()
+    print(f"Righe estratte e anonimizzate: {righe}")
+    if duplicati is not None:
+        print(f"Duplicati saltati: {statistiche.contatori.get('duplicati', 0)}")
+    print(f"Dizionario degli pseudonimi salvato in: {output_path_dict}")
+    statistiche.salva_json(output_path_statistiche, traccia=traccia_per_file)
+    print(f"Statistiche salvate in: {output_path_statistiche}")
 
-with open(output_path_dict, "w") as f:
-    json.dump(diz, f, indent=4)
-df_anon.to_csv(output_path_csv, index=False)
-print(f"CSV salvato in: {output_path_csv}")
+    if formato_output != "csv":
+        print(f"Dataset {formato_output} salvato in: {output_path_dataset}")
+    else:
+        if righe == 0:
+            print("Nessun dato valido estratto. Verrà creato un CSV vuoto.")
+            pd.DataFrame().to_csv(output_path_csv, index=False)
+        print(f"CSV salvato in: {output_path_csv}")
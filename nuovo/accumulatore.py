@@ -0,0 +1,194 @@
+from array import array
+import datetime
+import numpy as np
+import pandas as pd
+
+# Ordine delle colonne del DataFrame delle linee di dettaglio
+COLONNE_FATTURA = ['Data', 'IdPaese', 'IdFiscaleIVA', 'CAP', 'Comune', 'Provincia']
+COLONNE_LINEA = ['Descrizione', 'Quantita', 'PrezzoUnitario', 'PrezzoTotale']
+COLONNE = COLONNE_FATTURA + COLONNE_LINEA
+
+# Schema compatto: i campi ripetuti su ogni linea diventano categorie (codici
+# interi + un dizionario dei valori distinti), Quantita un int64. Il tipo di
+# Quantita è fisso e non dipende dai valori del blocco: i blocchi di
+# iter_linee finiscono nello stesso file Parquet/Arrow e devono avere lo stesso
+# schema. Quantita resta a 64 bit come il vecchio int() di Python: una
+# quantità di FatturaPA (fino a 12 cifre intere) non sta in un int32. I prezzi
+# restano float64: in float32 i centesimi degli importi grandi non sono
+# rappresentabili.
+COLONNE_CATEGORICHE = COLONNE_FATTURA[1:] + ['Descrizione']
+TIPO_QUANTITA = np.int64
+FORMATO_DATA = '%Y-%m-%d'
+
+
+class AccumulatoreLinee:
+    """
+    Accumula le linee di dettaglio di molte fatture in buffer colonnari tipizzati,
+    per costruire un solo DataFrame alla fine invece di un dict per riga e un
+    DataFrame per file.
+    I campi costanti per fattura (data e dati del cedente) sono memorizzati una
+    volta sola; ogni linea tiene solo l'indice della sua fattura e i valori
+    vengono replicati (broadcast) solo in to_dataframe().
+    Le date restano stringhe ISO fino a to_dataframe(), dove sono convertite
+    tutte insieme (vedi converti_date); nuova_fattura() si limita a
+    verificarle, così una data non valida fa fallire il suo file.
+    """
+
+    def __init__(self):
+        # Una voce per fattura
+        self.date = []
+        self.cedenti = []
+        # Una voce per linea
+        self.indice_fattura = array('q')
+        self.descrizioni = []
+        self.quantita = array('q')
+        self.prezzi_unitari = array('d')
+        self.prezzi_totali = array('d')
+
+    def __len__(self):
+        return len(self.indice_fattura)
+
+    @property
+    def n_fatture(self):
+        return len(self.date)
+
+    def nuova_fattura(self, data_fattura, cedente_info):
+        """Registra una fattura; le linee aggiunte dopo appartengono a lei"""
+        verifica_data(data_fattura)
+        self.date.append(data_fattura)
+        self.cedenti.append(tuple(cedente_info))
+
+    def aggiungi_linea(self, descrizione, quantita, prezzo_unitario, prezzo_totale):
+        if not self.date:
+            raise AttributeError("DettaglioLinee fuori da una fattura")
+        self.indice_fattura.append(len(self.date) - 1)
+        self.descrizioni.append(descrizione)
+        self.quantita.append(quantita)
+        self.prezzi_unitari.append(prezzo_unitario)
+        self.prezzi_totali.append(prezzo_totale)
+
+    def segna(self):
+        """Punto di ripristino da passare a ripristina() se un file fallisce a metà"""
+        return len(self.date), len(self.indice_fattura)
+
+    def ripristina(self, segno):
+        """Scarta fatture e linee aggiunte dopo segna()"""
+        n_fatture, n_linee = segno
+        del self.date[n_fatture:]
+        del self.cedenti[n_fatture:]
+        del self.indice_fattura[n_linee:]
+        del self.descrizioni[n_linee:]
+        del self.quantita[n_linee:]
+        del self.prezzi_unitari[n_linee:]
+        del self.prezzi_totali[n_linee:]
+
+    def estendi(self, altro):
+        """Accoda il contenuto di un altro accumulatore (es. risultato di un worker)"""
+        offset = len(self.date)
+        self.date.extend(altro.date)
+        self.cedenti.extend(altro.cedenti)
+        if offset:
+            self.indice_fattura.extend(array('q', (i + offset for i in altro.indice_fattura)))
+        else:
+            self.indice_fattura.extend(altro.indice_fattura)
+        self.descrizioni.extend(altro.descrizioni)
+        self.quantita.extend(altro.quantita)
+        self.prezzi_unitari.extend(altro.prezzi_unitari)
+        self.prezzi_totali.extend(altro.prezzi_totali)
+
+    def separa(self, n):
+        """
+        Toglie le prime n linee (con le loro fatture) e le restituisce in un
+        nuovo accumulatore; in questo restano le linee successive. Una fattura
+        divisa a metà finisce in entrambi. Da chiamare tra un file e l'altro.
+        """
+        testa = AccumulatoreLinee()
+        n = min(n, len(self))
+        if n <= 0:
+            return testa
+        ultima = self.indice_fattura[n - 1]
+        prima = self.indice_fattura[n] if n < len(self) else len(self.date)
+        testa.date = self.date[:ultima + 1]
+        testa.cedenti = self.cedenti[:ultima + 1]
+        testa.indice_fattura = self.indice_fattura[:n]
+        testa.descrizioni = self.descrizioni[:n]
+        testa.quantita = self.quantita[:n]
+        testa.prezzi_unitari = self.prezzi_unitari[:n]
+        testa.prezzi_totali = self.prezzi_totali[:n]
+        resto = (np.frombuffer(self.indice_fattura, dtype=np.int64)[n:] - prima).tobytes()
+        self.indice_fattura = array('q', resto)
+        del self.date[:prima]
+        del self.cedenti[:prima]
+        del self.descrizioni[:n]
+        del self.quantita[:n]
+        del self.prezzi_unitari[:n]
+        del self.prezzi_totali[:n]
+        return testa
+
+    def to_dataframe(self, compatto=True):
+        """
+        Costruisce il DataFrame finale (stesse colonne di get_linee_dettaglio).
+        Con compatto=True usa lo schema compatto (categorie) direttamente dai
+        buffer; con False le colonne di testo sono object, come nelle versioni
+        precedenti. Quantita è int64 in entrambi i casi.
+        """
+        if not len(self):
+            return pd.DataFrame()
+        indice = np.frombuffer(self.indice_fattura, dtype=np.int64)
+        colonne = {'Data': converti_date(self.date)[indice]}
+        for pos, nome in enumerate(COLONNE_FATTURA[1:]):
+            valori = np.empty(len(self.cedenti), dtype=object)
+            valori[:] = [cedente[pos] for cedente in self.cedenti]
+            if compatto:
+                # Categorie calcolate per fattura, poi i codici replicati sulle linee
+                codici, categorie = pd.factorize(valori)
+                colonne[nome] = pd.Categorical.from_codes(codici[indice], categorie)
+            else:
+                colonne[nome] = valori[indice]
+        descrizioni = np.array(self.descrizioni, dtype=object)
+        if compatto:
+            codici, categorie = pd.factorize(descrizioni)
+            colonne['Descrizione'] = pd.Categorical.from_codes(codici, categorie)
+        else:
+            colonne['Descrizione'] = descrizioni
+        colonne['Quantita'] = np.frombuffer(self.quantita, dtype=TIPO_QUANTITA).copy()
+        colonne['PrezzoUnitario'] = np.frombuffer(self.prezzi_unitari, dtype=np.float64).copy()
+        colonne['PrezzoTotale'] = np.frombuffer(self.prezzi_totali, dtype=np.float64).copy()
+        return pd.DataFrame(colonne, columns=COLONNE)
+
+
+def verifica_data(data_fattura):
+    """
+    Solleva ValueError se la data non è convertibile, come faceva il
+    pd.to_datetime per fattura: una data ISO costa un date.fromisoformat(), le
+    altre stringhe passano dal parser generico che userà converti_date.
+    """
+    if isinstance(data_fattura, datetime.date):
+        return
+    try:
+        datetime.date.fromisoformat(data_fattura)
+    except (ValueError, TypeError):
+        try:
+            pd.to_datetime(str(data_fattura).strip())
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"Data non valida: {data_fattura!r} ({e})") from e
+
+
+def converti_date(date):
+    """
+    Converte le date di tutte le fatture in datetime64[ns] con un solo
+    to_datetime vettoriale sul formato ISO. Le poche che non lo rispettano
+    (spazi, orario, Timestamp già convertiti) passano dal parser generico.
+    Le date arrivano già verificate da nuova_fattura(): se una non fosse
+    interpretabile diventerebbe NaT e verrebbe segnalata.
+    """
+    grezze = pd.Series(date, dtype=object)
+    convertite = pd.to_datetime(grezze, format=FORMATO_DATA, errors='coerce')
+    da_rivedere = convertite.isna() & grezze.notna()
+    if da_rivedere.any():
+        for i in np.flatnonzero(da_rivedere.to_numpy()):
+            try:
+                convertite.iat[i] = pd.to_datetime(str(grezze.iat[i]).strip())
+            except (ValueError, TypeError) as e:
+                print(f"Data non valida: {grezze.iat[i]!r} ({e})")
+    return convertite.to_numpy(dtype='datetime64[ns]')
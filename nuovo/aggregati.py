@@ -0,0 +1,147 @@
+"""
+Tabelle aggregate delle linee di fattura, per i cruscotti: spesa, righe,
+quantità e prezzo unitario minimo/massimo per fornitore (IdFiscaleIVA), per
+Provincia/Comune e per cessionario, mese per mese. La spesa delle sole linee
+con Quantita è tenuta a parte (spesa_con_quantita): è quella che va divisa
+per la quantità nel prezzo medio.
+Sono aggiornate a ogni blocco di linee ingerite invece di rileggere i CSV
+completi: il blocco viene raggruppato con un groupby vettoriale e il
+risultato è fuso nelle tabelle SQLite con un upsert (somme e conteggi si
+sommano, min e max si confrontano). leggi() risponde dalle tabelle senza
+riscansionare le linee.
+"""
+import os
+import pandas as pd
+
+from connessione_sqlite import connetti
+
+# Tabella -> colonne della chiave oltre a cessionario e mese
+TABELLE = {
+    'fornitore_mese': ('IdFiscaleIVA',),
+    'comune_mese': ('Provincia', 'Comune'),
+    'cessionario_mese': (),
+}
+# Quantita assente nella fattura (vedi creazione_df._valori_linea): esclusa dalle somme
+QUANTITA_MANCANTE = -1
+# Chiavi lette come stringhe dai CSV delle linee (pseudonimi e CAP possono sembrare numeri)
+TIPI_CSV = {'IdFiscaleIVA': str, 'CAP': str, 'Comune': str, 'Provincia': str}
+
+
+def _schema_tabella(tabella, chiave):
+    colonne = ''.join(f'{colonna} TEXT, ' for colonna in chiave)
+    return f"""
+        CREATE TABLE IF NOT EXISTS {tabella} (
+            cessionario TEXT, {colonne}mese TEXT,
+            righe INTEGER NOT NULL,
+            spesa REAL NOT NULL,
+            spesa_con_quantita REAL NOT NULL,
+            quantita INTEGER NOT NULL,
+            prezzo_min REAL,
+            prezzo_max REAL,
+            PRIMARY KEY (cessionario, {''.join(f'{colonna}, ' for colonna in chiave)}mese)
+        );"""
+
+
+class AggregatiLinee:
+
+    def __init__(self, percorso):
+        self.percorso = str(percorso)
+        self.conn = connetti(self.percorso, ''.join(_schema_tabella(tabella, chiave)
+                                                    for tabella, chiave in TABELLE.items()))
+
+    def chiudi(self):
+        self.conn.close()
+
+    def aggiorna(self, df, cessionario=''):
+        """
+        Fonde nelle tabelle le linee di df (un blocco appena ingerito). Il
+        cessionario è la colonna CodiceFiscaleCessionario se c'è, altrimenti
+        il valore `cessionario` per tutte le righe.
+        """
+        with self.conn:
+            self._fondi(df, cessionario)
+
+    def ricalcola(self, cessionario, blocchi):
+        """
+        Sostituisce gli aggregati di un cessionario con quelli dei DataFrame in
+        `blocchi`, in una sola transazione. Serve quando delle righe vengono
+        tolte dall'output (file modificati o eliminati): min e max non si
+        possono sottrarre.
+        """
+        with self.conn:
+            for tabella in TABELLE:
+                self.conn.execute(f"DELETE FROM {tabella} WHERE cessionario = ?", (cessionario,))
+            for df in blocchi:
+                self._fondi(df, cessionario)
+
+    def ricalcola_da_csv(self, cessionario, percorso_csv, righe_per_blocco=100000):
+        """ricalcola() leggendo a blocchi il CSV delle linee del cessionario"""
+        if os.path.exists(percorso_csv) and os.path.getsize(percorso_csv):
+            blocchi = pd.read_csv(percorso_csv, dtype=TIPI_CSV, chunksize=righe_per_blocco)
+        else:
+            blocchi = []
+        self.ricalcola(cessionario, blocchi)
+
+    def svuota(self):
+        with self.conn:
+            for tabella in TABELLE:
+                self.conn.execute(f"DELETE FROM {tabella}")
+
+    def _fondi(self, df, cessionario):
+        if df.empty:
+            return
+        con_quantita = df['Quantita'] != QUANTITA_MANCANTE
+        linee = pd.DataFrame({
+            'cessionario': df['CodiceFiscaleCessionario'] if 'CodiceFiscaleCessionario' in df.columns
+            else cessionario,
+            'mese': pd.to_datetime(df['Data'], errors='coerce').dt.to_period('M'),
+            'spesa': df['PrezzoTotale'],
+            'spesa_con_quantita': df['PrezzoTotale'].where(con_quantita, 0),
+            'quantita': df['Quantita'].where(con_quantita, 0),
+            'prezzo': df['PrezzoUnitario'],
+        })
+        for tabella, chiave in TABELLE.items():
+            for colonna in chiave:
+                linee[colonna] = df[colonna]
+            colonne = ['cessionario', *chiave, 'mese']
+            gruppi = linee.groupby(colonne, observed=True, sort=False, dropna=False).agg(
+                righe=('spesa', 'size'), spesa=('spesa', 'sum'),
+                spesa_con_quantita=('spesa_con_quantita', 'sum'), quantita=('quantita', 'sum'),
+                prezzo_min=('prezzo', 'min'), prezzo_max=('prezzo', 'max')).reset_index()
+            # Chiavi mancanti come '' (in SQLite NULL non fa conflitto nella chiave primaria)
+            valori = [gruppi[colonna].astype(str).where(gruppi[colonna].notna(), '').tolist()
+                      for colonna in colonne]
+            valori += [gruppi[misura].astype(object).where(gruppi[misura].notna(), None).tolist()
+                       for misura in ('righe', 'spesa', 'spesa_con_quantita', 'quantita',
+                                      'prezzo_min', 'prezzo_max')]
+            self.conn.executemany(f"""
+                INSERT INTO {tabella} VALUES ({', '.join('?' * len(gruppi.columns))})
+                ON CONFLICT ({', '.join(colonne)}) DO UPDATE SET
+                    righe = righe + excluded.righe,
+                    spesa = spesa + excluded.spesa,
+                    spesa_con_quantita = spesa_con_quantita + excluded.spesa_con_quantita,
+                    quantita = quantita + excluded.quantita,
+                    prezzo_min = MIN(COALESCE(prezzo_min, excluded.prezzo_min),
+                                     COALESCE(excluded.prezzo_min, prezzo_min)),
+                    prezzo_max = MAX(COALESCE(prezzo_max, excluded.prezzo_max),
+                                     COALESCE(excluded.prezzo_max, prezzo_max))
+            """, zip(*valori))
+
+    def leggi(self, tabella, **filtri):
+        """
+        DataFrame della tabella, filtrato per uguaglianza sulle colonne chiave
+        (es. leggi('fornitore_mese', IdFiscaleIVA='babd58f0c450', mese='2022-10')),
+        con in più il prezzo medio per unità (spesa_con_quantita / quantita:
+        le linee senza Quantita non entrano nel prezzo medio).
+        """
+        if tabella not in TABELLE:
+            raise ValueError(f"Tabella aggregata sconosciuta: {tabella}")
+        colonne_ammesse = {'cessionario', 'mese', *TABELLE[tabella]}
+        for colonna in filtri:
+            if colonna not in colonne_ammesse:
+                raise ValueError(f"Colonna non filtrabile in {tabella}: {colonna}")
+        condizioni = ' AND '.join(f'{colonna} = ?' for colonna in filtri)
+        df = pd.read_sql_query(f"SELECT * FROM {tabella}" + (f" WHERE {condizioni}" if filtri else ''),
+                               self.conn, params=list(filtri.values()))
+        df['prezzo_medio'] = df['spesa_con_quantita'] / df['quantita'].where(df['quantita'] != 0)
+        return df
@@ -0,0 +1,175 @@
+"""
+Lettura delle fatture direttamente dagli archivi delle consegne SDI (.zip,
+.tar, .tar.gz/.tgz, .tar.bz2, .tar.xz), senza scompattarli su disco.
+Un membro di un archivio è identificato dalla stringa
+'<archivio>::<nome del membro>': è un normale "path" per creazione_df
+(stampe d'errore, traccia per file, blocchi dei worker) e si serializza
+senza costi verso i processi worker.
+Ogni processo tiene aperto un solo handle per archivio: gli zip si leggono
+ad accesso diretto, i tar (compressi o no) solo in avanti. Per questo i
+worker non aprono mai un tar: nell'esecuzione parallela il processo
+principale lo legge una volta sola e passa ai worker i byte dei membri di
+ogni blocco (vedi precarica()).
+"""
+import os
+import tarfile
+import zipfile
+
+SEPARATORE = '::'
+ESTENSIONI_ZIP = ('.zip',)
+ESTENSIONI_TAR = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+# Handle aperti dal processo corrente: (pid, archivio) -> lettore. Il pid
+# evita di riusare nei worker (fork) un file aperto dal processo principale.
+_APERTI = {}
+
+
+def e_archivio(path):
+    """True se path è un archivio supportato (dall'estensione)"""
+    nome = str(path).lower()
+    return nome.endswith(ESTENSIONI_ZIP) or nome.endswith(ESTENSIONI_TAR)
+
+
+def membro(archivio, nome):
+    return f"{archivio}{SEPARATORE}{nome}"
+
+
+def dividi_membro(path):
+    """(archivio, nome del membro) se path indica un membro di un archivio, altrimenti None"""
+    archivio, separatore, nome = path.partition(SEPARATORE)
+    if not separatore or not e_archivio(archivio):
+        return None
+    return archivio, nome
+
+
+def e_membro(path):
+    return isinstance(path, str) and dividi_membro(path) is not None
+
+
+def e_membro_tar(path):
+    """True se path è un membro di un tar, che si legge solo in avanti"""
+    return e_membro(path) and not dividi_membro(path)[0].lower().endswith(ESTENSIONI_ZIP)
+
+
+def _da_elaborare(nome):
+    """Stesso criterio di creazione_df.file_batch: .xml (esclusi *_estratto.xml) e .p7m"""
+    nome = nome.lower()
+    return (nome.endswith('.xml') and not nome.endswith('_estratto.xml')) or nome.endswith('.p7m')
+
+
+def membri(archivio):
+    """
+    Membri da elaborare di un archivio, nell'ordine in cui vi sono salvati
+    (l'ordine in cui un tar si legge senza tornare indietro).
+    """
+    archivio = str(archivio)
+    if archivio.lower().endswith(ESTENSIONI_ZIP):
+        with zipfile.ZipFile(archivio) as zf:
+            nomi = [info.filename for info in zf.infolist() if not info.is_dir()]
+    else:
+        with tarfile.open(archivio, 'r|*') as tf:
+            nomi = [info.name for info in tf if info.isfile()]
+    return [membro(archivio, nome) for nome in nomi if _da_elaborare(nome)]
+
+
+def leggi(path):
+    """Byte di un membro (vedi membro()), letti dall'handle dell'archivio del processo"""
+    archivio, nome = dividi_membro(path)
+    chiave = (os.getpid(), archivio)
+    lettore = _APERTI.get(chiave)
+    if lettore is None:
+        if archivio.lower().endswith(ESTENSIONI_ZIP):
+            lettore = _LettoreZip(archivio)
+        else:
+            lettore = _LettoreTar(archivio)
+        _APERTI[chiave] = lettore
+    return lettore.leggi(nome)
+
+
+def precarica(contenuti):
+    """
+    Registra nel processo corrente i byte già letti di alcuni membri
+    (dict membro -> bytes, o l'eccezione sollevata leggendolo): leggi() li
+    restituisce senza aprire l'archivio. Valgono fino a chiudi().
+    """
+    pid = os.getpid()
+    for path, dati in contenuti.items():
+        archivio, nome = dividi_membro(path)
+        lettore = _APERTI.get((pid, archivio))
+        if not isinstance(lettore, _LettoreMemoria):
+            lettore = _APERTI[(pid, archivio)] = _LettoreMemoria(archivio)
+        lettore.contenuti[nome] = dati
+
+
+def chiudi():
+    """Chiude gli handle aperti dal processo corrente"""
+    for chiave in [chiave for chiave in _APERTI if chiave[0] == os.getpid()]:
+        _APERTI.pop(chiave).chiudi()
+
+
+def percorso_debug(path):
+    """
+    Percorso su disco per i file di debug di un membro (XML estratto,
+    candidati XML): accanto all'archivio, con il nome del membro.
+    """
+    archivio, nome = dividi_membro(path)
+    return os.path.join(os.path.dirname(archivio), os.path.basename(nome))
+
+
+class _LettoreZip:
+
+    def __init__(self, archivio):
+        self.zf = zipfile.ZipFile(archivio)
+
+    def leggi(self, nome):
+        return self.zf.read(nome)
+
+    def chiudi(self):
+        self.zf.close()
+
+
+class _LettoreTar:
+    """
+    Tar letto come stream: i membri vanno chiesti nell'ordine dell'archivio.
+    Se ne viene chiesto uno già superato si riapre l'archivio dall'inizio.
+    """
+
+    def __init__(self, archivio):
+        self.archivio = archivio
+        self.tf = None
+
+    def leggi(self, nome):
+        for _ in range(2):
+            if self.tf is None:
+                self.tf = tarfile.open(self.archivio, 'r|*')
+            info = self.tf.next()
+            while info is not None:
+                if info.name == nome and info.isfile():
+                    return self.tf.extractfile(info).read()
+                info = self.tf.next()
+            self.chiudi()
+        raise KeyError(f"{nome} non trovato in {self.archivio}")
+
+    def chiudi(self):
+        if self.tf is not None:
+            self.tf.close()
+            self.tf = None
+
+
+class _LettoreMemoria:
+    """Membri passati dal processo principale con precarica()"""
+
+    def __init__(self, archivio):
+        self.archivio = archivio
+        self.contenuti = {}
+
+    def leggi(self, nome):
+        dati = self.contenuti.get(nome)
+        if dati is None:
+            raise KeyError(f"{nome} non caricato da {self.archivio}")
+        if isinstance(dati, Exception):
+            raise dati
+        return dati
+
+    def chiudi(self):
+        self.contenuti.clear()
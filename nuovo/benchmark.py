@@ -0,0 +1,229 @@
+"""
+Microbenchmark dei componenti di estrazione.
+Uso: python benchmark.py
+"""
+import base64
+import random
+import time
+import timeit
+import zlib
+from lxml import objectify
+import pandas as pd
+import tag_fatturapa
+from accumulatore import AccumulatoreLinee, converti_date, verifica_data
+import estrai_p7m_python_v2
+from corpus_sintetico import fattura_sintetica, p7m_sintetico, p7m_compresso_sintetico
+from pseudonimi import cifratura, pseudonimi_colonna
+
+
+def _find_child_by_tag_scansione(parent, tag):
+    """Implementazione storica di find_child_by_tag (scansione lineare)"""
+    for child in parent.iterchildren():
+        if child.tag.endswith(tag):
+            return child
+    return None
+
+
+def _lookup_scansione(root):
+    header = _find_child_by_tag_scansione(root, 'FatturaElettronicaHeader')
+    body = _find_child_by_tag_scansione(root, 'FatturaElettronicaBody')
+    cedente = _find_child_by_tag_scansione(header, 'CedentePrestatore')
+    dati_anagrafici = _find_child_by_tag_scansione(cedente, 'DatiAnagrafici')
+    _find_child_by_tag_scansione(dati_anagrafici, 'IdFiscaleIVA')
+    _find_child_by_tag_scansione(cedente, 'Sede')
+    dati_generali = _find_child_by_tag_scansione(body, 'DatiGenerali')
+    _find_child_by_tag_scansione(dati_generali, 'DatiGeneraliDocumento').Data
+    beni_servizi = _find_child_by_tag_scansione(body, 'DatiBeniServizi')
+    return [linea for linea in beni_servizi.iterchildren() if linea.tag.endswith('DettaglioLinee')]
+
+
+def _lookup_xpath(root):
+    namespace = tag_fatturapa.namespace_documento(root)
+    header = tag_fatturapa.trova(root, 'FatturaElettronicaHeader', namespace)
+    body = tag_fatturapa.trova(root, 'FatturaElettronicaBody', namespace)
+    tag_fatturapa.trova(header, tag_fatturapa.CEDENTE_ID_FISCALE, namespace)
+    tag_fatturapa.trova(header, tag_fatturapa.CEDENTE_SEDE, namespace)
+    tag_fatturapa.trova(body, tag_fatturapa.DATA_DOCUMENTO, namespace)
+    return tag_fatturapa.trova_tutti(body, tag_fatturapa.DETTAGLIO_LINEE, namespace)
+
+
+def bench_lookup(n_linee=100, ripetizioni=2000):
+    """Confronta find_child_by_tag (scansione) con le XPath compilate di tag_fatturapa"""
+    root = objectify.fromstring(fattura_sintetica(n_linee))
+    assert len(_lookup_scansione(root)) == len(_lookup_xpath(root)) == n_linee
+    t_scan = timeit.timeit(lambda: _lookup_scansione(root), number=ripetizioni)
+    t_xpath = timeit.timeit(lambda: _lookup_xpath(root), number=ripetizioni)
+    print(f"[lookup] {n_linee} linee, {ripetizioni} documenti")
+    print(f"  find_child_by_tag: {t_scan / ripetizioni * 1e6:8.1f} us/documento")
+    print(f"  tag_fatturapa:     {t_xpath / ripetizioni * 1e6:8.1f} us/documento")
+
+
+def bench_accumulo(n_file=2000, linee_per_file=10):
+    """Confronta list-of-dicts + un DataFrame per file + concat con AccumulatoreLinee"""
+    cedente = ('IT', '01234567890', '40127', 'Bologna', 'BO')
+    data = pd.Timestamp('2023-06-30')
+
+    def dict_e_concat():
+        dfs = []
+        for _ in range(n_file):
+            rows = [dict(zip(
+                ['Data', 'IdPaese', 'IdFiscaleIVA', 'CAP', 'Comune', 'Provincia',
+                 'Descrizione', 'Quantita', 'PrezzoUnitario', 'PrezzoTotale'],
+                (data,) + cedente + (f'Articolo {i}', i, 1.5, 1.5 * i))) for i in range(linee_per_file)]
+            dfs.append(pd.DataFrame(rows))
+        return pd.concat(dfs, ignore_index=True)
+
+    def colonnare():
+        acc = AccumulatoreLinee()
+        for _ in range(n_file):
+            acc.nuova_fattura(data, cedente)
+            for i in range(linee_per_file):
+                acc.aggiungi_linea(f'Articolo {i}', i, 1.5, 1.5 * i)
+        return acc.to_dataframe(compatto=False)
+
+    pd.testing.assert_frame_equal(dict_e_concat(), colonnare())
+    t_dict = timeit.timeit(dict_e_concat, number=1)
+    t_col = timeit.timeit(colonnare, number=1)
+    print(f"[accumulo] {n_file} file x {linee_per_file} linee")
+    print(f"  dict + concat:     {t_dict:8.3f} s")
+    print(f"  AccumulatoreLinee: {t_col:8.3f} s")
+
+
+def bench_p7m(n_linee=200, ripetizioni=200):
+    """Confronta la decodifica CMS diretta con la catena euristica"""
+    xml = fattura_sintetica(n_linee)
+    der = p7m_sintetico(xml)
+    casi = [('DER', der), ('BER/chunk', p7m_sintetico(xml, chunk=1000)), ('base64', base64.encodebytes(der))]
+    print(f"[p7m] fattura di {n_linee} linee")
+    for nome, data in casi:
+        xml_cms = estrai_p7m_python_v2._estrai_xml_da_cms(data)
+        assert xml_cms == xml.decode('utf-8')
+        n = ripetizioni if nome != 'base64' else max(1, ripetizioni // 100)
+        t_cms = timeit.timeit(lambda: estrai_p7m_python_v2._estrai_xml_da_cms(data), number=ripetizioni)
+        t_eur = timeit.timeit(lambda: estrai_p7m_python_v2._estrai_xml_euristico(data, None), number=n)
+        # Sui p7m a chunk le euristiche restituiscono XML con gli header DER in mezzo
+        corretto = estrai_p7m_python_v2._estrai_xml_euristico(data, None) == xml_cms
+        print(f"  {nome:9s} CMS diretto: {t_cms / ripetizioni * 1e3:8.3f} ms/file"
+              f"   euristiche: {t_eur / n * 1e3:8.3f} ms/file"
+              f" ({'XML corretto' if corretto else 'XML corrotto'})")
+
+
+def _bruteforce_compressed_storico(data):
+    """Implementazione storica (quadratica) di _estrai_xml_bruteforce_compressed"""
+    for i in range(len(data)):
+        if data[i:i+2] in [b'\x78\x9c', b'\x78\xda']:
+            for j in range(i + 500, min(i + 500000, len(data))):
+                try:
+                    decompressed = zlib.decompress(data[i:j])
+                    if b'<?xml' in decompressed and b'FatturaElettronica' in decompressed:
+                        return decompressed.decode('utf-8', errors='ignore').strip()
+                except Exception:
+                    continue
+    return None
+
+
+def bench_zlib(n_linee=500):
+    """Tempo di _estrai_xml_bruteforce_compressed, storico vs streaming"""
+    xml = fattura_sintetica(n_linee)
+    print(f"[zlib] fattura di {n_linee} linee")
+    # Il caso piccolo (un solo stream, nessun header falso) è l'unico in cui
+    # l'implementazione storica termina in tempi ragionevoli
+    rng = random.Random(0)
+    piccolo = rng.randbytes(64) + zlib.compress(xml) + rng.randbytes(64)
+    inizio = time.perf_counter()
+    assert _bruteforce_compressed_storico(piccolo)
+    t_storico = time.perf_counter() - inizio
+    inizio = time.perf_counter()
+    assert estrai_p7m_python_v2._estrai_xml_bruteforce_compressed(piccolo)
+    t_stream = time.perf_counter() - inizio
+    print(f"  {len(piccolo) / 1024:7.1f} KB  storico: {t_storico:8.3f} s   streaming: {t_stream:8.4f} s")
+    grande = p7m_compresso_sintetico(xml)
+    inizio = time.perf_counter()
+    trovato = estrai_p7m_python_v2._estrai_xml_bruteforce_compressed(grande)
+    t_stream = time.perf_counter() - inizio
+    esito = 'XML trovato' if trovato == xml.decode('utf-8') else 'XML non trovato'
+    print(f"  {len(grande) / 1024:7.1f} KB  streaming: {t_stream:8.3f} s ({esito})")
+
+
+def bench_memoria(n_fatture=20000, linee_per_fattura=20, n_cedenti=300, n_articoli=2000):
+    """Memoria del DataFrame delle linee: schema object/int64 contro schema compatto"""
+    rng = random.Random(0)
+    comuni = [('40127', 'Bologna', 'BO'), ('20121', 'Milano', 'MI'), ('00184', 'Roma', 'RM')]
+    cedenti = [('IT', f'{rng.randrange(10 ** 11):011d}') + rng.choice(comuni) for _ in range(n_cedenti)]
+    articoli = [f'Articolo {i} - descrizione del bene o servizio' for i in range(n_articoli)]
+    acc = AccumulatoreLinee()
+    for _ in range(n_fatture):
+        acc.nuova_fattura(pd.Timestamp('2023-06-30'), rng.choice(cedenti))
+        for _ in range(linee_per_fattura):
+            acc.aggiungi_linea(rng.choice(articoli), rng.randrange(1, 100), 1.5, 1.5)
+
+    t0 = time.perf_counter()
+    df_object = acc.to_dataframe(compatto=False)
+    t_object = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    df_compatto = acc.to_dataframe()
+    t_compatto = time.perf_counter() - t0
+    pd.testing.assert_frame_equal(df_object, df_compatto, check_dtype=False, check_categorical=False)
+    mb_object = df_object.memory_usage(deep=True).sum() / 2 ** 20
+    mb_compatto = df_compatto.memory_usage(deep=True).sum() / 2 ** 20
+    print(f"[memoria] {len(acc)} linee, {n_cedenti} cedenti, {n_articoli} descrizioni distinte")
+    print(f"  object/int64:    {mb_object:8.1f} MB  costruzione {t_object:6.3f} s")
+    print(f"  schema compatto: {mb_compatto:8.1f} MB  costruzione {t_compatto:6.3f} s")
+
+
+def bench_date(n_fatture=20000):
+    """Date delle fatture: pd.to_datetime per fattura contro stringhe ISO convertite una volta"""
+    rng = random.Random(0)
+    testi = [f'20{rng.randrange(18, 25)}-{rng.randrange(1, 13):02d}-{rng.randrange(1, 29):02d}'
+             for _ in range(n_fatture)]
+
+    def per_fattura():
+        # Come prima: un Timestamp per fattura, poi la colonna costruita dai Timestamp
+        return pd.to_datetime(pd.Series([pd.to_datetime(t) for t in testi])).to_numpy()
+
+    def differita():
+        # Verifica per fattura (in nuova_fattura), conversione una volta sola
+        for t in testi:
+            verifica_data(t)
+        return converti_date(testi)
+
+    assert (per_fattura() == differita()).all()
+    t_prima = timeit.timeit(per_fattura, number=1)
+    t_dopo = timeit.timeit(differita, number=1)
+    print(f"[date] {n_fatture} fatture")
+    print(f"  to_datetime per fattura: {t_prima:8.3f} s  ({t_prima / n_fatture * 1e6:6.1f} us/fattura)")
+    print(f"  conversione differita:   {t_dopo:8.3f} s  ({t_dopo / n_fatture * 1e6:6.1f} us/fattura)")
+
+
+def bench_pseudonimi(n_righe=200000, n_cedenti=500, n_file=20):
+    """Confronta apply(cifratura) riga per riga con pseudonimi_colonna (unici + memo)"""
+    rng = random.Random(0)
+    partite_iva = [f'{rng.randrange(10 ** 11):011d}' for _ in range(n_cedenti)]
+    file = [pd.Series([rng.choice(partite_iva) for _ in range(n_righe // n_file)], dtype=object)
+            for _ in range(n_file)]
+
+    def riga_per_riga():
+        return [s.apply(lambda x: cifratura(x)).to_numpy() for s in file]
+
+    def unici_e_memo():
+        memo = {}
+        return [pseudonimi_colonna(s, memo)[0] for s in file]
+
+    for a, b in zip(riga_per_riga(), unici_e_memo()):
+        assert (a == b).all()
+    t_riga = timeit.timeit(riga_per_riga, number=1)
+    t_unici = timeit.timeit(unici_e_memo, number=1)
+    print(f"[pseudonimi] {n_righe} righe, {n_cedenti} cedenti, {n_file} file")
+    print(f"  apply(cifratura):    {t_riga:8.3f} s")
+    print(f"  pseudonimi_colonna:  {t_unici:8.3f} s")
+
+
+if __name__ == "__main__":
+    bench_lookup(n_linee=10)
+    bench_lookup(n_linee=1000, ripetizioni=200)
+    bench_accumulo()
+    bench_p7m()
+    bench_zlib()
+    bench_memoria()
+    bench_date()
+    bench_pseudonimi()
@@ -0,0 +1,232 @@
+"""
+Benchmark della pipeline su un corpus sintetico (vedi corpus_sintetico.py).
+Per ogni stadio e per ogni strategia di estrazione dei p7m (CMS, catena
+euristica, auto e ciascun approccio euristico da solo) riporta file/s,
+linee/s e picco RSS. Ogni stadio gira in un processo separato, così il picco
+di RSS è solo il suo; gli import sono fuori dal tempo misurato.
+Uso: python benchmark_pipeline.py [--file N] [--cartella DIR] [--workers N] [--json FILE]
+"""
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # Windows: picco RSS non disponibile
+    resource = None
+
+CARTELLA_NUOVO = os.path.dirname(os.path.abspath(__file__))
+CARTELLA_RADICE = os.path.dirname(CARTELLA_NUOVO)
+
+
+def picco_rss_mb():
+    """Picco di RSS del processo (e dei figli già terminati) in MB, None se non misurabile"""
+    if resource is None:
+        return None
+    picco = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # ru_maxrss è in KB su Linux e in byte su macOS
+    return picco / (1024 * 1024) if sys.platform == 'darwin' else picco / 1024
+
+
+def _file(cartella, sottocartella, estensione):
+    return sorted(glob.glob(os.path.join(cartella, sottocartella, f'*.{estensione}')))
+
+
+# Ogni stadio è una funzione (cartella, workers) che importa ciò che serve e
+# restituisce la funzione da cronometrare; questa restituisce (file, linee, ok).
+
+# Approcci di estrai_p7m_python_v2.approcci_euristici, misurati uno per uno
+EURISTICHE = ('binario', 'testo', 'asn1', 'generico', 'asn1crypto',
+              'bruteforce_binario', 'bruteforce_zlib', 'bruteforce_base64')
+
+
+def _esegui_estrazione(estrai, paths):
+    """Funzione da cronometrare: estrai(data) su ogni p7m; ok = file da cui è uscito un XML"""
+    def esegui():
+        linee = ok = 0
+        for path in paths:
+            with open(path, 'rb') as f:
+                data = f.read()
+            try:
+                xml = estrai(data)
+            except Exception:
+                xml = None
+            if xml:
+                ok += 1
+                linee += xml.count('<DettaglioLinee>')
+        return len(paths), linee, ok
+    return esegui
+
+
+def _estrazione(strategia):
+    def prepara(cartella, workers):
+        import estrai_p7m_python_v2
+        estrai = {
+            'cms': estrai_p7m_python_v2._estrai_xml_da_cms,
+            'euristiche': lambda data: estrai_p7m_python_v2._estrai_xml_euristico(data, None),
+            'auto': estrai_p7m_python_v2.estrai_xml_da_p7m_bytes,
+        }[strategia]
+        return _esegui_estrazione(estrai, _file(cartella, 'p7m', 'p7m'))
+    return prepara
+
+
+def _euristica(nome):
+    """Un solo approccio euristico su ogni p7m, anche dove uno precedente basterebbe"""
+    def prepara(cartella, workers):
+        import estrai_p7m_python_v2
+
+        def estrai(data):
+            # La scansione dei marcatori è condivisa dagli approcci: conta nel tempo di ciascuno
+            marcatori = estrai_p7m_python_v2.scansiona_marcatori(data)
+            return dict(estrai_p7m_python_v2.approcci_euristici(data, None, marcatori))[nome]()
+        return _esegui_estrazione(estrai, _file(cartella, 'p7m', 'p7m'))
+    return prepara
+
+
+def _parsing(engine):
+    def prepara(cartella, workers):
+        import creazione_df
+        paths = _file(cartella, 'xml', 'xml')
+
+        def esegui():
+            linee = sum(len(creazione_df.dataframe_linee_da_xml(path, engine=engine)) for path in paths)
+            return len(paths), linee, len(paths)
+        return esegui
+    return prepara
+
+
+def _batch(parallelo):
+    def prepara(cartella, workers):
+        import creazione_df
+        cartelle = [os.path.join(cartella, sottocartella) for sottocartella in ('xml', 'p7m')]
+        n_file = sum(len(creazione_df.file_batch(c)) for c in cartelle)
+
+        def esegui():
+            linee = sum(len(creazione_df.dataframe_linee_batch(c, workers=workers if parallelo else None))
+                        for c in cartelle)
+            return n_file, linee, n_file
+        return esegui
+    return prepara
+
+
+def _anonimizzazione_a_blocchi(cartella, workers):
+    """iter_linee -> anonimizza_fattura -> CSV, come nuovo/Anonimizzazione.py"""
+    import creazione_df
+    from Anonimizzazione import anonimizza_fattura
+    cartelle = [os.path.join(cartella, sottocartella) for sottocartella in ('xml', 'p7m')]
+    n_file = sum(len(creazione_df.file_batch(c)) for c in cartelle)
+
+    def esegui():
+        linee = 0
+        with tempfile.TemporaryDirectory() as uscita:
+            output_csv = os.path.join(uscita, 'linee.csv')
+            for c in cartelle:
+                for df in creazione_df.iter_linee(c):
+                    df_anon, _ = anonimizza_fattura(df, copia=False)
+                    df_anon.to_csv(output_csv, mode='a', header=not linee, index=False)
+                    linee += len(df_anon)
+        return n_file, linee, n_file
+    return esegui
+
+
+def _xml_tocsvs(cartella, workers):
+    """Script nella radice: ha moduli omonimi di quelli di nuovo/, quindi cambia sys.path"""
+    sys.path.remove(CARTELLA_NUOVO)
+    sys.path.insert(0, CARTELLA_RADICE)
+    import Anonimizzazione
+    paths = _file(cartella, 'xml', 'xml')
+
+    def esegui():
+        with tempfile.TemporaryDirectory() as uscita:
+            Anonimizzazione.xml_tocsvs(os.path.join(cartella, 'xml'), uscita)
+            linee = 0
+            for path in glob.glob(os.path.join(uscita, '*.csv')):
+                if os.path.basename(path) == 'cifratura.csv':
+                    continue  # pseudonimi esportati, non linee
+                with open(path) as f:
+                    linee += sum(1 for _ in f) - 1
+        return len(paths), linee, len(paths)
+    return esegui
+
+
+STADI = {
+    'p7m cms': _estrazione('cms'),
+    'p7m euristiche': _estrazione('euristiche'),
+    'p7m auto': _estrazione('auto'),
+    **{f'p7m {nome}': _euristica(nome) for nome in EURISTICHE},
+    'parsing objectify': _parsing('objectify'),
+    'parsing iterparse': _parsing('iterparse'),
+    'batch seriale': _batch(False),
+    'batch parallelo': _batch(True),
+    'iter_linee + anonimizzazione': _anonimizzazione_a_blocchi,
+    'xml_tocsvs (radice)': _xml_tocsvs,
+}
+
+
+def esegui_stadio(nome, cartella, workers):
+    """Eseguita nel processo figlio: misura lo stadio e restituisce il risultato"""
+    esegui = STADI[nome](cartella, workers)
+    rss_base = picco_rss_mb()
+    inizio = time.perf_counter()
+    n_file, linee, ok = esegui()
+    secondi = time.perf_counter() - inizio
+    return {'stadio': nome, 'secondi': secondi, 'file': n_file, 'linee': linee, 'ok': ok,
+            'file_s': n_file / secondi if secondi else 0.0,
+            'linee_s': linee / secondi if secondi else 0.0,
+            'rss_base_mb': rss_base, 'picco_rss_mb': picco_rss_mb()}
+
+
+def esegui_benchmark(cartella, workers, stadi=None):
+    """Lancia ogni stadio in un nuovo interprete e raccoglie i risultati"""
+    risultati = []
+    for nome in stadi or STADI:
+        esito = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--stadio', nome,
+             '--cartella', cartella, '--workers', str(workers)],
+            capture_output=True, text=True)
+        if esito.returncode != 0:
+            print(f"Errore su {nome}: {esito.stderr.strip().splitlines()[-1:]}")
+            continue
+        risultati.append(json.loads(esito.stdout.strip().splitlines()[-1]))
+    return risultati
+
+
+def stampa_risultati(risultati):
+    """Tabella dei risultati; RSS base = dopo gli import, prima dello stadio"""
+    print(f"{'stadio':30s} {'file':>6s} {'ok':>6s} {'linee':>8s} {'s':>8s} {'file/s':>9s} {'linee/s':>10s}"
+          f" {'RSS base':>9s} {'RSS picco':>9s}")
+    for r in risultati:
+        rss = ' '.join(f"{r[k]:9.1f}" if r[k] is not None else f"{'n/d':>9s}"
+                       for k in ('rss_base_mb', 'picco_rss_mb'))
+        print(f"{r['stadio']:30s} {r['file']:6d} {r['ok']:6d} {r['linee']:8d} {r['secondi']:8.3f} "
+              f"{r['file_s']:9.1f} {r['linee_s']:10.0f} {rss}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cartella', help="corpus da usare o in cui generarlo (default: cartella temporanea)")
+    parser.add_argument('--file', type=int, default=500, help="fatture da generare se il corpus non esiste")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--json', help="salva i risultati anche in questo file")
+    parser.add_argument('--stadio', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stadio:
+        print(json.dumps(esegui_stadio(args.stadio, args.cartella, args.workers)))
+        sys.exit(0)
+
+    from corpus_sintetico import genera_corpus
+    cartella = args.cartella or tempfile.mkdtemp(prefix='corpus_fatture_')
+    if not _file(cartella, 'xml', 'xml') and not _file(cartella, 'p7m', 'p7m'):
+        print(f"Corpus generato in {cartella}: {genera_corpus(cartella, args.file)}")
+    risultati = esegui_benchmark(cartella, args.workers)
+    stampa_risultati(risultati)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(risultati, f, indent=4)
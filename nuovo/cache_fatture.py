@@ -0,0 +1,125 @@
+"""
+Cache su disco, indirizzata per contenuto, dell'XML estratto e delle righe
+già parsate di ogni fattura. La chiave è lo SHA-256 del file di input, quindi
+lo stesso file (anche rinominato o spostato) viene estratto e parsato una
+volta sola. Le voci salvate con una versione del parser diversa da quella
+richiesta sono considerate scadute.
+"""
+import hashlib
+import pickle
+import sqlite3
+import time
+
+from connessione_sqlite import connetti
+
+
+def hash_contenuto(data):
+    """Chiave di cache: SHA-256 esadecimale dei byte del file"""
+    return hashlib.sha256(data).hexdigest()
+
+
+class CacheFatture:
+    """
+    Cache SQLite con limite di dimensione (max_byte) ed eviction LRU.
+    Può essere passata ai worker di dataframe_linee_batch: viene serializzata
+    come percorso + parametri e ogni processo apre la sua connessione.
+    """
+
+    def __init__(self, percorso, max_byte=1024 * 1024 * 1024):
+        self.percorso = str(percorso)
+        self.max_byte = max_byte
+        self._conn = None
+
+    def __getstate__(self):
+        return {'percorso': self.percorso, 'max_byte': self.max_byte}
+
+    def __setstate__(self, stato):
+        self.__init__(stato['percorso'], stato['max_byte'])
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = connetti(self.percorso, """
+                CREATE TABLE IF NOT EXISTS voci (
+                    chiave TEXT PRIMARY KEY,
+                    versione INTEGER NOT NULL,
+                    xml BLOB,
+                    righe BLOB NOT NULL,
+                    dimensione INTEGER NOT NULL,
+                    ultimo_accesso REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS voci_lru ON voci (ultimo_accesso);
+                CREATE TABLE IF NOT EXISTS totale (id INTEGER PRIMARY KEY CHECK (id = 0), byte INTEGER NOT NULL);
+                INSERT OR IGNORE INTO totale VALUES (0, 0);
+            """, wal=True, timeout=60)
+        return self._conn
+
+    def chiudi(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def leggi(self, chiave, versione):
+        """
+        Restituisce (xml_bytes, righe) per la chiave, o None se assente o salvata
+        con un'altra versione del parser (in quel caso la voce viene rimossa).
+        `righe` è l'oggetto passato a salva() (un AccumulatoreLinee).
+        """
+        riga = self.conn.execute(
+            "SELECT versione, xml, righe FROM voci WHERE chiave = ?", (chiave,)).fetchone()
+        if riga is None:
+            return None
+        if riga[0] != versione:
+            self._rimuovi(chiave)
+            return None
+        with self.conn:
+            self.conn.execute("UPDATE voci SET ultimo_accesso = ? WHERE chiave = ?", (time.time(), chiave))
+        return riga[1], pickle.loads(riga[2])
+
+    def salva(self, chiave, versione, xml_bytes, righe):
+        """Salva XML estratto (None per i file già XML) e righe parsate, poi applica il limite"""
+        blob = pickle.dumps(righe, protocol=pickle.HIGHEST_PROTOCOL)
+        dimensione = len(blob) + (len(xml_bytes) if xml_bytes else 0)
+        if dimensione > self.max_byte:
+            return
+        self._rimuovi(chiave)
+        try:
+            with self.conn:
+                self.conn.execute(
+                    "INSERT INTO voci VALUES (?, ?, ?, ?, ?, ?)",
+                    (chiave, versione, xml_bytes, blob, dimensione, time.time()))
+                self.conn.execute("UPDATE totale SET byte = byte + ?", (dimensione,))
+        except sqlite3.IntegrityError:
+            # Stesso file salvato nel frattempo da un altro worker
+            return
+        self._applica_limite()
+
+    def _rimuovi(self, chiave):
+        with self.conn:
+            riga = self.conn.execute("SELECT dimensione FROM voci WHERE chiave = ?", (chiave,)).fetchone()
+            if riga is not None and self.conn.execute(
+                    "DELETE FROM voci WHERE chiave = ?", (chiave,)).rowcount:
+                self.conn.execute("UPDATE totale SET byte = byte - ?", (riga[0],))
+
+    def dimensione_totale(self):
+        return self.conn.execute("SELECT byte FROM totale").fetchone()[0]
+
+    def _applica_limite(self):
+        """Elimina le voci usate meno di recente finché la cache supera max_byte"""
+        eccesso = self.dimensione_totale() - self.max_byte
+        if eccesso <= 0:
+            return
+        vittime = []
+        for chiave, dimensione in self.conn.execute(
+                "SELECT chiave, dimensione FROM voci ORDER BY ultimo_accesso"):
+            vittime.append((chiave, dimensione))
+            eccesso -= dimensione
+            if eccesso <= 0:
+                break
+        with self.conn:
+            # Un altro processo può averle già eliminate: si scala solo ciò che si cancella davvero
+            liberati = 0
+            for chiave, dimensione in vittime:
+                if self.conn.execute("DELETE FROM voci WHERE chiave = ?", (chiave,)).rowcount:
+                    liberati += dimensione
+            self.conn.execute("UPDATE totale SET byte = byte - ?", (liberati,))
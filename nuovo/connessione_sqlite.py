@@ -0,0 +1,25 @@
+"""
+Apertura dei database SQLite locali (manifest, registro pseudonimi, cache,
+indice dei duplicati, aggregati): crea la cartella se manca, apre la
+connessione e crea lo schema se il file è nuovo.
+"""
+import os
+import sqlite3
+
+
+def connetti(percorso, schema, wal=False, timeout=5.0):
+    """
+    Connessione a `percorso` con le istruzioni di `schema` già eseguite
+    (CREATE ... IF NOT EXISTS). wal=True attiva il journal WAL, per i
+    database scritti da più processi worker insieme; in quel caso conviene
+    anche un timeout lungo per l'attesa dei lock.
+    """
+    percorso = str(percorso)
+    cartella = os.path.dirname(percorso)
+    if cartella:
+        os.makedirs(cartella, exist_ok=True)
+    conn = sqlite3.connect(percorso, timeout=timeout)
+    if wal:
+        conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(schema)
+    return conn
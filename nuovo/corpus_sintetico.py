@@ -0,0 +1,160 @@
+"""
+Generatore deterministico di fatture FatturaPA sintetiche e delle loro buste
+p7m (DER, BER a chunk, base64, PEM), per benchmark e prove di regressione.
+A parità di parametri e seed produce sempre gli stessi byte.
+Uso: python corpus_sintetico.py <cartella> [n_file]
+"""
+import base64
+import os
+import random
+import sys
+import zlib
+
+NS_FATTURA = 'http://ivaservizi.agenziaentrate.gov.it/docs/xsd/fatture/v1.2'
+
+# Buste p7m viste in produzione: DER, BER con eContent a chunk, base64 a righe, PEM
+FORMATI_P7M = ('der', 'ber', 'base64', 'pem')
+# Prefissi del namespace: None = namespace di default (xmlns="...")
+PREFISSI = ('p', 'ns2', 'ns3', None)
+
+_COMUNI = [('40127', 'Bologna', 'BO'), ('20121', 'Milano', 'MI'), ('00184', 'Roma', 'RM'),
+           ('10121', 'Torino', 'TO'), ('80133', 'Napoli', 'NA'), ('50122', 'Firenze', 'FI')]
+_CESSIONARI = ['RSSMRA80A01H501U', 'BNCLRA80A01H501U', 'VRDGPP75C12F205X']
+
+CEDENTE_DEFAULT = ('01234567890', '40127', 'Bologna', 'BO')
+
+
+def cedenti_sintetici(n, seed=0):
+    """n cedenti (IdCodice, CAP, Comune, Provincia) distinti"""
+    rng = random.Random(seed)
+    codici = rng.sample(range(10 ** 10, 10 ** 11), n)
+    return [(f'{codice:011d}',) + rng.choice(_COMUNI) for codice in codici]
+
+
+def fattura_sintetica(n_linee=100, cedente=CEDENTE_DEFAULT, cessionario='RSSMRA80A01H501U',
+                      data='2023-06-30', numero=1, prefisso='p'):
+    """XML FatturaPA minimale con n_linee DettaglioLinee"""
+    id_codice, cap, comune, provincia = cedente
+    linee = ''.join(
+        f'<DettaglioLinee><NumeroLinea>{i}</NumeroLinea><Descrizione>Articolo {i}</Descrizione>'
+        f'<Quantita>{i % 7 + 1}.00</Quantita><PrezzoUnitario>1.50</PrezzoUnitario>'
+        f'<PrezzoTotale>{(i % 7 + 1) * 1.5:.2f}</PrezzoTotale><AliquotaIVA>22.00</AliquotaIVA></DettaglioLinee>'
+        for i in range(1, n_linee + 1)
+    )
+    if prefisso:
+        radice, dichiarazione = f'{prefisso}:FatturaElettronica', f'xmlns:{prefisso}="{NS_FATTURA}"'
+    else:
+        radice, dichiarazione = 'FatturaElettronica', f'xmlns="{NS_FATTURA}"'
+    return (
+        f'<?xml version="1.0" encoding="UTF-8"?>'
+        f'<{radice} versione="FPR12" {dichiarazione}>'
+        f'<FatturaElettronicaHeader>'
+        f'<DatiTrasmissione><IdTrasmittente><IdPaese>IT</IdPaese><IdCodice>{id_codice}</IdCodice></IdTrasmittente></DatiTrasmissione>'
+        f'<CedentePrestatore><DatiAnagrafici><IdFiscaleIVA><IdPaese>IT</IdPaese><IdCodice>{id_codice}</IdCodice></IdFiscaleIVA>'
+        f'<Anagrafica><Denominazione>Fornitore</Denominazione></Anagrafica><RegimeFiscale>RF01</RegimeFiscale></DatiAnagrafici>'
+        f'<Sede><Indirizzo>Via Roma 1</Indirizzo><CAP>{cap}</CAP><Comune>{comune}</Comune><Provincia>{provincia}</Provincia><Nazione>IT</Nazione></Sede></CedentePrestatore>'
+        f'<CessionarioCommittente><DatiAnagrafici><CodiceFiscale>{cessionario}</CodiceFiscale></DatiAnagrafici></CessionarioCommittente>'
+        f'</FatturaElettronicaHeader>'
+        f'<FatturaElettronicaBody><DatiGenerali><DatiGeneraliDocumento><TipoDocumento>TD01</TipoDocumento>'
+        f'<Divisa>EUR</Divisa><Data>{data}</Data><Numero>{numero}</Numero></DatiGeneraliDocumento></DatiGenerali>'
+        f'<DatiBeniServizi>{linee}</DatiBeniServizi></FatturaElettronicaBody>'
+        f'</{radice}>'
+    ).encode('utf-8')
+
+
+def _der(tag, contenuto):
+    """Elemento DER con lunghezza definita"""
+    n = len(contenuto)
+    if n < 0x80:
+        lunghezza = bytes([n])
+    else:
+        byte_lunghezza = n.to_bytes((n.bit_length() + 7) // 8, 'big')
+        lunghezza = bytes([0x80 | len(byte_lunghezza)]) + byte_lunghezza
+    return bytes([tag]) + lunghezza + contenuto
+
+
+def p7m_sintetico(xml, dimensione_firma=4000, chunk=None, seed=0):
+    """
+    Busta CMS SignedData DER con l'XML in eContent e certificati/firma fittizi.
+    Con chunk=N l'eContent è un OCTET STRING costruito BER a lunghezza
+    indefinita, spezzato in pezzi da N byte (come fanno molti software di firma).
+    """
+    rng = random.Random(seed)
+    oid_signed_data = _der(0x06, bytes.fromhex('2a864886f70d010702'))
+    oid_data = _der(0x06, bytes.fromhex('2a864886f70d010701'))
+    oid_sha256 = _der(0x30, _der(0x06, bytes.fromhex('608648016503040201')))
+    if chunk:
+        pezzi = b''.join(_der(0x04, xml[i:i + chunk]) for i in range(0, len(xml), chunk))
+        e_content = b'\x24\x80' + pezzi + b'\x00\x00'
+    else:
+        e_content = _der(0x04, xml)
+    encap = _der(0x30, oid_data + _der(0xA0, e_content))
+    certificati = _der(0xA0, _der(0x30, rng.randbytes(dimensione_firma)))
+    signer_infos = _der(0x31, _der(0x30, _der(0x02, b'\x01') + rng.randbytes(dimensione_firma // 4)))
+    signed_data = _der(0x30, _der(0x02, b'\x01') + _der(0x31, oid_sha256) + encap + certificati + signer_infos)
+    return _der(0x30, oid_signed_data + _der(0xA0, signed_data))
+
+
+def busta_p7m(xml, formato='der', seed=0):
+    """p7m nel formato indicato (vedi FORMATI_P7M)"""
+    if formato == 'der':
+        return p7m_sintetico(xml, seed=seed)
+    if formato == 'ber':
+        return p7m_sintetico(xml, chunk=1000, seed=seed)
+    der = p7m_sintetico(xml, seed=seed)
+    if formato == 'base64':
+        return base64.encodebytes(der)
+    if formato == 'pem':
+        return b'-----BEGIN PKCS7-----\n' + base64.encodebytes(der) + b'-----END PKCS7-----\n'
+    raise ValueError(f"Formato p7m non supportato: {formato}")
+
+
+def p7m_compresso_sintetico(xml, dimensione=2 * 1024 * 1024, falsi_header=2000, seed=0):
+    """
+    Dati binari casuali di circa `dimensione` byte con molti header zlib falsi
+    e, in fondo, l'XML compresso con zlib: il caso peggiore per la ricerca a forza bruta.
+    """
+    rnd = random.Random(seed)
+    dati = bytearray(rnd.randbytes(dimensione))
+    for _ in range(falsi_header):
+        pos = rnd.randrange(len(dati) - 2)
+        dati[pos:pos + 2] = rnd.choice([b'\x78\x9c', b'\x78\xda'])
+    return bytes(dati) + zlib.compress(xml) + rnd.randbytes(256)
+
+
+def genera_corpus(cartella, n_file=200, linee=(1, 50), n_cedenti=20, prefissi=PREFISSI,
+                  formati_p7m=FORMATI_P7M, quota_p7m=0.5, seed=0):
+    """
+    Scrive in `cartella`/xml le fatture in chiaro e in `cartella`/p7m quelle
+    firmate (circa quota_p7m del totale, a rotazione sui formati_p7m).
+    Numero di linee per fattura casuale in [linee[0], linee[1]].
+    Restituisce un dict con il numero di file e di linee per sottocartella.
+    """
+    rng = random.Random(seed)
+    cedenti = cedenti_sintetici(n_cedenti, seed)
+    conteggi = {'xml': [0, 0], 'p7m': [0, 0]}
+    for sottocartella in conteggi:
+        os.makedirs(os.path.join(cartella, sottocartella), exist_ok=True)
+    for numero in range(1, n_file + 1):
+        cedente = rng.choice(cedenti)
+        n_linee = rng.randint(*linee)
+        data = f'20{rng.randrange(21, 25)}-{rng.randrange(1, 13):02d}-{rng.randrange(1, 29):02d}'
+        xml = fattura_sintetica(n_linee, cedente, rng.choice(_CESSIONARI), data, numero,
+                                rng.choice(prefissi))
+        nome = f'IT{cedente[0]}_{numero:05d}.xml'
+        if formati_p7m and rng.random() < quota_p7m:
+            formato = formati_p7m[conteggi['p7m'][0] % len(formati_p7m)]
+            sottocartella, nome, contenuto = 'p7m', nome + '.p7m', busta_p7m(xml, formato, seed + numero)
+        else:
+            sottocartella, contenuto = 'xml', xml
+        with open(os.path.join(cartella, sottocartella, nome), 'wb') as f:
+            f.write(contenuto)
+        conteggi[sottocartella][0] += 1
+        conteggi[sottocartella][1] += n_linee
+    return {nome: {'file': n, 'linee': righe} for nome, (n, righe) in conteggi.items()}
+
+
+if __name__ == "__main__":
+    cartella = sys.argv[1] if len(sys.argv) > 1 else 'corpus_sintetico'
+    n_file = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    print(genera_corpus(cartella, n_file))
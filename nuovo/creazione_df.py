@@ -1,105 +1,573 @@
-from lxml import objectify
+from lxml import objectify, etree
 import pandas as pd
+import io
+import mmap
 import os
-from estrai_p7m_python_v2 import estrai_xml_da_p7m_python_v2
+from estrai_p7m_python_v2 import estrai_xml_bytes_da_p7m, _chiudi_mappa
 import glob
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from collections import deque
+import archivi
+import tag_fatturapa
+import strumentazione
+from accumulatore import AccumulatoreLinee
+from cache_fatture import hash_contenuto
+from indice_duplicati import identita_fattura
+
+# Da incrementare quando cambia l'output di estrazione/parsing:
+# invalida le voci della CacheFatture salvate con la versione precedente
+VERSIONE_PARSER = 5
 
 def find_child_by_tag(parent, tag):
-    for child in parent.iterchildren():
-        if child.tag.endswith(tag):
-            return child
-    return None
+    """Primo figlio con nome locale `tag` (vedi tag_fatturapa.trova)"""
+    return tag_fatturapa.trova(parent, tag)
+
+def find_all_children_by_tag(parent, tag):
+    return tag_fatturapa.trova_tutti(parent, tag)
 
-def get_cedente_info(header):
-    cedente = find_child_by_tag(header, 'CedentePrestatore')
-    dati_anagrafici = find_child_by_tag(cedente, 'DatiAnagrafici')
-    id_fiscale_iva = find_child_by_tag(dati_anagrafici, 'IdFiscaleIVA')
-    id_paese = str(id_fiscale_iva.IdPaese) if id_fiscale_iva is not None else ''
-    id_codice = str(id_fiscale_iva.IdCodice) if id_fiscale_iva is not None else ''
-    sede = find_child_by_tag(cedente, 'Sede')
-    cap = str(sede.CAP) if sede is not None and hasattr(sede, 'CAP') else ''
-    comune = str(sede.Comune) if sede is not None and hasattr(sede, 'Comune') else ''
-    provincia = str(sede.Provincia) if sede is not None and hasattr(sede, 'Provincia') else ''
+def get_cedente_info(header, namespace=None):
+    id_fiscale_iva = tag_fatturapa.trova(header, tag_fatturapa.CEDENTE_ID_FISCALE, namespace)
+    # Usa .text per preservare zeri iniziali (str() su objectify li perde)
+    id_paese = id_fiscale_iva.IdPaese.text if id_fiscale_iva is not None else ''
+    id_codice = id_fiscale_iva.IdCodice.text if id_fiscale_iva is not None else ''
+    sede = tag_fatturapa.trova(header, tag_fatturapa.CEDENTE_SEDE, namespace)
+    cap = sede.CAP.text if sede is not None and hasattr(sede, 'CAP') else ''
+    comune = sede.Comune.text if sede is not None and hasattr(sede, 'Comune') else ''
+    provincia = sede.Provincia.text if sede is not None and hasattr(sede, 'Provincia') else ''
     return id_paese, id_codice, cap, comune, provincia
 
-def get_data_fattura(body):
-    dati_generali = find_child_by_tag(body, 'DatiGenerali')
-    dati_doc = find_child_by_tag(dati_generali, 'DatiGeneraliDocumento')
-    return pd.to_datetime(str(dati_doc.Data))
+def testo_data_fattura(body, namespace=None):
+    """
+    Data del documento come stringa ISO (AAAA-MM-GG), senza convertirla:
+    AccumulatoreLinee converte tutte le date del batch in un colpo solo.
+    """
+    data = tag_fatturapa.trova(body, tag_fatturapa.DATA_DOCUMENTO, namespace)
+    if data is None:
+        raise AttributeError("DatiGeneraliDocumento senza Data")
+    return data.text
 
-def get_linee_dettaglio(body, cedente_info, data_fattura):
-    beni_servizi = find_child_by_tag(body, 'DatiBeniServizi')
+def get_data_fattura(body, namespace=None):
+    return pd.to_datetime(testo_data_fattura(body, namespace))
+
+def _valori_linea(linea):
+    """(Descrizione, Quantita, PrezzoUnitario, PrezzoTotale) di una DettaglioLinee objectify"""
+    #  controllare se esiste il tag quantita
+    if not hasattr(linea, 'Quantita') or linea.Quantita is None:
+        linea.Quantita = -1
+    return (
+        linea.Descrizione.text,
+        int(float(linea.Quantita)),
+        float(linea.PrezzoUnitario),
+        float(linea.PrezzoTotale),
+        # int(linea.AliquotaIVA)
+    )
+
+def get_linee_dettaglio(body, cedente_info, data_fattura, namespace=None):
     id_paese, id_codice, cap, comune, provincia = cedente_info
     rows = []
-    for linea in beni_servizi.iterchildren():
-        if linea.tag.endswith('DettaglioLinee'):
-            #  controllare se esiste il tag quantita
-            if not hasattr(linea, 'Quantita') or linea.Quantita is None:
-                linea.Quantita = -1
-            row = {
-                'Data': data_fattura,
-                'IdPaese': id_paese,
-                'IdFiscaleIVA': id_codice,
-                'CAP': cap,
-                'Comune': comune,
-                'Provincia': provincia,
-                'Descrizione': str(linea.Descrizione),
-                'Quantita': int(float(linea.Quantita)) if int(float(linea.Quantita)) is not None else -1 ,
-                'PrezzoUnitario': float(linea.PrezzoUnitario),
-                'PrezzoTotale': float(linea.PrezzoTotale),
-                # 'AliquotaIVA': int(linea.AliquotaIVA)
-            }
-            rows.append(row)
+    for linea in tag_fatturapa.trova_tutti(body, tag_fatturapa.DETTAGLIO_LINEE, namespace):
+        descrizione, quantita, prezzo_unitario, prezzo_totale = _valori_linea(linea)
+        row = {
+            'Data': data_fattura,
+            'IdPaese': id_paese,
+            'IdFiscaleIVA': id_codice,
+            'CAP': cap,
+            'Comune': comune,
+            'Provincia': provincia,
+            'Descrizione': descrizione,
+            'Quantita': quantita,
+            'PrezzoUnitario': prezzo_unitario,
+            'PrezzoTotale': prezzo_totale,
+        }
+        rows.append(row)
     return rows
 
-def dataframe_linee_da_xml(path):
-    xml = objectify.parse(open(path))
-    root = xml.getroot()
-    header = find_child_by_tag(root, 'FatturaElettronicaHeader')
-    body = find_child_by_tag(root, 'FatturaElettronicaBody')
-    cedente_info = get_cedente_info(header)
-    data_fattura = get_data_fattura(body)
-    rows = get_linee_dettaglio(body, cedente_info, data_fattura)
-    return pd.DataFrame(rows)
+def accumula_linee_da_xml(path, acc, engine='objectify'):
+    """
+    Aggiunge all'AccumulatoreLinee `acc` le linee di dettaglio di un file XML FatturaPA.
+    `path` può essere un percorso o un oggetto file binario (es. io.BytesIO).
+    engine='objectify' costruisce l'albero completo, engine='iterparse' usa il
+    parser in streaming (memoria costante anche su fatture/lotti molto grandi).
+    """
+    if engine == 'iterparse':
+        if isinstance(path, str):
+            strumentazione.conta('byte_letti', os.path.getsize(path))
+        # Parsing e costruzione delle righe sono intrecciati: un solo stadio
+        with strumentazione.misura('iterparse'):
+            return accumula_linee_da_xml_stream(path, acc)
+    if engine != 'objectify':
+        raise ValueError(f"Engine non supportato: {engine}")
+    with strumentazione.misura('parse_xml'):
+        if isinstance(path, str):
+            strumentazione.conta('byte_letti', os.path.getsize(path))
+            with open(path) as f:
+                xml = objectify.parse(f)
+        else:
+            xml = objectify.parse(path)
+    with strumentazione.misura('righe'):
+        root = xml.getroot()
+        # Il namespace si ricava una volta per documento e vale per tutte le ricerche
+        namespace = tag_fatturapa.namespace_documento(root)
+        header = tag_fatturapa.trova(root, 'FatturaElettronicaHeader', namespace)
+        cedente_info = get_cedente_info(header, namespace)
+        # Un lotto SDI può contenere più FatturaElettronicaBody
+        for body in tag_fatturapa.trova_tutti(root, 'FatturaElettronicaBody', namespace):
+            acc.nuova_fattura(testo_data_fattura(body, namespace), cedente_info)
+            for linea in tag_fatturapa.trova_tutti(body, tag_fatturapa.DETTAGLIO_LINEE, namespace):
+                acc.aggiungi_linea(*_valori_linea(linea))
 
-def dataframe_linee_auto(path):
+def dataframe_linee_da_xml(path, engine='objectify'):
     """
-    Se path è un .p7m estrae l'XML e crea il DataFrame, altrimenti usa direttamente l'XML.
+    Crea il DataFrame delle linee di dettaglio da un file XML FatturaPA.
+    engine: 'objectify' (default) o 'iterparse', vedi accumula_linee_da_xml.
+    """
+    acc = AccumulatoreLinee()
+    accumula_linee_da_xml(path, acc, engine=engine)
+    return acc.to_dataframe()
+
+def _nome_locale(tag):
+    """Nome del tag senza namespace/prefisso"""
+    return tag.rpartition('}')[2] if isinstance(tag, str) else ''
+
+def _libera(elem):
+    """Svuota l'elemento già elaborato e i fratelli precedenti"""
+    elem.clear()
+    parent = elem.getparent()
+    if parent is not None:
+        while elem.getprevious() is not None:
+            del parent[0]
+
+def accumula_linee_da_xml_stream(path, acc):
+    """
+    Aggiunge ad `acc` le DettaglioLinee lette con etree.iterparse, man mano che
+    arrivano gli eventi di fine elemento. Gli elementi elaborati vengono liberati,
+    quindi la memoria resta costante qualunque sia la dimensione della fattura.
+    Produce le stesse colonne del percorso objectify.
+    """
+    cedente_info = ('', '', '', '', '')
+    fattura_aperta = False
+    for _, elem in etree.iterparse(path, events=('end',), remove_comments=True):
+        nome = _nome_locale(elem.tag)
+        if nome == 'CedentePrestatore':
+            namespace = tag_fatturapa.namespace_documento(elem)
+            id_fiscale_iva = tag_fatturapa.trova(elem, 'DatiAnagrafici/IdFiscaleIVA', namespace)
+            sede = tag_fatturapa.trova(elem, 'Sede', namespace)
+            if id_fiscale_iva is None:
+                id_paese, id_codice = '', ''
+            else:
+                id_paese = tag_fatturapa.testo(id_fiscale_iva, 'IdPaese', namespace)
+                id_codice = tag_fatturapa.testo(id_fiscale_iva, 'IdCodice', namespace)
+                if id_paese is None or id_codice is None:
+                    raise AttributeError("IdFiscaleIVA senza IdPaese/IdCodice")
+            cedente_info = (
+                id_paese,
+                id_codice,
+                tag_fatturapa.testo(sede, 'CAP', namespace) or '',
+                tag_fatturapa.testo(sede, 'Comune', namespace) or '',
+                tag_fatturapa.testo(sede, 'Provincia', namespace) or '',
+            )
+            _libera(elem)
+        elif nome == 'DatiGeneraliDocumento':
+            data = tag_fatturapa.testo(elem, 'Data')
+            if data is None:
+                raise AttributeError("DatiGeneraliDocumento senza Data")
+            acc.nuova_fattura(data, cedente_info)
+            fattura_aperta = True
+        elif nome == 'DettaglioLinee':
+            if not fattura_aperta:
+                raise AttributeError("DettaglioLinee senza DatiGeneraliDocumento")
+            namespace = tag_fatturapa.namespace_documento(elem)
+            descrizione = tag_fatturapa.testo(elem, 'Descrizione', namespace)
+            quantita = tag_fatturapa.testo(elem, 'Quantita', namespace)
+            prezzo_unitario = tag_fatturapa.testo(elem, 'PrezzoUnitario', namespace)
+            prezzo_totale = tag_fatturapa.testo(elem, 'PrezzoTotale', namespace)
+            if descrizione is None or prezzo_unitario is None or prezzo_totale is None:
+                raise AttributeError("DettaglioLinee incompleta")
+            acc.aggiungi_linea(
+                descrizione,
+                int(float(quantita)) if quantita is not None else -1,
+                float(prezzo_unitario),
+                float(prezzo_totale),
+            )
+            _libera(elem)
+        elif nome in ('FatturaElettronicaBody', 'Allegati'):
+            # Allegati può contenere base64 di diversi MB: non va tenuto in memoria
+            _libera(elem)
+            if nome == 'FatturaElettronicaBody':
+                fattura_aperta = False
+
+def dataframe_linee_da_xml_stream(path):
+    """Come dataframe_linee_da_xml ma con il parser in streaming (iterparse)"""
+    return dataframe_linee_da_xml(path, engine='iterparse')
+
+def accumula_linee_auto(path, acc, engine='objectify', salva_xml_estratto=False, cache=None,
+                        duplicati=None):
+    """
+    Se path è un .p7m estrae l'XML e lo aggiunge ad `acc`, altrimenti usa direttamente l'XML.
+    L'XML estratto viene parsato in memoria; con salva_xml_estratto=True viene
+    anche scritto in path + '_estratto.xml' per debug.
+    Con una CacheFatture i file già visti (stesso contenuto, stessa
+    VERSIONE_PARSER) non vengono né estratti né parsati.
+    Con un IndiceDuplicati le fatture già registrate da un altro file (la
+    stessa in .xml e .p7m, o riconsegnata) vengono saltate prima del parsing.
+    path può anche essere un membro di un archivio (vedi archivi.py): viene
+    letto in memoria dall'archivio, senza scompattarlo.
+    """
+    if cache is not None:
+        return _accumula_linee_con_cache(path, acc, engine, salva_xml_estratto, cache, duplicati)
+    if duplicati is not None or archivi.e_membro(path) or path.lower().endswith('.p7m'):
+        data = _leggi_file(path)
+        try:
+            xml, xml_bytes = _estrai_xml(data, path)
+            if xml_bytes is not None:
+                # Del .p7m serve solo l'XML estratto: la mappa si chiude prima del parsing
+                _rilascia(data)
+            if salva_xml_estratto and xml_bytes is not None:
+                _salva_xml_estratto(path, xml_bytes)
+            if duplicati is None or not _e_duplicato(xml, path, duplicati):
+                accumula_linee_da_xml(_sorgente_xml(xml), acc, engine=engine)
+        finally:
+            _rilascia(data)
+        return
+    accumula_linee_da_xml(path, acc, engine=engine)
+
+def _leggi_file(path):
+    """
+    Contenuto di un file su disco, mappato in memoria (mmap) come in
+    estrai_xml_da_p7m_python_v2, o i byte di un membro di archivio.
+    Va restituito con _rilascia() quando non serve più.
+    """
+    with strumentazione.misura('lettura'):
+        if archivi.e_membro(path):
+            data = archivi.leggi(path)
+        else:
+            with open(path, 'rb') as f:
+                dimensione = os.fstat(f.fileno()).st_size
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if dimensione else b''
+    strumentazione.conta('byte_letti', len(data))
+    return data
+
+def _rilascia(data):
+    if isinstance(data, mmap.mmap):
+        _chiudi_mappa(data)
+
+def _sorgente_xml(xml):
+    """File da passare al parser: la mmap stessa (lxml la legge a blocchi) o i byte in un BytesIO"""
+    if isinstance(xml, mmap.mmap):
+        xml.seek(0)
+        return xml
+    return io.BytesIO(xml)
+
+def _estrai_xml(data, path):
+    """
+    (XML della fattura, XML estratto) dal file già letto in `data`: per un
+    .p7m l'XML estratto, per un XML data stesso e None come XML estratto.
+    L'XML resta in byte: lo decodifica lxml durante il parsing.
     """
     if path.lower().endswith('.p7m'):
-        xml_content = estrai_xml_da_p7m_python_v2(path)
-        # Salva temporaneamente l'XML estratto
-        temp_xml = path + '_estratto.xml'
-        with open(temp_xml, 'w', encoding='utf-8') as f:
-            f.write(xml_content)
-        path_xml = temp_xml
+        p7m_path = archivi.percorso_debug(path) if archivi.e_membro(path) else path
+        xml_bytes = estrai_xml_bytes_da_p7m(data, p7m_path)
+        return xml_bytes, xml_bytes
+    return data, None
+
+def _e_duplicato(xml, path, duplicati):
+    """
+    Registra la fattura nell'IndiceDuplicati; True se un altro file l'aveva
+    già registrata. Nessuna stampa per copia: le copie si contano nelle
+    statistiche (contatore 'duplicati') e la coppia copia -> originale resta
+    nell'indice (tabella copie).
+    """
+    with strumentazione.misura('duplicati'):
+        originale = duplicati.registra(identita_fattura(xml), path)
+    if originale is None:
+        return False
+    strumentazione.conta('duplicati')
+    return True
+
+def _accumula_linee_con_cache(path, acc, engine, salva_xml_estratto, cache, duplicati=None):
+    data = _leggi_file(path)
+    try:
+        _accumula_dati_con_cache(path, data, acc, engine, salva_xml_estratto, cache, duplicati)
+    finally:
+        _rilascia(data)
+
+def _accumula_dati_con_cache(path, data, acc, engine, salva_xml_estratto, cache, duplicati):
+    with strumentazione.misura('hash'):
+        chiave = hash_contenuto(data)
+    with strumentazione.misura('cache'):
+        voce = cache.leggi(chiave, VERSIONE_PARSER)
+    if voce is not None:
+        strumentazione.conta('cache_hit')
+        xml_bytes, acc_file = voce
+        xml = data if xml_bytes is None else xml_bytes
     else:
-        path_xml = path
-    return dataframe_linee_da_xml(path_xml)
+        strumentazione.conta('cache_miss')
+        xml, xml_bytes = _estrai_xml(data, path)
+        acc_file = None
+    if xml_bytes is not None:
+        _rilascia(data)
+    if salva_xml_estratto and xml_bytes is not None:
+        _salva_xml_estratto(path, xml_bytes)
+    if duplicati is not None and _e_duplicato(xml, path, duplicati):
+        return
+    if acc_file is None:
+        acc_file = AccumulatoreLinee()
+        accumula_linee_da_xml(_sorgente_xml(xml), acc_file, engine=engine)
+        with strumentazione.misura('cache'):
+            cache.salva(chiave, VERSIONE_PARSER, xml_bytes, acc_file)
+    acc.estendi(acc_file)
+
+def _salva_xml_estratto(path, xml_bytes):
+    """Export di debug dell'XML estratto da un .p7m"""
+    if archivi.e_membro(path):
+        path = archivi.percorso_debug(path)
+    with open(path + '_estratto.xml', 'wb') as f:
+        f.write(xml_bytes)
 
-def dataframe_linee_batch(cartella):
+def dataframe_linee_auto(path, engine='objectify', salva_xml_estratto=False, cache=None,
+                         duplicati=None):
     """
-    Processa tutti i file .xml (esclusi *_estratto.xml) e .p7m in una cartella.
-    Restituisce un unico DataFrame concatenato. Salta i file malformati.
+    Se path è un .p7m estrae l'XML e crea il DataFrame, altrimenti usa direttamente l'XML.
+    Un duplicato (vedi accumula_linee_auto) dà un DataFrame vuoto.
+    """
+    acc = AccumulatoreLinee()
+    accumula_linee_auto(path, acc, engine=engine, salva_xml_estratto=salva_xml_estratto, cache=cache,
+                        duplicati=duplicati)
+    return acc.to_dataframe()
+
+def file_batch(cartella):
+    """
+    File da processare: tutti i .xml e poi tutti i .p7m. Gli *_estratto.xml
+    (export di debug dei .p7m) sono esclusi per non contare due volte le fatture.
+    Se `cartella` è un archivio (.zip, .tar.gz, ...) restituisce i suoi membri
+    .xml/.p7m nell'ordine dell'archivio, senza estrarli (vedi archivi.py).
     """
-    dfs = []
-    # Tutti i .xml che NON finiscono con _estratto.xml
-    for path in glob.glob(os.path.join(cartella, "*.xml")):
-        if not path.endswith("_estratto.xml"):
-            try:
-                dfs.append(dataframe_linee_auto(path))
-            except Exception as e:
-                print(f"Errore su {path}: {e}")
-    # Tutti i .p7m
-    for path in glob.glob(os.path.join(cartella, "*.p7m")):
+    if archivi.e_archivio(cartella) and os.path.isfile(cartella):
+        return archivi.membri(cartella)
+    paths = [path for path in glob.glob(os.path.join(cartella, "*.xml"))
+             if not path.endswith("_estratto.xml")]
+    paths.extend(glob.glob(os.path.join(cartella, "*.p7m")))
+    return paths
+
+def accumula_linee_batch(paths, acc, engine='objectify', salva_xml_estratto=False, cache=None,
+                         duplicati=None):
+    """
+    Aggiunge ad `acc` le linee di tutti i file in `paths`. Salta i file malformati
+    (le linee già accumulate di un file fallito a metà vengono scartate).
+    Restituisce la lista degli errori come (path, messaggio).
+    """
+    errori = []
+    for path in paths:
+        errore = _accumula_file(path, acc, engine, salva_xml_estratto, cache, duplicati)
+        if errore is not None:
+            errori.append((path, errore))
+    return errori
+
+def _accumula_file(path, acc, engine, salva_xml_estratto, cache, duplicati=None):
+    """
+    accumula_linee_auto su un file, con le statistiche per file.
+    Se il file fallisce scarta le sue linee (e la sua registrazione
+    nell'IndiceDuplicati) e restituisce il messaggio d'errore.
+    """
+    statistiche = strumentazione.STATISTICHE
+    statistiche.inizio_file(path)
+    segno = acc.segna()
+    try:
+        accumula_linee_auto(path, acc, engine=engine, salva_xml_estratto=salva_xml_estratto,
+                            cache=cache, duplicati=duplicati)
+    except Exception as e:
+        acc.ripristina(segno)
+        if duplicati is not None:
+            duplicati.rimuovi([path])
+        print(f"Errore su {path}: {e}")
+        statistiche.conta('errori')
+        statistiche.fine_file(str(e))
+        return str(e)
+    statistiche.conta('file')
+    statistiche.conta('linee', len(acc) - segno[1])
+    statistiche.fine_file()
+    return None
+
+def _elabora_blocco(paths, engine, salva_xml_estratto, cache, traccia=False, duplicati=None,
+                    contenuti=None):
+    """
+    Eseguita nei processi worker: restituisce dati colonnari, non DataFrame,
+    e le statistiche del blocco da unire a quelle del processo principale.
+    contenuti: byte dei membri di tar già letti dal processo principale
+    (vedi archivi.precarica). Gli handle degli archivi sono chiusi a fine
+    blocco: i processi del pool non passano da nessun altro punto di chiusura.
+    """
+    statistiche = strumentazione.nuove_statistiche(traccia)
+    acc = AccumulatoreLinee()
+    if contenuti:
+        archivi.precarica(contenuti)
+    try:
+        errori = accumula_linee_batch(paths, acc, engine=engine, salva_xml_estratto=salva_xml_estratto,
+                                      cache=cache, duplicati=duplicati)
+    finally:
+        archivi.chiudi()
+    return acc, errori, statistiche
+
+def _leggi_membri(paths):
+    """dict membro -> bytes (o l'eccezione della lettura, che il worker risolleva)"""
+    contenuti = {}
+    for path in paths:
         try:
-            dfs.append(dataframe_linee_auto(path))
+            contenuti[path] = archivi.leggi(path)
         except Exception as e:
-            print(f"Errore su {path}: {e}")
-    if dfs:
-        return pd.concat(dfs, ignore_index=True)
+            contenuti[path] = e
+    return contenuti
+
+def _blocchi_tar(executor, blocchi, workers, argomenti):
+    """
+    Risultati di _elabora_blocco nell'ordine dei blocchi, per i membri di un
+    tar: il processo principale legge l'archivio una volta sola, in avanti,
+    e invia a ogni worker i byte del suo blocco. Al più 2 * workers blocchi
+    sono in volo, così in memoria non finisce l'intero archivio.
+    """
+    in_volo = deque()
+    try:
+        for blocco in blocchi:
+            in_volo.append(executor.submit(_elabora_blocco, blocco, *argomenti,
+                                           contenuti=_leggi_membri(blocco)))
+            if len(in_volo) >= 2 * workers:
+                yield in_volo.popleft().result()
+    finally:
+        archivi.chiudi()
+    while in_volo:
+        yield in_volo.popleft().result()
+
+def dividi_in_blocchi(paths, n_blocchi):
+    """Divide `paths` in al più n_blocchi blocchi contigui (l'ordine resta quello originale)"""
+    dimensione = max(1, -(-len(paths) // max(1, n_blocchi)))
+    return [paths[i:i + dimensione] for i in range(0, len(paths), dimensione)]
+
+def accumula_linee_parallelo(paths, acc, workers, engine='objectify', salva_xml_estratto=False,
+                             cache=None, blocchi_per_worker=4, duplicati=None):
+    """
+    Come accumula_linee_batch ma distribuisce i file su un ProcessPoolExecutor,
+    a blocchi contigui. Per uno zip ogni worker legge i suoi membri dal suo
+    handle dell'archivio; un tar invece è letto una volta sola da questo
+    processo, che passa i byte ai worker (vedi _blocchi_tar). Ogni worker
+    restituisce un AccumulatoreLinee che viene accodato ad `acc` nell'ordine
+    dei blocchi, quindi l'ordine delle righe è lo stesso dell'esecuzione seriale.
+    """
+    blocchi = dividi_in_blocchi(paths, workers * blocchi_per_worker)
+    traccia = strumentazione.STATISTICHE.traccia is not None
+    argomenti = (engine, salva_xml_estratto, cache, traccia, duplicati)
+    errori = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        if paths and archivi.e_membro_tar(paths[0]):
+            risultati = _blocchi_tar(executor, blocchi, workers, argomenti)
+        else:
+            risultati = executor.map(_elabora_blocco, blocchi, *(repeat(valore) for valore in argomenti))
+        for acc_blocco, errori_blocco, statistiche in risultati:
+            acc.estendi(acc_blocco)
+            errori.extend(errori_blocco)
+            strumentazione.STATISTICHE.unisci(statistiche)
+    return errori
+
+def dataframe_linee_batch(cartella, engine='objectify', workers=None, salva_xml_estratto=False,
+                          cache=None, duplicati=None):
+    """
+    Processa tutti i file .xml (esclusi *_estratto.xml) e .p7m in una cartella
+    o in un archivio .zip/.tar.gz (letto senza scompattarlo, vedi file_batch).
+    Restituisce un unico DataFrame concatenato. Salta i file malformati.
+    engine: 'objectify' (default) o 'iterparse', vedi accumula_linee_da_xml.
+    workers: se > 1 i file vengono elaborati in parallelo su più processi,
+    con lo stesso ordine di righe dell'esecuzione seriale.
+    salva_xml_estratto: esporta per debug l'XML estratto dai .p7m (*_estratto.xml).
+    cache: CacheFatture opzionale; in una riesecuzione sugli stessi file
+    estrazione e parsing vengono saltati del tutto.
+    duplicati: IndiceDuplicati opzionale; le fatture già elaborate da un altro
+    file (stessa fattura in .xml e .p7m, o riconsegnata) non vengono parsate.
+    Le linee di tutti i file finiscono in un solo AccumulatoreLinee e il
+    DataFrame viene costruito una volta sola alla fine.
+    """
+    acc = AccumulatoreLinee()
+    paths = file_batch(cartella)
+    if workers and workers > 1 and len(paths) > 1:
+        accumula_linee_parallelo(paths, acc, workers, engine=engine,
+                                 salva_xml_estratto=salva_xml_estratto, cache=cache, duplicati=duplicati)
     else:
-        return pd.DataFrame()  # vuoto se nessun file trovato
+        accumula_linee_batch(paths, acc, engine=engine, salva_xml_estratto=salva_xml_estratto,
+                             cache=cache, duplicati=duplicati)
+        archivi.chiudi()
+    with strumentazione.misura('dataframe'):
+        return acc.to_dataframe()  # vuoto se nessun file trovato
+
+def iter_linee(cartella, chunk_rows=100000, engine='objectify', salva_xml_estratto=False, cache=None,
+               duplicati=None):
+    """
+    Versione a blocchi di dataframe_linee_batch: restituisce un generatore di
+    DataFrame da chunk_rows righe ciascuno (l'ultimo può essere più corto),
+    nello stesso ordine e con le stesse colonne del DataFrame completo.
+    In memoria restano al più un blocco e le linee di un file, quindi un
+    archivio di più anni si può anonimizzare e scrivere blocco per blocco.
+    Come dataframe_linee_batch accetta anche un archivio .zip/.tar.gz.
+    """
+    acc = AccumulatoreLinee()
+    try:
+        for path in file_batch(cartella):
+            accumula_linee_batch([path], acc, engine=engine, salva_xml_estratto=salva_xml_estratto,
+                                 cache=cache, duplicati=duplicati)
+            while len(acc) >= chunk_rows:
+                with strumentazione.misura('dataframe'):
+                    df = acc.separa(chunk_rows).to_dataframe()
+                yield df
+    finally:
+        archivi.chiudi()
+    if len(acc):
+        with strumentazione.misura('dataframe'):
+            df = acc.to_dataframe()
+        yield df
+
+def dataframe_linee_batch_incrementale(cartella, output_csv, manifest, engine='objectify',
+                                      salva_xml_estratto=False, cache=None, duplicati=None):
+    """
+    Versione incrementale di dataframe_linee_batch che aggiorna direttamente `output_csv`.
+    Con il ManifestFile `manifest` elabora solo i file nuovi o modificati e
+    appende le loro righe all'output; le righe dei file modificati o eliminati
+    vengono prima tolte dall'output. Restituisce il DataFrame delle righe aggiunte.
+    """
+    if archivi.e_archivio(cartella):
+        raise ValueError("L'elaborazione incrementale richiede una cartella, non un archivio")
+    manifest.riconcilia([output_csv])
+    paths = file_batch(cartella)
+    nuovi, modificati, eliminati = manifest.confronta(paths)
+    copie = []
+    if duplicati is not None:
+        # Le loro fatture non sono più nell'output: le copie saltate come loro
+        # duplicati tornano da elaborare, una di esse diventa il nuovo originale
+        attuali = set(paths).difference(nuovi, modificati)
+        copie = [path for path in duplicati.rimuovi(modificati + eliminati) if path in attuali]
+    output = os.path.basename(output_csv)
+    manifest.rimuovi_dagli_output(modificati + eliminati + copie, os.path.dirname(output_csv))
+    acc = AccumulatoreLinee()
+    righe_per_file = []
+    for path in nuovi + modificati + copie:
+        n_linee = len(acc)
+        if _accumula_file(path, acc, engine, salva_xml_estratto, cache, duplicati) is None:
+            righe_per_file.append((path, len(acc) - n_linee))
+    with strumentazione.misura('dataframe'):
+        df = acc.to_dataframe()
+    if not df.empty:
+        scrivi_header = not os.path.exists(output_csv) or os.path.getsize(output_csv) == 0
+        with strumentazione.misura('scrittura_csv'):
+            df.to_csv(output_csv, mode='a', header=scrivi_header, index=False)
+    # Righe e dimensione dell'output in una transazione: se ci si ferma prima,
+    # riconcilia() toglie le righe appena appese
+    inizio = manifest.righe_output(output)
+    with manifest.transazione():
+        for path, n in righe_per_file:
+            manifest.registra(path, {output: (inizio, n)})
+            inizio += n
+        if os.path.exists(output_csv):
+            manifest.segna_dimensione(output, os.path.getsize(output_csv))
+    print(f"Incrementale: {len(nuovi)} nuovi, {len(modificati)} modificati, "
+          f"{len(eliminati)} eliminati, {len(copie)} copie rielaborate, {len(df)} righe aggiunte")
+    return df
 
 if __name__ == "__main__":
     # Esempio: processa tutti i file validi in una cartella
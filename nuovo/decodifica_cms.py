@@ -0,0 +1,212 @@
+"""
+Decodifica diretta della busta CMS (PKCS#7 SignedData) di un file .p7m.
+Legge la struttura DER/BER in un solo passaggio e restituisce i byte di
+encapContentInfo.eContent, cioè l'XML firmato, senza euristiche.
+Usa solo la libreria standard.
+"""
+import binascii
+import re
+
+# OID DER di signedData (solo contenuto, senza tag/lunghezza): 1.2.840.113549.1.7.2
+OID_SIGNED_DATA = bytes.fromhex('2a864886f70d010702')
+
+TAG_SEQUENCE = 0x30
+TAG_SET = 0x31
+TAG_INTEGER = 0x02
+TAG_OID = 0x06
+TAG_OCTET_STRING = 0x04
+TAG_OCTET_STRING_COSTRUITO = 0x24
+TAG_CONTESTO_0 = 0xA0
+
+# Le fatture con doppia firma hanno un p7m dentro il p7m
+MAX_ANNIDAMENTO = 4
+# Livelli di elementi BER a lunghezza indefinita o OCTET STRING costruiti uno
+# dentro l'altro: le buste reali ne usano uno o due, un file malformato
+# (0x24 0x80 ripetuto) non deve esaurire lo stack di Python
+MAX_PROFONDITA = 64
+
+_INIZIO_PEM = re.compile(rb'\s*-----BEGIN[^\n]*\n')
+_FINE_PEM = re.compile(rb'-----END')
+
+
+class ErroreCMS(ValueError):
+    """La struttura non è una busta CMS SignedData leggibile"""
+
+
+def _leggi_header(buf, pos):
+    """
+    Legge tag e lunghezza dell'elemento che inizia in `pos`.
+    Restituisce (tag, inizio_contenuto, lunghezza); lunghezza è None se indefinita (BER).
+    """
+    if pos + 2 > len(buf):
+        raise ErroreCMS(f"Elemento troncato in posizione {pos}")
+    tag = buf[pos]
+    if tag & 0x1F == 0x1F:
+        raise ErroreCMS("Tag ASN.1 multi-byte non supportati")
+    primo = buf[pos + 1]
+    pos += 2
+    if primo < 0x80:
+        return tag, pos, primo
+    n_byte = primo & 0x7F
+    if n_byte == 0:
+        if not tag & 0x20:
+            raise ErroreCMS("Lunghezza indefinita su un elemento primitivo")
+        return tag, pos, None
+    if n_byte > 8 or pos + n_byte > len(buf):
+        raise ErroreCMS(f"Lunghezza non valida in posizione {pos}")
+    lunghezza = int.from_bytes(buf[pos:pos + n_byte], 'big')
+    pos += n_byte
+    if pos + lunghezza > len(buf):
+        raise ErroreCMS(f"Elemento oltre la fine del file in posizione {pos}")
+    return tag, pos, lunghezza
+
+
+def _controlla_profondita(profondita, pos):
+    if profondita > MAX_PROFONDITA:
+        raise ErroreCMS(f"Più di {MAX_PROFONDITA} livelli BER annidati in posizione {pos}")
+
+
+def _fine_elemento(buf, pos, profondita=0):
+    """Posizione successiva alla fine dell'elemento che inizia in `pos`"""
+    tag, inizio, lunghezza = _leggi_header(buf, pos)
+    if lunghezza is not None:
+        return inizio + lunghezza
+    _controlla_profondita(profondita, pos)
+    # Lunghezza indefinita: i figli terminano con end-of-contents (00 00)
+    pos = inizio
+    while True:
+        if buf[pos:pos + 2] == b'\x00\x00':
+            return pos + 2
+        pos = _fine_elemento(buf, pos, profondita + 1)
+
+
+def _entra(buf, pos, tag_atteso):
+    """Verifica il tag dell'elemento in `pos` e restituisce l'inizio del suo contenuto"""
+    tag, inizio, _ = _leggi_header(buf, pos)
+    if tag != tag_atteso:
+        raise ErroreCMS(f"Atteso tag 0x{tag_atteso:02x}, trovato 0x{tag:02x} in posizione {pos}")
+    return inizio
+
+
+def _leggi_oid(buf, pos):
+    """Restituisce (contenuto OID, posizione successiva)"""
+    tag, inizio, lunghezza = _leggi_header(buf, pos)
+    if tag != TAG_OID or lunghezza is None:
+        raise ErroreCMS(f"Atteso OID in posizione {pos}")
+    return bytes(buf[inizio:inizio + lunghezza]), inizio + lunghezza
+
+
+def _frammenti_octet_string(buf, pos, frammenti, profondita=0):
+    """
+    Aggiunge a `frammenti` le memoryview dei pezzi dell'OCTET STRING in `pos`
+    e restituisce la posizione successiva. Gestisce sia la forma primitiva sia
+    quella costruita (BER, a chunk, con lunghezza definita o indefinita),
+    in cui il contenuto è spezzato in più OCTET STRING annidati.
+    """
+    tag, inizio, lunghezza = _leggi_header(buf, pos)
+    if tag == TAG_OCTET_STRING:
+        frammenti.append(buf[inizio:inizio + lunghezza])
+        return inizio + lunghezza
+    if tag != TAG_OCTET_STRING_COSTRUITO:
+        raise ErroreCMS(f"eContent non è un OCTET STRING (tag 0x{tag:02x})")
+    _controlla_profondita(profondita, pos)
+    pos = inizio
+    if lunghezza is None:
+        while buf[pos:pos + 2] != b'\x00\x00':
+            pos = _frammenti_octet_string(buf, pos, frammenti, profondita + 1)
+        return pos + 2
+    fine = inizio + lunghezza
+    while pos < fine:
+        pos = _frammenti_octet_string(buf, pos, frammenti, profondita + 1)
+    return fine
+
+
+def _leggi_octet_string(buf, pos):
+    """
+    Contenuto di un OCTET STRING: memoryview su `buf` se è in un pezzo solo
+    (nessuna copia), riassemblato in un solo buffer se a chunk.
+    """
+    frammenti = []
+    _frammenti_octet_string(buf, pos, frammenti)
+    if len(frammenti) == 1:
+        return frammenti[0]
+    # Una sola copia: join delle memoryview dei chunk
+    return b''.join(frammenti)
+
+
+def _contenuto_signed_data(buf):
+    """Percorre ContentInfo -> SignedData -> encapContentInfo -> eContent"""
+    # ContentInfo ::= SEQUENCE { contentType OID, content [0] EXPLICIT ANY }
+    pos = _entra(buf, 0, TAG_SEQUENCE)
+    oid, pos = _leggi_oid(buf, pos)
+    if oid != OID_SIGNED_DATA:
+        raise ErroreCMS("ContentInfo non di tipo signedData")
+    pos = _entra(buf, pos, TAG_CONTESTO_0)
+    # SignedData ::= SEQUENCE { version, digestAlgorithms SET, encapContentInfo, ... }
+    pos = _entra(buf, pos, TAG_SEQUENCE)
+    if buf[pos] != TAG_INTEGER:
+        raise ErroreCMS("SignedData senza version")
+    pos = _fine_elemento(buf, pos)
+    if buf[pos] != TAG_SET:
+        raise ErroreCMS("SignedData senza digestAlgorithms")
+    pos = _fine_elemento(buf, pos)
+    # EncapsulatedContentInfo ::= SEQUENCE { eContentType OID, eContent [0] EXPLICIT OCTET STRING }
+    pos = _entra(buf, pos, TAG_SEQUENCE)
+    _, pos = _leggi_oid(buf, pos)
+    if buf[pos] != TAG_CONTESTO_0:
+        raise ErroreCMS("Firma detached: eContent assente")
+    pos = _entra(buf, pos, TAG_CONTESTO_0)
+    return _leggi_octet_string(buf, pos)
+
+
+def _decodifica_testuale(data):
+    """
+    Se il p7m è in formato PEM o base64 restituisce il DER decodificato,
+    altrimenti None. `data` è una memoryview: il base64 si decodifica
+    direttamente dalla fetta, senza copie intermedie (a2b_base64 scarta i newline).
+    """
+    testa = bytes(data[:64]).lstrip()
+    if testa.startswith(b'-----BEGIN'):
+        inizio = _INIZIO_PEM.match(data)
+        if inizio is None:
+            return None
+        fine = _FINE_PEM.search(data, inizio.end())
+        corpo = data[inizio.end():fine.start() if fine else len(data)]
+    elif testa[:1] == b'M':  # base64 di 0x30 0x8x ...
+        corpo = data
+    else:
+        return None
+    try:
+        return binascii.a2b_base64(corpo)
+    except (binascii.Error, ValueError):
+        return None
+
+
+def estrai_contenuto_cms(data):
+    """
+    Restituisce i byte di eContent della busta CMS SignedData contenuta in `data`
+    (DER, BER, PEM o base64) come memoryview o bytes: con un eContent in un pezzo
+    solo è una memoryview su `data`, senza copie. Gestisce p7m annidati (doppia firma).
+    Solleva ErroreCMS se la struttura non è leggibile.
+    """
+    buf = memoryview(data)
+    if not len(buf) or buf[0] != TAG_SEQUENCE:
+        decodificato = _decodifica_testuale(buf)
+        if decodificato is None:
+            raise ErroreCMS("Il file non inizia con una SEQUENCE ASN.1")
+        buf = memoryview(decodificato)
+    contenuto = None
+    for _ in range(MAX_ANNIDAMENTO):
+        try:
+            interno = _contenuto_signed_data(buf)
+        except (ErroreCMS, IndexError) as e:
+            if contenuto is None:
+                raise ErroreCMS(str(e)) from e
+            # Il contenuto inizia con 0x30 ma non è un CMS: è già il documento
+            return contenuto
+        contenuto = interno
+        # Un contenuto che è a sua volta un CMS va spacchettato di nuovo
+        if contenuto[:1] != b'\x30':
+            return contenuto
+        buf = memoryview(contenuto)
+    return contenuto
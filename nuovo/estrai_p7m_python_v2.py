@@ -1,124 +1,264 @@
+import bisect
 import io
+import mmap
+import os
 import re
 from lxml import objectify
 import pandas as pd
 import zlib
 import binascii
-import base64
+import tag_fatturapa
+import strumentazione
+from decodifica_cms import estrai_contenuto_cms, ErroreCMS
 
 def estrai_xml_da_p7m_python_v2(p7m_path):
     """
     Estrae il contenuto XML da un file .p7m usando solo librerie Python.
-    Versione che prova diversi approcci di parsing.
+    Prima decodifica direttamente la busta CMS (un solo passaggio sui dati);
+    solo se fallisce prova i diversi approcci euristici.
+    Il file è mappato in memoria (mmap) invece di essere letto: gli approcci
+    lavorano su fette e memoryview della mappa e copiano solo l'XML trovato,
+    quindi anche i lotti firmati da decine di MB non vengono duplicati in RAM.
     """
-    with open(p7m_path, 'rb') as f:
-        p7m_data = f.read()
-    
-    # Approccio 1: Cerca pattern XML direttamente nei dati binari
-    xml_content = _cerca_xml_in_binario(p7m_data)
+    with strumentazione.misura('lettura'):
+        with open(p7m_path, 'rb') as f:
+            dimensione = os.fstat(f.fileno()).st_size
+            # Un file vuoto non si può mappare
+            p7m_data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if dimensione else b''
+    strumentazione.conta('byte_letti', dimensione)
+    try:
+        return estrai_xml_da_p7m_bytes(p7m_data, p7m_path)
+    finally:
+        if dimensione:
+            _chiudi_mappa(p7m_data)
+
+def _chiudi_mappa(mappa):
+    try:
+        mappa.close()
+    except BufferError:
+        pass  # una memoryview è ancora viva (es. in un traceback): la chiude il garbage collector
+
+def _decodifica(data, inizio, fine, encoding='utf-8'):
+    """Testo di data[inizio:fine], decodificato senza copiare prima la fetta in un bytes"""
+    with memoryview(data) as vista:
+        return str(vista[inizio:fine], encoding, 'ignore')
+
+def estrai_xml_da_p7m_bytes(p7m_data, p7m_path=None):
+    """
+    Come estrai_xml_da_p7m_python_v2 ma sui byte già letti del .p7m (bytes
+    o qualsiasi buffer con find(), es. una mmap). p7m_path serve solo per i file di debug scritti dagli approcci euristici.
+    """
+    with strumentazione.misura('p7m.cms'):
+        xml_content = _estrai_xml_da_cms(p7m_data)
     if xml_content:
+        strumentazione.strategia('cms')
         return xml_content
-    
-    # Approccio 2: Prova decodifica con diversi encoding
-    for encoding in ['utf-8', 'latin-1', 'cp1252', 'iso-8859-1']:
+    return _estrai_xml_euristico(p7m_data, p7m_path)
+
+def estrai_xml_bytes_da_p7m(p7m_data, p7m_path=None):
+    """
+    Come estrai_xml_da_p7m_bytes ma restituisce l'XML in byte UTF-8, per chi
+    lo passa a lxml: il contenuto della busta CMS non viene decodificato in
+    testo e poi ricodificato.
+    """
+    with strumentazione.misura('p7m.cms'):
+        xml_bytes = _byte_xml_da_cms(p7m_data)
+    if xml_bytes:
+        strumentazione.strategia('cms')
+        return xml_bytes
+    return _estrai_xml_euristico(p7m_data, p7m_path).encode('utf-8')
+
+def _contenuto_cms(data):
+    """eContent della struttura CMS SignedData se contiene una fattura, altrimenti None"""
+    try:
+        contenuto = estrai_contenuto_cms(data)
+    except ErroreCMS:
+        return None
+    if _FATTURA_ELETTRONICA.search(contenuto) is None:
+        return None
+    return contenuto
+
+def _estrai_xml_da_cms(data):
+    """Legge eContent dalla struttura CMS SignedData; None se non è leggibile"""
+    contenuto = _contenuto_cms(data)
+    if contenuto is None:
+        return None
+    # contenuto può essere una memoryview sui dati: si decodifica senza copiarlo
+    return _decodifica(contenuto, 0, len(contenuto)).strip()
+
+def _byte_xml_da_cms(data):
+    """Come _estrai_xml_da_cms, ma i byte dell'XML: una sola copia della memoryview"""
+    contenuto = _contenuto_cms(data)
+    if contenuto is None:
+        return None
+    xml_bytes = bytes(contenuto).strip()
+    if not xml_bytes.isascii():
         try:
-            xml_content = _cerca_xml_in_testo(p7m_data, encoding)
-            if xml_content:
-                return xml_content
-        except:
-            continue
-    
-    # Approccio 3: Cerca pattern ASN.1/DER (più avanzato)
-    xml_content = _cerca_xml_in_asn1(p7m_data)
-    if xml_content:
-        return xml_content
-    
-    # Approccio 4: Fallback - cerca la prima sequenza che sembra XML
-    xml_content = _cerca_xml_generico(p7m_data)
-    if xml_content:
-        return xml_content
-    
-    # Approccio 5: Parsing ASN.1 avanzato con asn1crypto
-    xml_content = _cerca_xml_in_asn1crypto(p7m_data, p7m_path)
-    if xml_content:
-        return xml_content
-    
-    # Approccio 6: Brute-force binario
-    xml_content = _estrai_xml_bruteforce_binario(p7m_data)
-    if xml_content:
-        print("[Brute-force binario] XML estratto!")
-        return xml_content
-    
-    # Approccio 7: Brute-force decompress zlib
-    xml_content = _estrai_xml_bruteforce_compressed(p7m_data)
-    if xml_content:
-        print("[Brute-force decompress zlib] XML estratto!")
-        return xml_content
-    
-    # Approccio 8: Brute-force base64
-    xml_content = _estrai_xml_bruteforce_base64(p7m_data)
-    if xml_content:
-        print("[Brute-force base64] XML estratto!")
-        return xml_content
+            xml_bytes.decode('utf-8')
+        except UnicodeDecodeError:
+            # Come _estrai_xml_da_cms: i byte che non sono UTF-8 valido vengono scartati
+            return xml_bytes.decode('utf-8', 'ignore').strip().encode('utf-8')
+    return xml_bytes
+
+def _estrai_xml_euristico(p7m_data, p7m_path):
+    """
+    Catena di approcci euristici, usata quando la decodifica CMS non riesce.
+    Il tempo di ogni approccio tentato e quello che ha funzionato finiscono
+    nelle statistiche (p7m.<nome>).
+    """
+    # Una sola scansione dei marcatori XML, condivisa dagli approcci
+    with strumentazione.misura('p7m.marcatori'):
+        marcatori = scansiona_marcatori(p7m_data)
+
+    messaggi = {
+        'bruteforce_binario': "[Brute-force binario] XML estratto!",
+        'bruteforce_zlib': "[Brute-force decompress zlib] XML estratto!",
+        'bruteforce_base64': "[Brute-force base64] XML estratto!",
+    }
+    for nome, approccio in approcci_euristici(p7m_data, p7m_path, marcatori):
+        with strumentazione.misura(f'p7m.{nome}'):
+            xml_content = approccio()
+        if xml_content:
+            if nome in messaggi:
+                print(messaggi[nome])
+            strumentazione.strategia(nome)
+            return xml_content
     
     # Fallback: salva tutte le sequenze che iniziano con < e finiscono con >
-    _salva_sequenze_xml_debug(p7m_data, p7m_path)
+    if p7m_path:
+        _salva_sequenze_xml_debug(p7m_data, p7m_path)
     
     raise Exception("Impossibile estrarre XML dal file p7m")
 
-def _cerca_xml_in_binario(data):
-    """Cerca pattern XML direttamente nei dati binari (robusto: primo end dopo start, strip)"""
-    xml_start_patterns = [
-        b'<?xml',
-        b'\x3c\x3f\x78\6d\6c',  # <?xml in hex
-        b'<n0:FatturaElettronica',
-    ]
-    xml_end_patterns = [
-        b'</ns2:FatturaElettronica>',
-        b'</FatturaElettronica>',
-        b'</p:FatturaElettronica>',
-        b'</n0:FatturaElettronica>',
+def approcci_euristici(p7m_data, p7m_path, marcatori):
+    """
+    (nome, funzione senza argomenti) degli approcci euristici, nell'ordine in
+    cui _estrai_xml_euristico li prova; marcatori è scansiona_marcatori(p7m_data).
+    Ogni funzione restituisce l'XML o None (benchmark_pipeline li misura uno per uno).
+    """
+    return [
+        # Approccio 1: Cerca pattern XML direttamente nei dati binari
+        ('binario', lambda: _cerca_xml_in_binario(p7m_data, marcatori)),
+        # Approccio 2: Prova decodifica con diversi encoding
+        ('testo', lambda: _cerca_xml_in_testi(p7m_data, marcatori)),
+        # Approccio 3: Cerca pattern ASN.1/DER (più avanzato)
+        ('asn1', lambda: _cerca_xml_in_asn1(p7m_data)),
+        # Approccio 4: Fallback - cerca la prima sequenza che sembra XML
+        ('generico', lambda: _cerca_xml_generico(p7m_data)),
+        # Approccio 5: Parsing ASN.1 avanzato con asn1crypto
+        ('asn1crypto', lambda: _cerca_xml_in_asn1crypto(p7m_data, p7m_path)),
+        # Approccio 6: Brute-force binario
+        ('bruteforce_binario', lambda: _estrai_xml_bruteforce_binario(p7m_data, marcatori)),
+        # Approccio 7: Brute-force decompress zlib
+        ('bruteforce_zlib', lambda: _estrai_xml_bruteforce_compressed(p7m_data)),
+        # Approccio 8: Brute-force base64
+        ('bruteforce_base64', lambda: _estrai_xml_bruteforce_base64(p7m_data)),
     ]
-    for start_pattern in xml_start_patterns:
-        start_pos = data.find(start_pattern)
-        if start_pos != -1:
-            for end_pattern in xml_end_patterns:
-                end_pos = data.find(end_pattern, start_pos)
-                if end_pos != -1:
-                    end_pos += len(end_pattern)
-                    xml_bytes = data[start_pos:end_pos]
-                    # Rimuovi caratteri nulli e whitespace ai bordi
-                    xml_bytes = xml_bytes.strip(b'\x00 \r\n\t')
-                    try:
-                        return xml_bytes.decode('utf-8', errors='ignore').strip()
-                    except:
-                        try:
-                            return xml_bytes.decode('latin-1', errors='ignore').strip()
-                        except:
-                            continue
+
+# Marcatori di inizio/fine XML, riconosciuti tutti insieme in un solo passaggio
+# (qualsiasi prefisso: p:, n0:, ns2:, ... o nessuno). Tutte le alternative
+# partono da '<', così la regex prova a fare match solo su quel byte.
+_MARCATORI_XML = re.compile(
+    b'<(?:(?P<dichiarazione>\\?xml)'
+    b'|(?P<chiusura>/(?:[A-Za-z0-9_]{1,16}:)?FatturaElettronica>)'
+    b'|(?P<apertura>(?:[A-Za-z0-9_]{1,16}:)?FatturaElettronica(?=[\\s>/])))'
+)
+_FATTURA_ELETTRONICA = re.compile(b'FatturaElettronica')
+_FINE_FATTURA_TESTO = re.compile('</(?:[A-Za-z0-9_]+:)?FatturaElettronica>')
+
+class MarcatoriXML:
+    """
+    Posizioni di tutti i marcatori XML di un file p7m, trovate con una sola
+    scansione (regex con alternative) su una memoryview dei dati. Il risultato
+    è condiviso da tutti gli approcci di estrazione, che così non ripetono
+    una find() per ogni pattern.
+    """
+
+    def __init__(self, data):
+        self.dichiarazioni = []  # inizio di '<?xml'
+        self.aperture = []       # inizio di '<...FatturaElettronica'
+        self.chiusure = []       # fine di '</...FatturaElettronica>'
+        self.chiusure_per_tag = {}
+        for match in _MARCATORI_XML.finditer(memoryview(data)):
+            tipo = match.lastgroup
+            if tipo == 'chiusura':
+                self.chiusure.append(match.end())
+                self.chiusure_per_tag.setdefault(match.group(), []).append(match.end())
+            elif tipo == 'dichiarazione':
+                self.dichiarazioni.append(match.start())
+            else:
+                self.aperture.append(match.start())
+
+    def inizi(self):
+        """Tutti gli inizi candidati, in ordine di posizione"""
+        return sorted(self.dichiarazioni + self.aperture)
+
+    def primo_inizio(self):
+        """Primo '<?xml', o in mancanza la prima apertura di FatturaElettronica"""
+        if self.dichiarazioni:
+            return self.dichiarazioni[0]
+        if self.aperture:
+            return self.aperture[0]
+        return None
+
+    def prima_chiusura_dopo(self, pos):
+        """Fine della prima chiusura di FatturaElettronica dopo `pos`, None se assente"""
+        i = bisect.bisect_right(self.chiusure, pos)
+        return self.chiusure[i] if i < len(self.chiusure) else None
+
+    def chiusure_dopo(self, pos):
+        """Per ogni variante del tag di chiusura, la fine della sua prima occorrenza dopo `pos`"""
+        fini = []
+        for posizioni in self.chiusure_per_tag.values():
+            i = bisect.bisect_right(posizioni, pos)
+            if i < len(posizioni):
+                fini.append(posizioni[i])
+        return sorted(fini)
+
+def scansiona_marcatori(data):
+    """Scansione unica dei marcatori XML di `data` (vedi MarcatoriXML)"""
+    return MarcatoriXML(data)
+
+def _cerca_xml_in_binario(data, marcatori=None):
+    """Cerca pattern XML direttamente nei dati binari (robusto: primo end dopo start, strip)"""
+    if marcatori is None:
+        marcatori = scansiona_marcatori(data)
+    start_pos = marcatori.primo_inizio()
+    if start_pos is None:
+        return None
+    end_pos = marcatori.prima_chiusura_dopo(start_pos)
+    if end_pos is None:
+        return None
+    # Inizia con '<' e finisce con '>': nessun carattere nullo o spazio da togliere ai bordi
+    return _decodifica(data, start_pos, end_pos).strip()
+
+def _cerca_xml_in_testi(data, marcatori=None):
+    """Approccio 2: _cerca_xml_in_testo con gli encoding più comuni"""
+    for encoding in ['utf-8', 'latin-1', 'cp1252', 'iso-8859-1']:
+        try:
+            xml_content = _cerca_xml_in_testo(data, encoding, marcatori)
+            if xml_content:
+                return xml_content
+        except:
+            continue
     return None
 
-def _cerca_xml_in_testo(data, encoding):
-    """Cerca pattern XML dopo decodifica con un encoding specifico (robusto: primo end dopo start, strip)"""
+def _cerca_xml_in_testo(data, encoding, marcatori=None):
+    """
+    Cerca pattern XML dopo decodifica con un encoding specifico (robusto: primo end dopo start, strip).
+    I marcatori sono ASCII, quindi per gli encoding usati (utf-8, latin-1, cp1252)
+    si decodifica solo la porzione candidata invece dell'intero file.
+    """
     try:
-        text = data.decode(encoding, errors='ignore')
-        xml_start = text.find('<?xml')
-        if xml_start == -1:
-            xml_start = text.find('<n0:FatturaElettronica')
-        if xml_start != -1:
-            end_patterns = [
-                '</ns2:FatturaElettronica>',
-                '</FatturaElettronica>',
-                '</p:FatturaElettronica>',
-                '</n0:FatturaElettronica>',
-            ]
-            for end_pattern in end_patterns:
-                xml_end = text.find(end_pattern, xml_start)
-                if xml_end != -1:
-                    xml_end += len(end_pattern)
-                    xml_content = text[xml_start:xml_end].strip(' \r\n\t\x00')
-                    if _is_valid_xml(xml_content):
-                        return xml_content
+        if marcatori is None:
+            marcatori = scansiona_marcatori(data)
+        xml_start = marcatori.primo_inizio()
+        if xml_start is not None:
+            for xml_end in marcatori.chiusure_dopo(xml_start):
+                text = _decodifica(data, xml_start, xml_end, encoding)
+                xml_content = text.strip(' \r\n\t\x00')
+                if _is_valid_xml(xml_content):
+                    return xml_content
     except:
         pass
     return None
@@ -152,7 +292,8 @@ def _cerca_xml_in_asn1crypto(data, p7m_path=None):
     """Estrae tutte le OCTET STRING con asn1crypto e cerca l'XML"""
     try:
         from asn1crypto import cms
-        content_info = cms.ContentInfo.load(data)
+        # asn1crypto accetta solo bytes (non una mmap): l'unica copia intera, su un approccio di ripiego
+        content_info = cms.ContentInfo.load(data if isinstance(data, bytes) else bytes(data))
         # Ricorsivamente cerca tutte le octet string
         def extract_octets(obj):
             if hasattr(obj, 'native') and isinstance(obj.native, (bytes, str)):
@@ -189,19 +330,26 @@ def _cerca_xml_in_asn1crypto(data, p7m_path=None):
         print(f"Errore ASN.1 advanced: {e}")
     return None
 
+def _sequenze_lunghe(data, minimo=1000):
+    """
+    (inizio, fine) delle sequenze da un '<' al primo '>' successivo lunghe più
+    di `minimo` byte. Cercate sui byte: '<' e '>' sono ASCII in tutti gli
+    encoding provati, quindi non serve decodificare l'intero file.
+    """
+    start = data.find(b'<')
+    while start != -1:
+        end = data.find(b'>', start)
+        if end != -1 and (end - start) > minimo:
+            yield start, end + 1
+        start = data.find(b'<', start + 1)
+
 def _cerca_xml_generico(data):
     """Cerca la prima sequenza che inizia con < e finisce con > lunga almeno 1000 caratteri"""
     try:
-        for encoding in ['utf-8', 'latin-1', 'cp1252', 'iso-8859-1']:
-            text = data.decode(encoding, errors='ignore')
-            start = text.find('<')
-            while start != -1:
-                end = text.find('>', start)
-                if end != -1 and (end - start) > 1000:
-                    candidate = text[start:end+1]
-                    if '<?xml' in candidate and '</FatturaElettronica' in candidate:
-                        return candidate
-                start = text.find('<', start+1)
+        for start, end in _sequenze_lunghe(data):
+            candidate = data[start:end]
+            if b'<?xml' in candidate and b'</FatturaElettronica' in candidate:
+                return _decodifica(data, start, end)
     except:
         pass
     return None
@@ -209,21 +357,13 @@ def _cerca_xml_generico(data):
 def _salva_sequenze_xml_debug(data, p7m_path):
     """Salva su file tutte le sequenze che iniziano con < e finiscono con > per analisi manuale"""
     try:
-        for encoding in ['utf-8', 'latin-1', 'cp1252', 'iso-8859-1']:
-            text = data.decode(encoding, errors='ignore')
-            found = False
-            with open(p7m_path + '_xml_candidates.txt', 'w', encoding='utf-8') as f:
-                start = text.find('<')
-                while start != -1:
-                    end = text.find('>', start)
-                    if end != -1 and (end - start) > 1000:
-                        candidate = text[start:end+1]
-                        f.write(candidate + '\n\n---\n\n')
-                        found = True
-                    start = text.find('<', start+1)
-            if found:
-                print(f"Sequenze XML candidate salvate in: {p7m_path}_xml_candidates.txt")
-                break
+        found = False
+        with open(p7m_path + '_xml_candidates.txt', 'w', encoding='utf-8') as f:
+            for start, end in _sequenze_lunghe(data):
+                f.write(_decodifica(data, start, end) + '\n\n---\n\n')
+                found = True
+        if found:
+            print(f"Sequenze XML candidate salvate in: {p7m_path}_xml_candidates.txt")
     except Exception as e:
         print(f"Errore salvataggio sequenze XML candidate: {e}")
     return None
@@ -238,87 +378,74 @@ def _is_valid_xml(xml_content):
 
 def find_child_by_tag(parent, tag):
     """Trova un elemento figlio per tag name (considera solo la parte finale del tag)"""
-    for child in parent.iterchildren():
-        if child.tag.endswith(tag):
-            return child
-    return None
+    return tag_fatturapa.trova(parent, tag)
 
-def get_cedente_info(header):
+def get_cedente_info(header, namespace=None):
     """Estrae informazioni del cedente/prestatore"""
-    cedente = find_child_by_tag(header, 'CedentePrestatore')
+    cedente = tag_fatturapa.trova(header, 'CedentePrestatore', namespace)
     if cedente is None:
         return '', '', '', '', ''
     
-    dati_anagrafici = find_child_by_tag(cedente, 'DatiAnagrafici')
-    id_fiscale_iva = find_child_by_tag(dati_anagrafici, 'IdFiscaleIVA') if dati_anagrafici else None
+    id_fiscale_iva = tag_fatturapa.trova(cedente, 'DatiAnagrafici/IdFiscaleIVA', namespace)
     
     id_paese = str(id_fiscale_iva.IdPaese) if id_fiscale_iva is not None and hasattr(id_fiscale_iva, 'IdPaese') else ''
     id_codice = str(id_fiscale_iva.IdCodice) if id_fiscale_iva is not None and hasattr(id_fiscale_iva, 'IdCodice') else ''
     
-    sede = find_child_by_tag(cedente, 'Sede')
+    sede = tag_fatturapa.trova(cedente, 'Sede', namespace)
     cap = str(sede.CAP) if sede is not None and hasattr(sede, 'CAP') else ''
     comune = str(sede.Comune) if sede is not None and hasattr(sede, 'Comune') else ''
     provincia = str(sede.Provincia) if sede is not None and hasattr(sede, 'Provincia') else ''
     
     return id_paese, id_codice, cap, comune, provincia
 
-def get_data_fattura(body):
+def get_data_fattura(body, namespace=None):
     """Estrae la data della fattura"""
-    dati_generali = find_child_by_tag(body, 'DatiGenerali')
-    if dati_generali is None:
-        return pd.NaT
-    
-    dati_doc = find_child_by_tag(dati_generali, 'DatiGeneraliDocumento')
-    if dati_doc is None or not hasattr(dati_doc, 'Data'):
+    data = tag_fatturapa.trova(body, tag_fatturapa.DATA_DOCUMENTO, namespace)
+    if data is None:
         return pd.NaT
     
-    return pd.to_datetime(str(dati_doc.Data))
+    return pd.to_datetime(str(data))
 
-def get_linee_dettaglio(body, cedente_info, data_fattura):
+def get_linee_dettaglio(body, cedente_info, data_fattura, namespace=None):
     """Estrae le linee di dettaglio della fattura"""
-    beni_servizi = find_child_by_tag(body, 'DatiBeniServizi')
-    if beni_servizi is None:
-        return []
-    
     id_paese, id_codice, cap, comune, provincia = cedente_info
     rows = []
     
-    for linea in beni_servizi.iterchildren():
-        if linea.tag.endswith('DettaglioLinee'):
-            # Gestione robusta della quantità
-            quantita = -1
-            if hasattr(linea, 'Quantita') and linea.Quantita is not None:
-                try:
-                    quantita = int(float(str(linea.Quantita)))
-                except (ValueError, TypeError):
-                    quantita = -1
-            
-            # Gestione robusta di altri campi
-            descrizione = str(linea.Descrizione) if hasattr(linea, 'Descrizione') else ''
-            
-            try:
-                prezzo_unitario = float(str(linea.PrezzoUnitario)) if hasattr(linea, 'PrezzoUnitario') else 0.0
-            except (ValueError, TypeError):
-                prezzo_unitario = 0.0
-            
+    for linea in tag_fatturapa.trova_tutti(body, tag_fatturapa.DETTAGLIO_LINEE, namespace):
+        # Gestione robusta della quantità
+        quantita = -1
+        if hasattr(linea, 'Quantita') and linea.Quantita is not None:
             try:
-                prezzo_totale = float(str(linea.PrezzoTotale)) if hasattr(linea, 'PrezzoTotale') else 0.0
+                quantita = int(float(str(linea.Quantita)))
             except (ValueError, TypeError):
-                prezzo_totale = 0.0
-            
-            row = {
-                'Data': data_fattura,
-                'IdPaese': id_paese,
-                'IdFiscaleIVA': id_codice,
-                'CAP': cap,
-                'Comune': comune,
-                'Provincia': provincia,
-                'Descrizione': descrizione,
-                'Quantita': quantita,
-                'PrezzoUnitario': prezzo_unitario,
-                'PrezzoTotale': prezzo_totale,
-            }
-            rows.append(row)
+                quantita = -1
+        
+        # Gestione robusta di altri campi
+        descrizione = str(linea.Descrizione) if hasattr(linea, 'Descrizione') else ''
+        
+        try:
+            prezzo_unitario = float(str(linea.PrezzoUnitario)) if hasattr(linea, 'PrezzoUnitario') else 0.0
+        except (ValueError, TypeError):
+            prezzo_unitario = 0.0
+        
+        try:
+            prezzo_totale = float(str(linea.PrezzoTotale)) if hasattr(linea, 'PrezzoTotale') else 0.0
+        except (ValueError, TypeError):
+            prezzo_totale = 0.0
+        
+        row = {
+            'Data': data_fattura,
+            'IdPaese': id_paese,
+            'IdFiscaleIVA': id_codice,
+            'CAP': cap,
+            'Comune': comune,
+            'Provincia': provincia,
+            'Descrizione': descrizione,
+            'Quantita': quantita,
+            'PrezzoUnitario': prezzo_unitario,
+            'PrezzoTotale': prezzo_totale,
+        }
+        rows.append(row)
     
     return rows
 
@@ -331,16 +458,9 @@ def sanitize_xml(xml_content):
 
 def clean_xml_after_closing_tag(xml_content):
     """Taglia l'XML dopo il primo tag di chiusura FatturaElettronica valido"""
-    end_tags = [
-        '</ns2:FatturaElettronica>',
-        '</FatturaElettronica>',
-        '</p:FatturaElettronica>',
-        '</n0:FatturaElettronica>',
-    ]
-    for tag in end_tags:
-        idx = xml_content.find(tag)
-        if idx != -1:
-            return xml_content[:idx+len(tag)]
+    match = _FINE_FATTURA_TESTO.search(xml_content)
+    if match:
+        return xml_content[:match.end()]
     return xml_content
 
 def dataframe_linee_da_p7m_python(p7m_path):
@@ -357,18 +477,19 @@ def dataframe_linee_da_p7m_python(p7m_path):
         xml_content = clean_xml_after_closing_tag(xml_content)
         # Parsa l'XML
         xml = objectify.fromstring(xml_content.encode('utf-8'))
+        namespace = tag_fatturapa.namespace_documento(xml)
         
         # Trova le sezioni principali
-        header = find_child_by_tag(xml, 'FatturaElettronicaHeader')
-        body = find_child_by_tag(xml, 'FatturaElettronicaBody')
+        header = tag_fatturapa.trova(xml, 'FatturaElettronicaHeader', namespace)
+        body = tag_fatturapa.trova(xml, 'FatturaElettronicaBody', namespace)
         
         if header is None or body is None:
             raise Exception("Struttura XML della fattura non valida")
         
         # Estrai informazioni
-        cedente_info = get_cedente_info(header)
-        data_fattura = get_data_fattura(body)
-        rows = get_linee_dettaglio(body, cedente_info, data_fattura)
+        cedente_info = get_cedente_info(header, namespace)
+        data_fattura = get_data_fattura(body, namespace)
+        rows = get_linee_dettaglio(body, cedente_info, data_fattura, namespace)
         
         return pd.DataFrame(rows)
         
@@ -437,71 +558,84 @@ def debug_p7m_structure(p7m_path):
     except:
         print("Decodifica Latin-1 fallita")
 
-def _estrai_xml_bruteforce_binario(data):
+def _estrai_xml_bruteforce_binario(data, marcatori=None):
     """Cerca la sequenza binaria più lunga che inizia con < e finisce con > e contiene FatturaElettronica"""
-    start_bytes = [b'<?xml', b'<FatturaElettronica', b'<n0:FatturaElettronica', b'<p:FatturaElettronica']
-    end_bytes = [b'</FatturaElettronica>', b'</n0:FatturaElettronica>', b'</p:FatturaElettronica>', b'</ns2:FatturaElettronica>']
-    best_candidate = b''
-    for s in start_bytes:
-        start = data.find(s)
-        while start != -1:
-            for e in end_bytes:
-                end = data.find(e, start)
-                if end != -1:
-                    end += len(e)
-                    candidate = data[start:end]
-                    if b'FatturaElettronica' in candidate and len(candidate) > len(best_candidate):
-                        best_candidate = candidate
-            start = data.find(s, start+1)
-    if best_candidate:
-        # Decodifica robusta
-        for encoding in ['utf-8', 'latin-1', 'cp1252', 'iso-8859-1']:
-            try:
-                return best_candidate.decode(encoding, errors='ignore').strip()
-            except:
-                continue
+    if marcatori is None:
+        marcatori = scansiona_marcatori(data)
+    best_start, best_end = 0, 0
+    for start in marcatori.inizi():
+        for end in marcatori.chiusure_dopo(start):
+            # Ogni candidato termina con </...FatturaElettronica>, quindi la contiene
+            if end - start > best_end - best_start:
+                best_start, best_end = start, end
+    if best_end:
+        return _decodifica(data, best_start, best_end).strip()
     return None
 
-def _estrai_xml_bruteforce_compressed(data):
-    """Cerca blocchi binari compressi (zlib/deflate) che contengono XML e li decomprime"""
-    min_block_size = 500  # blocchi troppo piccoli non sono XML
-    max_block_size = 500000  # blocchi troppo grandi sono improbabili
-    found = False
-    for i in range(len(data)):
-        # Cerca possibili header zlib (0x78 0x9C o 0x78 0xDA)
-        if data[i:i+2] in [b'\x78\x9c', b'\x78\xda']:
-            for j in range(i+min_block_size, min(i+max_block_size, len(data))):
-                try:
-                    chunk = data[i:j]
-                    decompressed = zlib.decompress(chunk)
-                    if b'<?xml' in decompressed and b'FatturaElettronica' in decompressed:
-                        try:
-                            return decompressed.decode('utf-8', errors='ignore').strip()
-                        except:
-                            return decompressed.decode('latin-1', errors='ignore').strip()
-                except Exception:
-                    continue
+# Header zlib più comuni (0x78 0x9C default, 0x78 0xDA massima compressione)
+_HEADER_ZLIB = re.compile(b'\x78[\x9c\xda]')
+_FINE_FATTURA = re.compile(b'</(?:[A-Za-z0-9_]+:)?FatturaElettronica>')
+
+def _estrai_xml_bruteforce_compressed(data, max_block_size=500000, budget_byte=16 * 1024 * 1024,
+                                      max_output=64 * 1024 * 1024, blocco_max=65536):
+    """
+    Cerca blocchi binari compressi (zlib/deflate) che contengono XML e li decomprime.
+    Da ogni header zlib candidato decomprime in streaming con zlib.decompressobj,
+    fermandosi al primo errore, a fine stream o appena trova la chiusura di
+    FatturaElettronica. Ogni candidato legge al più max_block_size byte
+    compressi e l'intero file al più budget_byte, quindi il tempo è lineare
+    e limitato anche su file grandi o malformati. I pezzi letti partono da
+    512 byte e raddoppiano, così i falsi header (che falliscono subito)
+    consumano poco budget.
+    """
+    dati = memoryview(data)
+    budget = budget_byte
+    for match in _HEADER_ZLIB.finditer(data):
+        if budget <= 0:
+            break
+        inizio = match.start()
+        fine = min(inizio + max_block_size, len(dati))
+        decompressore = zlib.decompressobj()
+        output = bytearray()
+        fine_xml = None
+        pos = inizio
+        blocco = 512
+        try:
+            while pos < fine and budget > 0 and not decompressore.eof:
+                pezzo = dati[pos:min(pos + blocco, fine)]
+                blocco = min(blocco * 2, blocco_max)
+                pos += len(pezzo)
+                budget -= len(pezzo)
+                # Il tag di chiusura può stare a cavallo di due pezzi
+                da = max(0, len(output) - 64)
+                output += decompressore.decompress(pezzo, max_output - len(output))
+                fine_xml = _FINE_FATTURA.search(output, da)
+                if fine_xml or len(output) >= max_output:
+                    break
+        except zlib.error:
+            continue
+        if fine_xml:
+            del output[fine_xml.end():]
+        if b'<?xml' in output and b'FatturaElettronica' in output:
+            try:
+                return output.decode('utf-8', errors='ignore').strip()
+            except:
+                return output.decode('latin-1', errors='ignore').strip()
     return None
 
 def _estrai_xml_bruteforce_base64(data):
     """Cerca blocchi base64 lunghi, li decodifica e cerca XML"""
     # Cerca sequenze di almeno 500 caratteri base64
-    import re
     b64_pattern = re.compile(b'([A-Za-z0-9+/=\r\n]{500,})')
-    for match in b64_pattern.finditer(data):
-        b64_block = match.group(1)
-        # Rimuovi newline
-        b64_block = b64_block.replace(b'\r', b'').replace(b'\n', b'')
-        try:
-            decoded = base64.b64decode(b64_block, validate=False)
-            # Cerca XML nel decodificato
-            for encoding in ['utf-8', 'latin-1', 'cp1252', 'iso-8859-1']:
-                try:
-                    text = decoded.decode(encoding, errors='ignore')
-                    if '<?xml' in text and 'FatturaElettronica' in text:
-                        return text[text.find('<?xml'):text.rfind('>')+1]
-                except:
-                    continue
-        except Exception:
-            continue
+    with memoryview(data) as vista:
+        for match in b64_pattern.finditer(data):
+            # a2b_base64 legge direttamente la fetta della memoryview e scarta i newline
+            try:
+                decoded = binascii.a2b_base64(vista[match.start(1):match.end(1)])
+            except Exception:
+                continue
+            # Cerca XML nel decodificato e decodifica solo quella porzione
+            start = decoded.find(b'<?xml')
+            if start != -1 and b'FatturaElettronica' in decoded:
+                return _decodifica(decoded, start, decoded.rfind(b'>') + 1)
     return None
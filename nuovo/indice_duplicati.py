@@ -0,0 +1,216 @@
+"""
+Indice delle fatture già elaborate, per non contare due volte lo stesso
+documento ricevuto sia come .xml sia come .p7m, o riconsegnato in un lotto
+successivo. L'identità di una fattura è (IdFiscaleIVA del cedente, Numero,
+Data, SHA-256 dell'XML normalizzato) e si ricava con una scansione dei byte
+dell'XML, subito dopo l'estrazione e prima del parsing delle linee.
+Ogni identità appartiene al primo file che l'ha registrata: lo stesso file
+rielaborato (stesso path) non è un duplicato di sé stesso, quindi rilanciare
+il batch sulla stessa cartella produce lo stesso output. I file saltati come
+duplicati restano annotati (tabella copie): se l'originale viene modificato o
+eliminato, rimuovi() li restituisce perché vengano rielaborati. Le esecuzioni che
+riscrivono l'output da capo svuotano prima l'indice (svuota()): altrimenti le
+fatture registrate da un'esecuzione precedente, con un altro path, sparirebbero
+dal nuovo output.
+"""
+import hashlib
+import re
+import sqlite3
+
+from connessione_sqlite import connetti
+
+_BOM = b'\xef\xbb\xbf'
+_DICHIARAZIONE = re.compile(rb'\s*<\?xml[^>]*\?>')
+# Spazi tra due tag (diventano '><') o fine riga CRLF (diventa '\n')
+_DA_NORMALIZZARE = re.compile(rb'>\s+<|\r\n')
+_SPAZI = b' \t\n\r\x0b\x0c'
+_CEDENTE = re.compile(rb'<(?:[\w.-]+:)?CedentePrestatore[\s>].*?</(?:[\w.-]+:)?CedentePrestatore>', re.S)
+_ID_FISCALE = re.compile(rb'<(?:[\w.-]+:)?IdFiscaleIVA[\s>].*?</(?:[\w.-]+:)?IdFiscaleIVA>', re.S)
+_DATI_DOCUMENTO = re.compile(
+    rb'<(?:[\w.-]+:)?DatiGeneraliDocumento[\s>].*?</(?:[\w.-]+:)?DatiGeneraliDocumento>', re.S)
+
+
+def _testo(tag):
+    """Regex del testo del primo elemento `tag` (con o senza prefisso)"""
+    return re.compile(rb'<(?:[\w.-]+:)?' + tag + rb'>\s*([^<]*?)\s*</')
+
+
+_ID_PAESE = _testo(b'IdPaese')
+_ID_CODICE = _testo(b'IdCodice')
+_NUMERO = _testo(b'Numero')
+_DATA = _testo(b'Data')
+
+
+def _pezzi_normalizzati(xml):
+    """
+    Pezzi (memoryview sull'input o piccoli bytes) dell'XML normalizzato: senza
+    BOM, dichiarazione, spazi tra i tag e con fine riga \\n. xml può essere
+    bytes o una mmap: il testo tra un punto da normalizzare e l'altro non
+    viene copiato.
+    """
+    inizio, fine = 0, len(xml)
+    if xml[:len(_BOM)] == _BOM:
+        inizio = len(_BOM)
+    dichiarazione = _DICHIARAZIONE.match(xml, inizio)
+    if dichiarazione:
+        inizio = dichiarazione.end()
+    while inizio < fine and xml[inizio] in _SPAZI:
+        inizio += 1
+    while fine > inizio and xml[fine - 1] in _SPAZI:
+        fine -= 1
+    vista = memoryview(xml)
+    for trovato in _DA_NORMALIZZARE.finditer(xml, inizio, fine):
+        yield vista[inizio:trovato.start()]
+        yield b'\n' if trovato.group() == b'\r\n' else b'><'
+        inizio = trovato.end()
+    yield vista[inizio:fine]
+
+
+def normalizza_xml(xml):
+    """
+    XML senza BOM, dichiarazione, spazi tra i tag e con fine riga \\n: la
+    stessa fattura salvata in chiaro o firmata nel .p7m dà gli stessi byte.
+    """
+    return b''.join(_pezzi_normalizzati(xml))
+
+
+def _sha256_normalizzato(xml):
+    """SHA-256 di normalizza_xml(xml), calcolato a pezzi senza costruire la copia normalizzata"""
+    h = hashlib.sha256()
+    for pezzo in _pezzi_normalizzati(xml):
+        h.update(pezzo)
+    return h.hexdigest()
+
+
+def _primo(regex, testo):
+    trovato = regex.search(testo)
+    return trovato.group(1).decode('utf-8', errors='ignore') if trovato else ''
+
+
+def identita_fattura(xml):
+    """
+    (IdFiscaleIVA del cedente, Numero, Data, sha256) dai byte dell'XML, senza
+    parsarlo. In un lotto con più FatturaElettronicaBody Numero e Data sono
+    quelli di tutti i documenti, separati da virgola. xml può essere bytes o
+    una mmap del file.
+    """
+    cedente = _CEDENTE.search(xml)
+    id_fiscale = cedente and _ID_FISCALE.search(xml, cedente.start(), cedente.end())
+    if id_fiscale:
+        blocco = id_fiscale.group()
+        id_fiscale = _primo(_ID_PAESE, blocco) + _primo(_ID_CODICE, blocco)
+    documenti = [documento.group() for documento in _DATI_DOCUMENTO.finditer(xml)]
+    return (
+        id_fiscale or '',
+        ','.join(_primo(_NUMERO, documento) for documento in documenti),
+        ','.join(_primo(_DATA, documento) for documento in documenti),
+        _sha256_normalizzato(xml),
+    )
+
+
+class IndiceDuplicati:
+    """
+    Indice SQLite identità -> path del primo file che l'ha registrata; la
+    chiave primaria sull'identità rende ogni ricerca un accesso all'indice.
+    Come CacheFatture può essere passato ai worker: viene serializzato come
+    percorso e ogni processo apre la sua connessione.
+    """
+
+    def __init__(self, percorso):
+        self.percorso = str(percorso)
+        self._conn = None
+
+    def __getstate__(self):
+        return {'percorso': self.percorso}
+
+    def __setstate__(self, stato):
+        self.__init__(stato['percorso'])
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = connetti(self.percorso, """
+                CREATE TABLE IF NOT EXISTS fatture (
+                    id_fiscale TEXT NOT NULL,
+                    numero TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    PRIMARY KEY (id_fiscale, numero, data, sha256)
+                );
+                CREATE UNIQUE INDEX IF NOT EXISTS fatture_path ON fatture (path);
+                CREATE TABLE IF NOT EXISTS copie (
+                    path TEXT PRIMARY KEY,
+                    originale TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS copie_originale ON copie (originale);
+            """, wal=True, timeout=60)
+        return self._conn
+
+    def chiudi(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM fatture").fetchone()[0]
+
+    def registra(self, identita, path):
+        """
+        Registra la fattura per `path` (sostituendo l'identità che il path
+        aveva prima, se il file è cambiato). Se l'identità appartiene già a un
+        altro file non registra nulla e restituisce quel path: è un duplicato.
+        Altrimenti restituisce None. L'inserimento è atomico, quindi tra più
+        worker una sola copia della fattura viene elaborata. Il duplicato
+        resta annotato come copia dell'originale (vedi rimuovi()).
+        """
+        try:
+            with self.conn:
+                self.conn.execute("DELETE FROM fatture WHERE path = ?", (path,))
+                self.conn.execute("DELETE FROM copie WHERE path = ?", (path,))
+                self.conn.execute("INSERT INTO fatture VALUES (?, ?, ?, ?, ?)", tuple(identita) + (path,))
+            return None
+        except sqlite3.IntegrityError:
+            originale = self.originale(identita)
+            if originale == path:
+                return None
+            with self.conn:
+                self.conn.execute("DELETE FROM fatture WHERE path = ?", (path,))
+                self.conn.execute("INSERT OR REPLACE INTO copie VALUES (?, ?)", (path, originale))
+            return originale
+
+    def originale(self, identita):
+        """Path del file registrato con questa identità, o None"""
+        riga = self.conn.execute(
+            "SELECT path FROM fatture WHERE id_fiscale = ? AND numero = ? AND data = ? AND sha256 = ?",
+            tuple(identita)).fetchone()
+        return riga[0] if riga else None
+
+    def cerca(self, id_fiscale, numero, data):
+        """(sha256, path) delle fatture registrate con questo cedente, numero e data"""
+        return self.conn.execute(
+            "SELECT sha256, path FROM fatture WHERE id_fiscale = ? AND numero = ? AND data = ?",
+            (id_fiscale, numero, data)).fetchall()
+
+    def svuota(self):
+        """Dimentica tutte le fatture: da chiamare prima di riscrivere l'output da capo"""
+        with self.conn:
+            self.conn.execute("DELETE FROM fatture")
+            self.conn.execute("DELETE FROM copie")
+
+    def rimuovi(self, paths):
+        """
+        Dimentica le fatture di questi file (modificati, eliminati, o falliti
+        dopo la registrazione). Restituisce i file che erano stati saltati come
+        loro duplicati, ordinati: la loro fattura non è più nell'output e vanno
+        rielaborati (il primo che si registra diventa il nuovo originale).
+        """
+        paths = list(paths)
+        copie = set()
+        with self.conn:
+            for path in paths:
+                copie.update(riga[0] for riga in self.conn.execute(
+                    "SELECT path FROM copie WHERE originale = ?", (path,)))
+                self.conn.execute("DELETE FROM copie WHERE originale = ? OR path = ?", (path, path))
+                self.conn.execute("DELETE FROM fatture WHERE path = ?", (path,))
+        return sorted(copie.difference(paths))
@@ -0,0 +1,291 @@
+"""
+Manifest dei file già elaborati, per l'ingestione incrementale.
+Per ogni file sorgente registra dimensione, mtime, hash del contenuto e le
+righe che ha prodotto in ciascun file di output (posizione di inizio e numero
+di righe, in ordine di append). Così a ogni esecuzione si elaborano solo i
+file nuovi o modificati, e le righe dei file modificati o eliminati si possono
+togliere dagli output senza riparsare l'archivio.
+Per ogni output tiene anche la dimensione in byte dopo l'ultima scrittura
+registrata, salvata nella stessa transazione delle righe: se un'esecuzione si
+interrompe tra l'append al CSV e la registrazione, riconcilia() tronca
+l'output a quella dimensione e il file viene rielaborato.
+"""
+import csv
+import hashlib
+import os
+from contextlib import contextmanager
+
+from connessione_sqlite import connetti
+
+
+def hash_file(path):
+    """SHA-256 del contenuto del file, letto a blocchi"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for blocco in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(blocco)
+    return h.hexdigest()
+
+
+class ManifestFile:
+
+    def __init__(self, percorso):
+        self.percorso = str(percorso)
+        self.conn = connetti(self.percorso, """
+            CREATE TABLE IF NOT EXISTS file (
+                path TEXT PRIMARY KEY,
+                dimensione INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                sha256 TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS righe (
+                path TEXT NOT NULL,
+                output TEXT NOT NULL,
+                inizio INTEGER NOT NULL,
+                n INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS righe_path ON righe (path);
+            CREATE INDEX IF NOT EXISTS righe_output ON righe (output, inizio);
+            CREATE TABLE IF NOT EXISTS output (
+                nome TEXT PRIMARY KEY,
+                byte INTEGER NOT NULL
+            );
+        """)
+        self._in_transazione = False
+
+    def chiudi(self):
+        self.conn.close()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM file").fetchone()[0]
+
+    @contextmanager
+    def transazione(self):
+        """Raggruppa più registra(), rimuovi() e segna_dimensione() in un'unica transazione"""
+        self._in_transazione = True
+        try:
+            with self.conn:
+                yield
+        finally:
+            self._in_transazione = False
+
+    @contextmanager
+    def _scrittura(self):
+        if self._in_transazione:
+            yield
+        else:
+            with self.conn:
+                yield
+
+    def svuota(self):
+        """Dimentica tutti i file: da chiamare quando gli output vengono riscritti da capo"""
+        with self._scrittura():
+            self.conn.execute("DELETE FROM file")
+            self.conn.execute("DELETE FROM righe")
+            self.conn.execute("DELETE FROM output")
+
+    def segna_dimensione(self, output, byte):
+        """Dimensione di un output dopo le scritture appena registrate"""
+        with self._scrittura():
+            self.conn.execute("INSERT OR REPLACE INTO output VALUES (?, ?)", (output, byte))
+
+    def dimensione(self, output):
+        """Dimensione registrata di un output, o None"""
+        riga = self.conn.execute("SELECT byte FROM output WHERE nome = ?", (output,)).fetchone()
+        return riga[0] if riga else None
+
+    def verifica_output(self, percorsi_output):
+        """
+        Solleva ValueError se il manifest è vuoto ma uno degli output esiste
+        già con dei dati: le righe verrebbero appese di nuovo tutte, con
+        posizioni che ripartono da 0 e non corrispondono più al file.
+        """
+        if len(self):
+            return
+        for percorso in percorsi_output:
+            if os.path.exists(percorso) and os.path.getsize(percorso):
+                raise ValueError(f"{percorso} esiste già ma il manifest {self.percorso} è vuoto: "
+                                 "eliminare l'output o rigenerarlo con un'esecuzione completa")
+
+    def riconcilia(self, percorsi_output):
+        """
+        Da chiamare all'avvio, prima di elaborare: riporta ogni output allo
+        stato registrato nel manifest. Un output più lungo della dimensione
+        registrata contiene righe appese da un'esecuzione interrotta prima
+        della registrazione: viene troncato (i loro file non sono nel manifest
+        e saranno rielaborati). Una riscrittura di rimuovi_dagli_output()
+        interrotta dopo la registrazione viene completata. Solleva ValueError
+        se un output è più corto del registrato o se il manifest è vuoto ma
+        l'output ha già dati (vedi verifica_output).
+        Restituisce i percorsi degli output troncati.
+        """
+        percorsi_output = [str(percorso) for percorso in percorsi_output]
+        self.verifica_output(percorsi_output)
+        troncati = []
+        for percorso in percorsi_output:
+            byte = self.dimensione(os.path.basename(percorso))
+            temporaneo = percorso + '.tmp'
+            if os.path.exists(temporaneo):
+                if byte is not None and os.path.getsize(temporaneo) == byte:
+                    os.replace(temporaneo, percorso)
+                else:
+                    os.remove(temporaneo)
+            if byte is None or not os.path.exists(percorso):
+                continue
+            attuale = os.path.getsize(percorso)
+            if attuale < byte:
+                raise ValueError(f"{percorso} è più corto di quanto registrato nel manifest {self.percorso} "
+                                 f"({attuale} byte invece di {byte}): rigenerarlo con un'esecuzione completa")
+            if attuale > byte:
+                with open(percorso, 'r+b') as f:
+                    f.truncate(byte)
+                print(f"{percorso}: tolti {attuale - byte} byte di righe non registrate")
+                troncati.append(percorso)
+        return troncati
+
+    def confronta(self, paths):
+        """
+        Confronta i file presenti con quelli registrati.
+        Restituisce (nuovi, modificati, eliminati). Un file con dimensione o
+        mtime diversi ma stesso hash non è considerato modificato: viene solo
+        aggiornato il suo stat.
+        """
+        registrati = {path: (dimensione, mtime_ns, sha256) for path, dimensione, mtime_ns, sha256
+                      in self.conn.execute("SELECT path, dimensione, mtime_ns, sha256 FROM file")}
+        nuovi, modificati = [], []
+        for path in paths:
+            voce = registrati.pop(path, None)
+            if voce is None:
+                nuovi.append(path)
+                continue
+            st = os.stat(path)
+            if (st.st_size, st.st_mtime_ns) == voce[:2]:
+                continue
+            if hash_file(path) == voce[2]:
+                with self.conn:
+                    self.conn.execute("UPDATE file SET dimensione = ?, mtime_ns = ? WHERE path = ?",
+                                      (st.st_size, st.st_mtime_ns, path))
+            else:
+                modificati.append(path)
+        eliminati = sorted(registrati)
+        return nuovi, modificati, eliminati
+
+    def stat_registrati(self):
+        """dict path -> (dimensione, mtime_ns) dei file registrati"""
+        return {path: (dimensione, mtime_ns) for path, dimensione, mtime_ns
+                in self.conn.execute("SELECT path, dimensione, mtime_ns FROM file")}
+
+    def righe_output(self, output):
+        """Numero di righe registrate per un output (posizione del prossimo append)"""
+        riga = self.conn.execute(
+            "SELECT MAX(inizio + n) FROM righe WHERE output = ?", (output,)).fetchone()
+        return riga[0] or 0
+
+    def registra(self, path, righe, stat=None, sha256=None):
+        """
+        Registra un file elaborato. `righe` è un dict output -> (inizio, n)
+        con le righe appena appese a ciascun output. stat (dimensione, mtime_ns)
+        e sha256 si possono passare se già noti; altrimenti sono letti dal file.
+        """
+        if stat is None:
+            st = os.stat(path)
+            stat = (st.st_size, st.st_mtime_ns)
+        if sha256 is None:
+            sha256 = hash_file(path)
+        with self._scrittura():
+            self._cancella(path)
+            self.conn.execute("INSERT INTO file VALUES (?, ?, ?, ?)", (path,) + tuple(stat) + (sha256,))
+            self.conn.executemany("INSERT INTO righe VALUES (?, ?, ?, ?)",
+                                  [(path, output, inizio, n) for output, (inizio, n) in righe.items() if n])
+
+    def _cancella(self, path):
+        self.conn.execute("DELETE FROM file WHERE path = ?", (path,))
+        self.conn.execute("DELETE FROM righe WHERE path = ?", (path,))
+
+    def rimuovi(self, paths):
+        """
+        Toglie dal manifest i file indicati (modificati o eliminati) e ricompatta
+        le posizioni delle righe rimaste. Restituisce un dict
+        output -> lista ordinata di (inizio, n) da togliere da quell'output.
+        """
+        da_togliere = {}
+        with self._scrittura():
+            for path in paths:
+                for output, inizio, n in self.conn.execute(
+                        "SELECT output, inizio, n FROM righe WHERE path = ?", (path,)).fetchall():
+                    da_togliere.setdefault(output, []).append((inizio, n))
+                self._cancella(path)
+            for output, intervalli in da_togliere.items():
+                intervalli.sort()
+                self._compatta(output, intervalli)
+        return da_togliere
+
+    def _compatta(self, output, intervalli):
+        """Sposta indietro le righe che seguivano gli intervalli tolti"""
+        rimaste = self.conn.execute(
+            "SELECT rowid, inizio FROM righe WHERE output = ? ORDER BY inizio", (output,)).fetchall()
+        aggiornamenti = []
+        tolte, i = 0, 0
+        for rowid, inizio in rimaste:
+            while i < len(intervalli) and intervalli[i][0] < inizio:
+                tolte += intervalli[i][1]
+                i += 1
+            if tolte:
+                aggiornamenti.append((inizio - tolte, rowid))
+        self.conn.executemany("UPDATE righe SET inizio = ? WHERE rowid = ?", aggiornamenti)
+
+    def rimuovi_dagli_output(self, paths, cartella_output):
+        """
+        rimuovi() più la rimozione delle righe dai CSV in `cartella_output`.
+        I CSV senza quelle righe sono scritti in file temporanei; il manifest
+        ricompattato viene registrato con le loro dimensioni e solo dopo i
+        temporanei sostituiscono gli output (riconcilia() completa la
+        sostituzione se ci si ferma in mezzo). Restituisce il dict di rimuovi().
+        """
+        temporanei = {}
+        try:
+            with self.transazione():
+                da_togliere = self.rimuovi(paths)
+                for output, intervalli in da_togliere.items():
+                    percorso = os.path.join(str(cartella_output), output)
+                    if not os.path.exists(percorso):
+                        continue
+                    temporanei[percorso] = _senza_righe(percorso, intervalli)
+                    self.segna_dimensione(output, os.path.getsize(temporanei[percorso]))
+        except BaseException:
+            for temporaneo in temporanei.values():
+                os.remove(temporaneo)
+            raise
+        for percorso, temporaneo in temporanei.items():
+            os.replace(temporaneo, percorso)
+        return da_togliere
+
+
+def rimuovi_righe_csv(percorso_csv, intervalli):
+    """
+    Riscrive un CSV (con header) senza le righe dati negli intervalli (inizio, n),
+    leggendolo in streaming. Le righe sono contate dopo l'header, come gli
+    indici di un DataFrame letto con pandas.
+    """
+    if not intervalli or not os.path.exists(percorso_csv):
+        return
+    os.replace(_senza_righe(percorso_csv, intervalli), percorso_csv)
+
+
+def _senza_righe(percorso_csv, intervalli):
+    """Scrive accanto al CSV una copia senza le righe negli intervalli e ne restituisce il percorso"""
+    da_saltare = set()
+    for inizio, n in intervalli:
+        da_saltare.update(range(inizio, inizio + n))
+    temporaneo = str(percorso_csv) + '.tmp'
+    with open(percorso_csv, newline='', encoding='utf-8') as sorgente, \
+            open(temporaneo, 'w', newline='', encoding='utf-8') as destinazione:
+        lettore = csv.reader(sorgente)
+        scrittore = csv.writer(destinazione, lineterminator=os.linesep)
+        header = next(lettore, None)
+        if header is not None:
+            scrittore.writerow(header)
+        for i, riga in enumerate(lettore):
+            if i not in da_saltare:
+                scrittore.writerow(riga)
+    return temporaneo
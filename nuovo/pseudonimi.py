@@ -0,0 +1,128 @@
+"""
+Pseudonimizzazione delle partite IVA.
+Lo pseudonimo è sha256(str(valore))[:12]; viene calcolato una volta per valore
+distinto e ricordato in un memo condiviso tra file e batch, poi riportato
+sulle righe per indice.
+RegistroPseudonimi conserva su disco (SQLite) la corrispondenza pseudonimo <->
+partita IVA, aggiornata solo con i valori nuovi di ogni esecuzione.
+"""
+import csv
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+
+from connessione_sqlite import connetti
+
+# Memo valore -> pseudonimo, condiviso da tutte le chiamate del processo
+MEMO_CIFRATURA = {}
+
+
+def cifratura(stringa):
+    return hashlib.sha256(str(stringa).encode()).hexdigest()[:12]
+
+
+def pseudonimi_colonna(valori, memo=None):
+    """
+    Restituisce (pseudonimi riga per riga, dict pseudonimo -> valore); se la
+    colonna è categorica anche il risultato lo è.
+    Hash calcolati solo sui valori unici (factorize) e non già presenti nel memo.
+    """
+    if memo is None:
+        memo = MEMO_CIFRATURA
+    if isinstance(getattr(valori, 'dtype', None), pd.CategoricalDtype) and not valori.isna().any():
+        # Colonna già categorica (schema compatto): si cifrano solo le categorie
+        valori = valori.cat.remove_unused_categories()
+        categorie = valori.cat.categories
+        pseudonimi = [_pseudonimo(valore, memo) for valore in categorie]
+        righe = pd.Categorical.from_codes(valori.cat.codes, pseudonimi)
+        return righe, dict(zip(pseudonimi, categorie))
+    valori = np.asarray(valori, dtype=object)
+    codici, unici = pd.factorize(valori)
+    pseudonimi = np.empty(len(unici) + 1, dtype=object)
+    for i, valore in enumerate(unici):
+        pseudonimi[i] = _pseudonimo(valore, memo)
+    righe = pseudonimi[codici]
+    diz = dict(zip(pseudonimi[:-1], unici))
+    # factorize mette None e NaN a -1: si cifrano a parte, come str(None)/str(nan)
+    mancanti = np.flatnonzero(codici == -1)
+    for i in mancanti:
+        righe[i] = _pseudonimo(valori[i], memo)
+        diz[righe[i]] = valori[i]
+    return righe, diz
+
+
+def _pseudonimo(valore, memo):
+    chiave = str(valore)
+    pseudonimo = memo.get(chiave)
+    if pseudonimo is None:
+        pseudonimo = memo[chiave] = cifratura(chiave)
+    return pseudonimo
+
+
+class RegistroPseudonimi:
+    """
+    Registro persistente pseudonimo <-> valore originale, indicizzato in
+    entrambe le direzioni: ogni esecuzione inserisce solo le coppie che non
+    c'erano. cifratura.csv e il JSON del dizionario restano come esportazioni
+    (esporta_csv, esporta_json) scritte a fine esecuzione.
+    """
+
+    def __init__(self, percorso):
+        self.percorso = str(percorso)
+        self.conn = connetti(self.percorso, """
+            CREATE TABLE IF NOT EXISTS pseudonimi (
+                pseudonimo TEXT PRIMARY KEY,
+                valore TEXT
+            );
+            CREATE INDEX IF NOT EXISTS pseudonimi_valore ON pseudonimi (valore);
+        """)
+
+    def chiudi(self):
+        self.conn.close()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM pseudonimi").fetchone()[0]
+
+    def aggiungi(self, diz):
+        """Inserisce in un'unica transazione le coppie pseudonimo -> valore non ancora registrate"""
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO pseudonimi VALUES (?, ?)",
+                ((pseudonimo, None if pd.isna(valore) else str(valore)) for pseudonimo, valore in diz.items()))
+
+    def valore(self, pseudonimo):
+        """Re-identificazione: partita IVA dello pseudonimo, o None se sconosciuto"""
+        riga = self.conn.execute(
+            "SELECT valore FROM pseudonimi WHERE pseudonimo = ?", (pseudonimo,)).fetchone()
+        return riga[0] if riga else None
+
+    def pseudonimo(self, valore):
+        """Pseudonimo registrato per la partita IVA, o None se mai vista"""
+        riga = self.conn.execute(
+            "SELECT pseudonimo FROM pseudonimi WHERE valore = ?", (str(valore),)).fetchone()
+        return riga[0] if riga else None
+
+    def importa_csv(self, percorso_csv):
+        """Carica un cifratura.csv scritto dalle versioni precedenti"""
+        with open(percorso_csv, newline='', encoding='utf-8') as f:
+            lettore = csv.reader(f)
+            next(lettore, None)
+            with self.conn:
+                self.conn.executemany("INSERT OR IGNORE INTO pseudonimi VALUES (?, ?)",
+                                      (riga[:2] for riga in lettore if len(riga) >= 2))
+
+    def esporta_csv(self, percorso_csv):
+        """Scrive l'intero registro nel vecchio formato di cifratura.csv (piva_anon, IdFiscaleIVA)"""
+        with open(percorso_csv, 'w', newline='', encoding='utf-8') as f:
+            scrittore = csv.writer(f, lineterminator=os.linesep)
+            scrittore.writerow(['piva_anon', 'IdFiscaleIVA'])
+            scrittore.writerows(self.conn.execute(
+                "SELECT pseudonimo, valore FROM pseudonimi ORDER BY rowid"))
+
+    def esporta_json(self, percorso_json):
+        """Scrive l'intero registro come il vecchio JSON del dizionario {pseudonimo: partita IVA}"""
+        with open(percorso_json, 'w') as f:
+            json.dump(dict(self.conn.execute("SELECT pseudonimo, valore FROM pseudonimi ORDER BY rowid")),
+                      f, indent=4)
@@ -0,0 +1,290 @@
+"""
+Servizio di ingestione continua: sorveglia la cartella di deposito e
+anonimizza le fatture (XML e P7M) pochi secondi dopo il loro arrivo, invece
+di rielaborare tutto a ogni esecuzione di Anonimizzazione.py.
+- La cartella è letta in polling con uno snapshot di (dimensione, mtime)
+  confrontato con quello precedente: nessuna dipendenza esterna.
+- Un file viene elaborato solo quando il suo stat è rimasto uguale per
+  `attesa_stabile` secondi, così non si leggono file ancora in scrittura.
+- L'estrazione (dataframe_linee_auto) gira su un pool di processi; il
+  processo principale anonimizza e appende le righe al CSV di output, unico
+  scrittore, e le registra nel manifest insieme alla nuova dimensione del
+  CSV (all'avvio le righe appese e non registrate vengono tolte, vedi
+  ManifestFile.riconcilia). Un file modificato dopo
+  l'elaborazione sostituisce le sue righe; i file tolti dalla cartella
+  (archiviati) lasciano le loro righe nell'output.
+- Le fatture già elaborate da un altro file (la stessa in .xml e .p7m, o
+  riconsegnata) sono saltate con l'IndiceDuplicati in <output>.duplicati.db.
+- Le tabelle aggregate per i cruscotti (<output>.aggregati.db, vedi
+  aggregati.py) si aggiornano con le sole righe nuove di ogni file.
+- Se un worker muore (crash dell'interprete, OOM) il pool viene ricreato
+  e i file che erano in elaborazione tornano in coda come sospetti: vengono
+  rielaborati da soli, uno alla volta, e un file che fa cadere il pool
+  MAX_TENTATIVI volte da solo è contato come errore.
+- stato() espone profondità della coda e ritardo (lag) tra arrivo e
+  scrittura; viene anche salvato a ogni ciclo in <output>.stato.json.
+Uso: python servizio_ingestione.py <cartella> <output_csv> [--intervallo S] [--workers N]
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import creazione_df
+from Anonimizzazione import anonimizza_fattura
+from manifest import ManifestFile, hash_file
+from aggregati import AggregatiLinee
+from indice_duplicati import IndiceDuplicati
+from pseudonimi import RegistroPseudonimi
+
+# Cadute del pool con il file da solo in elaborazione prima di contarlo come errore
+MAX_TENTATIVI = 3
+
+
+def snapshot(cartella):
+    """dict path -> (dimensione, mtime_ns) dei file da elaborare (come creazione_df.file_batch)"""
+    stat = {}
+    for path in creazione_df.file_batch(cartella):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue  # tolto tra il listing e lo stat
+        stat[path] = (st.st_size, st.st_mtime_ns)
+    return stat
+
+
+def _elabora_file(path, engine, duplicati):
+    """
+    Eseguita nei worker: (DataFrame, sha256, None) oppure (None, None, messaggio d'errore).
+    L'hash per il manifest si calcola qui: il file può sparire (archiviato)
+    prima che il processo principale lo registri.
+    """
+    try:
+        sha256 = hash_file(path)
+        return creazione_df.dataframe_linee_auto(path, engine=engine, duplicati=duplicati), sha256, None
+    except Exception as e:
+        duplicati.rimuovi([path])
+        return None, None, str(e)
+
+
+class ServizioIngestione:
+
+    def __init__(self, cartella, output_csv, workers=2, intervallo=1.0, attesa_stabile=2.0,
+                 engine='objectify'):
+        self.cartella = cartella
+        self.output_csv = str(output_csv)
+        self.output = os.path.basename(self.output_csv)
+        self.intervallo = intervallo
+        self.attesa_stabile = attesa_stabile
+        self.engine = engine
+        self.workers = workers
+        base = os.path.splitext(self.output_csv)[0]
+        self.percorso_stato = base + '.stato.json'
+        self.manifest = ManifestFile(base + '.manifest.db')
+        troncati = self.manifest.riconcilia([self.output_csv])
+        self.registro = RegistroPseudonimi(base + '.pseudonimi.db')
+        self.duplicati = IndiceDuplicati(base + '.duplicati.db')
+        self.aggregati = AggregatiLinee(base + '.aggregati.db')
+        if troncati:
+            # Le righe tolte erano già state sommate negli aggregati
+            self.aggregati.ricalcola_da_csv('', self.output_csv)
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+        # Stat dei file già elaborati (anche falliti, per non riprovarli finché non cambiano)
+        self.elaborati = self.manifest.stat_registrati()
+        self.in_attesa = {}   # path -> (stat, primo arrivo, ultimo cambiamento)
+        self.in_corso = {}    # future -> (path, stat, primo arrivo)
+        self.sospetti = set()  # in elaborazione durante una caduta del pool
+        self.tentativi = {}   # path -> cadute del pool con il file da solo in elaborazione
+        self.contatori = {'file': 0, 'linee': 0, 'errori': 0}
+        self.ultimo_lag = None
+        self.lag_massimo = 0.0
+
+    def chiudi(self):
+        self.executor.shutdown(wait=True)
+        self._raccogli(attendi=True)
+        # _raccogli può aver ricreato il pool dopo una caduta: non ha processi da attendere
+        self.executor.shutdown(wait=False)
+        self.manifest.chiudi()
+        self.registro.chiudi()
+        self.duplicati.chiudi()
+        self.aggregati.chiudi()
+
+    def ciclo(self):
+        """Un giro di polling: rileva i file nuovi/cambiati, avvia quelli stabili, scrive i risultati"""
+        ora = time.time()
+        attuale = snapshot(self.cartella)
+        in_elaborazione = {path for path, _, _ in self.in_corso.values()}
+        for path, stat in attuale.items():
+            if self.elaborati.get(path) == stat or path in in_elaborazione:
+                continue
+            voce = self.in_attesa.get(path)
+            if voce is None:
+                self.in_attesa[path] = (stat, ora, ora)
+            elif voce[0] != stat:
+                # Ancora in scrittura: si riparte con il debounce
+                self.in_attesa[path] = (stat, voce[1], ora)
+        pronti = []
+        for path in list(self.in_attesa):
+            stat, arrivo, cambiamento = self.in_attesa[path]
+            if path not in attuale:
+                del self.in_attesa[path]
+                self.sospetti.discard(path)
+            elif ora - cambiamento >= self.attesa_stabile:
+                pronti.append(path)
+        if self.sospetti:
+            # Dopo una caduta del pool i sospetti girano da soli, uno alla volta,
+            # finché non si scopre quale file la causa; gli altri aspettano
+            pronti = [path for path in pronti if path in self.sospetti][:1] if not self.in_corso else []
+        for path in pronti:
+            self._avvia(path)
+        self._raccogli()
+        self._salva_stato()
+
+    def _avvia(self, path):
+        stat, arrivo, _ = self.in_attesa.pop(path)
+        if path in self.elaborati:
+            self._rilascia(path)
+        try:
+            futuro = self.executor.submit(_elabora_file, path, self.engine, self.duplicati)
+        except BrokenProcessPool:
+            # Il pool è caduto dopo l'ultimo _raccogli: path va in coda con gli altri
+            self.in_attesa[path] = (stat, arrivo, time.time())
+            self._pool_caduto()
+            return
+        self.in_corso[futuro] = (path, stat, arrivo)
+
+    def _rilascia(self, path):
+        """
+        Un file già elaborato è cambiato: la sua vecchia fattura esce
+        dall'indice dei duplicati e le copie saltate come suoi duplicati
+        tornano da elaborare al prossimo ciclo.
+        """
+        for copia in self.duplicati.rimuovi([path]):
+            self.elaborati.pop(copia, None)
+
+    def _raccogli(self, attendi=False):
+        """
+        Scrive nell'output i risultati dei worker già pronti. Un file lento non
+        blocca quelli inviati dopo di lui, quindi le righe finiscono
+        nell'output in ordine di completamento, non di invio (il manifest
+        tiene la posizione di ciascun file). Se il pool è caduto, prima si
+        scrivono i risultati dei file completati, poi solo quelli rimasti
+        senza risultato tornano in coda (vedi _pool_caduto).
+        """
+        caduto = False
+        for futuro in list(self.in_corso):
+            if not attendi and not futuro.done():
+                continue
+            try:
+                df, sha256, errore = futuro.result()
+            except BrokenProcessPool:
+                caduto = True
+                continue
+            path, stat, arrivo = self.in_corso.pop(futuro)
+            self.sospetti.discard(path)
+            self.tentativi.pop(path, None)
+            self.elaborati[path] = stat
+            if errore is not None:
+                print(f"Errore su {path}: {errore}")
+                self.contatori['errori'] += 1
+                continue
+            self._scrivi(path, df, stat, sha256)
+            self.ultimo_lag = time.time() - arrivo
+            self.lag_massimo = max(self.lag_massimo, self.ultimo_lag)
+        if caduto:
+            self._pool_caduto()
+
+    def _pool_caduto(self):
+        """
+        Un worker è morto e il pool non accetta più lavoro: i file rimasti in
+        elaborazione senza risultato sono persi e tornano in coda come
+        sospetti, su un pool nuovo. La caduta è imputata a un file solo se era
+        l'unico senza risultato; dopo MAX_TENTATIVI il file è contato come errore.
+        """
+        ora = time.time()
+        da_soli = len(self.in_corso) == 1
+        for path, stat, arrivo in self.in_corso.values():
+            if da_soli:
+                self.tentativi[path] = self.tentativi.get(path, 0) + 1
+            if self.tentativi.get(path, 0) < MAX_TENTATIVI:
+                self.sospetti.add(path)
+                self.in_attesa[path] = (stat, arrivo, ora)
+                continue
+            del self.tentativi[path]
+            self.sospetti.discard(path)
+            self.elaborati[path] = stat
+            print(f"Errore su {path}: il worker è terminato {MAX_TENTATIVI} volte durante l'elaborazione")
+            self.contatori['errori'] += 1
+        self.in_corso.clear()
+        self.executor.shutdown(wait=False)
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+
+    def _scrivi(self, path, df, stat, sha256):
+        # Un file già elaborato e poi modificato: le sue vecchie righe vanno tolte
+        intervalli = self.manifest.rimuovi_dagli_output([path], os.path.dirname(self.output_csv)).get(self.output)
+        if intervalli:
+            # Caso raro (file modificato): min e max non si sottraggono, si ricalcola dal CSV
+            self.aggregati.ricalcola_da_csv('', self.output_csv)
+        inizio = self.manifest.righe_output(self.output)
+        if not df.empty:
+            df_anon, diz = anonimizza_fattura(df, copia=False)
+            self.registro.aggiungi(diz)
+            scrivi_header = not os.path.exists(self.output_csv) or os.path.getsize(self.output_csv) == 0
+            df_anon.to_csv(self.output_csv, mode='a', header=scrivi_header, index=False)
+            self.aggregati.aggiorna(df_anon)
+        with self.manifest.transazione():
+            self.manifest.registra(path, {self.output: (inizio, len(df))}, stat, sha256)
+            if not df.empty:
+                self.manifest.segna_dimensione(self.output, os.path.getsize(self.output_csv))
+        self.contatori['file'] += 1
+        self.contatori['linee'] += len(df)
+
+    def stato(self):
+        """Profondità della coda e ritardi, in secondi"""
+        ora = time.time()
+        arrivi = [arrivo for _, arrivo, _ in self.in_attesa.values()]
+        arrivi += [arrivo for _, _, arrivo in self.in_corso.values()]
+        return {
+            'in_attesa': len(self.in_attesa),
+            'in_elaborazione': len(self.in_corso),
+            'coda': len(self.in_attesa) + len(self.in_corso),
+            'lag_piu_vecchio': ora - min(arrivi) if arrivi else 0.0,
+            'ultimo_lag': self.ultimo_lag,
+            'lag_massimo': self.lag_massimo,
+            **self.contatori,
+        }
+
+    def _salva_stato(self):
+        temporaneo = self.percorso_stato + '.tmp'
+        with open(temporaneo, 'w') as f:
+            json.dump(self.stato(), f, indent=4)
+        os.replace(temporaneo, self.percorso_stato)
+
+    def esegui(self, durata=None):
+        """Ciclo di polling fino a Ctrl+C (o per `durata` secondi)"""
+        fine = time.time() + durata if durata is not None else None
+        try:
+            while fine is None or time.time() < fine:
+                inizio = time.time()
+                self.ciclo()
+                time.sleep(max(0.0, self.intervallo - (time.time() - inizio)))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.chiudi()
+            print(f"Servizio fermato: {self.stato()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('cartella', help="cartella di deposito delle fatture (XML e P7M)")
+    parser.add_argument('output_csv', help="CSV anonimizzato a cui appendere le righe")
+    parser.add_argument('--intervallo', type=float, default=1.0, help="secondi tra due polling")
+    parser.add_argument('--attesa-stabile', type=float, default=2.0,
+                        help="secondi senza cambiamenti prima di elaborare un file")
+    parser.add_argument('--workers', type=int, default=2)
+    args = parser.parse_args()
+    ServizioIngestione(args.cartella, args.output_csv, workers=args.workers, intervallo=args.intervallo,
+                       attesa_stabile=args.attesa_stabile).esegui()
@@ -0,0 +1,123 @@
+"""
+Output colonnare opzionale (Parquet o Arrow IPC) in alternativa al CSV.
+Le righe sono scritte come dataset partizionato in stile hive per
+CodiceFiscaleCessionario (se presente) e mese della fattura, per esempio
+    linee.parquet/CodiceFiscaleCessionario=RSSMRA80A01H501U/Mese=2023-06/part-....parquet
+con i tipi del DataFrame (date, interi, float) invece di testo. Chi legge può
+saltare le partizioni che non servono e caricare solo alcune colonne.
+Richiede pyarrow; senza, il CSV resta l'unico formato disponibile.
+"""
+import os
+import shutil
+import uuid
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+except ImportError:
+    pa = None
+    ds = None
+
+# formato -> (formato pyarrow.dataset, estensione dei file)
+FORMATI = {'parquet': ('parquet', 'parquet'), 'arrow': ('ipc', 'arrow')}
+COLONNA_MESE = 'Mese'
+COLONNA_CESSIONARIO = 'CodiceFiscaleCessionario'
+# Colonne categoriche delle linee (vedi accumulatore.py): nel dataset sono
+# dizionari con indici int32 qualunque sia il numero di categorie del blocco
+COLONNE_DIZIONARIO = ('IdPaese', 'IdFiscaleIVA', 'CAP', 'Comune', 'Provincia', 'Descrizione')
+
+
+def _richiedi_pyarrow(formato):
+    if formato not in FORMATI:
+        raise ValueError(f"Formato non supportato: {formato} (validi: csv, {', '.join(FORMATI)})")
+    if pa is None:
+        raise ImportError("Per l'output Parquet/Arrow serve pyarrow (pip install pyarrow)")
+
+
+def _partizionamento(nomi):
+    # Sempre stringhe: i codici fiscali numerici non devono perdere gli zeri iniziali
+    return ds.partitioning(pa.schema([(nome, pa.string()) for nome in nomi]), flavor='hive')
+
+
+def _tipo_colonna(nome):
+    if nome == 'Data':
+        return pa.timestamp('ns')
+    if nome == 'Quantita':
+        return pa.int64()
+    if nome in ('PrezzoUnitario', 'PrezzoTotale'):
+        return pa.float64()
+    if nome in COLONNE_DIZIONARIO:
+        return pa.dictionary(pa.int32(), pa.string())
+    return pa.string()
+
+
+def schema_linee(colonne):
+    """
+    Schema Arrow esplicito delle colonne: non dipende dai valori del blocco
+    (larghezza degli interi, numero di categorie), così tutti i file del
+    dataset hanno lo stesso schema e si leggono insieme.
+    """
+    return pa.schema([(nome, _tipo_colonna(nome)) for nome in colonne])
+
+
+def partizioni_predefinite(df):
+    """CodiceFiscaleCessionario (se il DataFrame lo ha) e mese della fattura"""
+    if COLONNA_CESSIONARIO in df.columns:
+        return [COLONNA_CESSIONARIO, COLONNA_MESE]
+    return [COLONNA_MESE]
+
+
+def scrivi_colonnare(df, cartella, formato='parquet', partizioni=None):
+    """
+    Aggiunge le righe di df al dataset in `cartella`. Ogni chiamata scrive file
+    nuovi nelle partizioni toccate, quindi si può chiamare una volta per file
+    sorgente; per ripartire da zero usare svuota_colonnare().
+    La colonna Mese (AAAA-MM) è ricavata da Data. Le colonne sono convertite
+    allo schema fisso di schema_linee().
+    """
+    _richiedi_pyarrow(formato)
+    if df.empty:
+        return
+    if partizioni is None:
+        partizioni = partizioni_predefinite(df)
+    if COLONNA_MESE in partizioni and COLONNA_MESE not in df.columns:
+        df = df.assign(**{COLONNA_MESE: df['Data'].dt.strftime('%Y-%m')})
+    df = df.astype({nome: str for nome in partizioni if nome != COLONNA_MESE})
+    formato_ds, estensione = FORMATI[formato]
+    tabella = pa.Table.from_pandas(df, preserve_index=False)
+    ds.write_dataset(
+        tabella.cast(schema_linee(tabella.column_names)),
+        str(cartella),
+        format=formato_ds,
+        partitioning=_partizionamento(partizioni),
+        basename_template=f'part-{uuid.uuid4().hex}-{{i}}.{estensione}',
+        existing_data_behavior='overwrite_or_ignore',
+    )
+
+
+def svuota_colonnare(cartella, formato='parquet'):
+    """Elimina il dataset in `cartella` (prima di una riscrittura completa)"""
+    _richiedi_pyarrow(formato)
+    if os.path.isdir(cartella):
+        shutil.rmtree(cartella)
+
+
+def leggi_colonnare(cartella, formato='parquet', colonne=None, partizioni=None, **filtri):
+    """
+    Legge il dataset come DataFrame. `colonne` limita le colonne caricate;
+    i filtri per nome di partizione (es. Mese=['2023-05', '2023-06'] oppure
+    CodiceFiscaleCessionario='RSS...') escludono le cartelle senza aprirle.
+    `partizioni` deve corrispondere a quelle usate in scrittura; se omesso è
+    ricavato dalle cartelle del primo livello.
+    """
+    _richiedi_pyarrow(formato)
+    if partizioni is None:
+        per_cessionario = any(nome.startswith(COLONNA_CESSIONARIO + '=') for nome in os.listdir(cartella))
+        partizioni = [COLONNA_CESSIONARIO, COLONNA_MESE] if per_cessionario else [COLONNA_MESE]
+    dataset = ds.dataset(str(cartella), format=FORMATI[formato][0], partitioning=_partizionamento(partizioni))
+    filtro = None
+    for nome, valori in filtri.items():
+        valori = [valori] if isinstance(valori, str) else list(valori)
+        condizione = ds.field(nome).isin(valori)
+        filtro = condizione if filtro is None else filtro & condizione
+    return dataset.to_table(columns=colonne, filter=filtro).to_pandas()
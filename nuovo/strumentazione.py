@@ -0,0 +1,121 @@
+"""
+Strumentazione leggera della pipeline di ingestione: tempo per stadio,
+contatori (file, byte letti, linee, errori, hit di cache), approccio di
+estrazione p7m che ha funzionato e, se abilitata, una traccia per file.
+Ogni misura costa due perf_counter e una somma in un dict, quindi resta
+sempre attiva. Ogni processo ha le sue statistiche: i worker di
+creazione_df.accumula_linee_parallelo le restituiscono insieme alle linee
+e il processo principale le unisce.
+"""
+import json
+import time
+
+
+class Statistiche:
+
+    def __init__(self, traccia=False):
+        self.tempi = {}        # stadio -> [secondi, chiamate]
+        self.contatori = {}    # nome -> totale
+        self.strategie = {}    # approccio di estrazione p7m -> file
+        self.traccia = [] if traccia else None
+        self._file = None      # voce della traccia del file in corso
+
+    def aggiungi_tempo(self, stadio, secondi):
+        voce = self.tempi.get(stadio)
+        if voce is None:
+            self.tempi[stadio] = [secondi, 1]
+        else:
+            voce[0] += secondi
+            voce[1] += 1
+        if self._file is not None:
+            tempi = self._file['tempi']
+            tempi[stadio] = tempi.get(stadio, 0.0) + secondi
+
+    def conta(self, nome, n=1):
+        self.contatori[nome] = self.contatori.get(nome, 0) + n
+        if self._file is not None:
+            self._file[nome] = self._file.get(nome, 0) + n
+
+    def strategia(self, nome):
+        self.strategie[nome] = self.strategie.get(nome, 0) + 1
+        if self._file is not None:
+            self._file['strategia'] = nome
+
+    def inizio_file(self, path):
+        if self.traccia is not None:
+            self._file = {'path': path, 'tempi': {}}
+
+    def fine_file(self, errore=None):
+        if self._file is not None:
+            if errore is not None:
+                self._file['errore'] = errore
+            self.traccia.append(self._file)
+            self._file = None
+
+    def unisci(self, altre):
+        """Somma le statistiche di un altro processo (es. un worker)"""
+        for stadio, (secondi, chiamate) in altre.tempi.items():
+            voce = self.tempi.setdefault(stadio, [0.0, 0])
+            voce[0] += secondi
+            voce[1] += chiamate
+        for nome, n in altre.contatori.items():
+            self.contatori[nome] = self.contatori.get(nome, 0) + n
+        for nome, n in altre.strategie.items():
+            self.strategie[nome] = self.strategie.get(nome, 0) + n
+        if self.traccia is not None and altre.traccia:
+            self.traccia.extend(altre.traccia)
+
+    def riepilogo(self, traccia=False):
+        """Dict serializzabile in JSON; con traccia=True include le voci per file"""
+        riepilogo = {
+            'tempi': {stadio: {'secondi': round(secondi, 6), 'chiamate': chiamate}
+                      for stadio, (secondi, chiamate) in sorted(self.tempi.items(), key=lambda v: -v[1][0])},
+            'contatori': dict(self.contatori),
+            'strategie_p7m': dict(self.strategie),
+        }
+        if traccia and self.traccia is not None:
+            riepilogo['file'] = self.traccia
+        return riepilogo
+
+    def salva_json(self, percorso, traccia=False):
+        with open(percorso, 'w') as f:
+            json.dump(self.riepilogo(traccia), f, indent=4)
+
+
+class _Misura:
+    """Context manager di misura(): aggiunge il tempo trascorso allo stadio"""
+    __slots__ = ('stadio', 'inizio')
+
+    def __init__(self, stadio):
+        self.stadio = stadio
+
+    def __enter__(self):
+        self.inizio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        STATISTICHE.aggiungi_tempo(self.stadio, time.perf_counter() - self.inizio)
+        return False
+
+
+# Statistiche del processo corrente
+STATISTICHE = Statistiche()
+
+
+def nuove_statistiche(traccia=False):
+    """Sostituisce le statistiche del processo con statistiche vuote e le restituisce"""
+    global STATISTICHE
+    STATISTICHE = Statistiche(traccia)
+    return STATISTICHE
+
+
+def misura(stadio):
+    return _Misura(stadio)
+
+
+def conta(nome, n=1):
+    STATISTICHE.conta(nome, n)
+
+
+def strategia(nome):
+    STATISTICHE.strategia(nome)
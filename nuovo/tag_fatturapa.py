@@ -0,0 +1,75 @@
+from lxml import etree
+
+# Percorsi FatturaPA usati per estrarre le linee. I percorsi sono relativi
+# all'elemento passato a trova()/trova_tutti() e usano solo i nomi locali:
+# il namespace viene ricavato dal documento.
+CEDENTE_ID_FISCALE = 'CedentePrestatore/DatiAnagrafici/IdFiscaleIVA'
+CEDENTE_SEDE = 'CedentePrestatore/Sede'
+CESSIONARIO_DATI_ANAGRAFICI = 'CessionarioCommittente/DatiAnagrafici'
+DATA_DOCUMENTO = 'DatiGenerali/DatiGeneraliDocumento/Data'
+DETTAGLIO_LINEE = 'DatiBeniServizi/DettaglioLinee'
+
+# Cache delle espressioni compilate: (namespace, percorso) -> etree.XPath
+_xpath_compilate = {}
+
+
+def namespace_documento(elem):
+    """
+    Namespace dei figli di `elem` ('' se non qualificati).
+    In FatturaPA la radice è qualificata (p:, ns2:, n0:, ...) ma i figli di
+    solito no, quindi si guarda il primo figlio elemento e non la radice.
+    """
+    for child in elem.iterchildren(tag=etree.Element):
+        tag = child.tag
+        return tag[1:tag.index('}')] if tag[0] == '{' else ''
+    tag = elem.tag
+    return tag[1:tag.index('}')] if tag[0] == '{' else ''
+
+
+def _xpath(namespace, percorso):
+    """Restituisce (compilandola una volta sola) l'XPath per il percorso"""
+    chiave = (namespace, percorso)
+    xpath = _xpath_compilate.get(chiave)
+    if xpath is None:
+        if namespace:
+            espressione = '/'.join('f:' + parte for parte in percorso.split('/'))
+            xpath = etree.XPath(espressione, namespaces={'f': namespace})
+        elif namespace is None:
+            # Fallback indipendente dal namespace, per documenti "misti"
+            espressione = '/'.join(f"*[local-name()='{parte}']" for parte in percorso.split('/'))
+            xpath = etree.XPath(espressione)
+        else:
+            xpath = etree.XPath(percorso)
+        _xpath_compilate[chiave] = xpath
+    return xpath
+
+
+def trova_tutti(parent, percorso, namespace=None):
+    """
+    Tutti gli elementi che corrispondono a `percorso` sotto `parent`.
+    Se `namespace` non è indicato viene ricavato da `parent`; chi fa più
+    ricerche sullo stesso documento può calcolarlo una volta con
+    namespace_documento() e passarlo.
+    """
+    if parent is None:
+        return []
+    if namespace is None:
+        namespace = namespace_documento(parent)
+    risultato = _xpath(namespace, percorso)(parent)
+    if not risultato:
+        risultato = _xpath(None, percorso)(parent)
+    return risultato
+
+
+def trova(parent, percorso, namespace=None):
+    """Primo elemento che corrisponde a `percorso` sotto `parent`, None se assente"""
+    risultato = trova_tutti(parent, percorso, namespace)
+    return risultato[0] if risultato else None
+
+
+def testo(parent, percorso, namespace=None):
+    """Testo del primo elemento trovato ('' se vuoto), None se assente"""
+    elem = trova(parent, percorso, namespace)
+    if elem is None:
+        return None
+    return elem.text if elem.text is not None else ''
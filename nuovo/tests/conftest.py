@@ -0,0 +1,5 @@
+import os
+import sys
+
+# I moduli di nuovo/ si importano tra loro come moduli di primo livello
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
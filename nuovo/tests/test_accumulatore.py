@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+from corpus_sintetico import fattura_sintetica
+from creazione_df import dataframe_linee_batch
+
+
+@pytest.mark.parametrize('engine', ['objectify', 'iterparse'])
+def test_quantita_oltre_int32(tmp_path, engine):
+    # Una Quantita FatturaPA ha fino a 12 cifre intere: non deve far scartare il file
+    xml = fattura_sintetica(n_linee=2).replace(b'<Quantita>3.00</Quantita>', b'<Quantita>999999999999.00</Quantita>')
+    (tmp_path / 'grande.xml').write_bytes(xml)
+    df = dataframe_linee_batch(str(tmp_path), engine=engine)
+    assert df['Quantita'].dtype == np.int64
+    assert df['Quantita'].tolist() == [2, 999999999999]
+
+
+@pytest.mark.parametrize('engine', ['objectify', 'iterparse'])
+def test_data_non_valida_scarta_il_file(tmp_path, engine, capsys):
+    (tmp_path / 'buona.xml').write_bytes(fattura_sintetica(n_linee=2))
+    (tmp_path / 'rotta.xml').write_bytes(fattura_sintetica(n_linee=3, data='2023-13-45', numero=2))
+    df = dataframe_linee_batch(str(tmp_path), engine=engine)
+    assert len(df) == 2
+    assert df['Data'].notna().all()
+    assert 'rotta.xml' in capsys.readouterr().out
@@ -0,0 +1,25 @@
+import pandas as pd
+
+from aggregati import AggregatiLinee
+
+
+def test_prezzo_medio_solo_sulle_linee_con_quantita(tmp_path):
+    aggregati = AggregatiLinee(tmp_path / 'aggregati.db')
+    try:
+        aggregati.aggiorna(pd.DataFrame({
+            'Data': pd.to_datetime(['2023-06-30'] * 3),
+            'IdFiscaleIVA': ['babd58f0c450'] * 3,
+            'Provincia': ['BO'] * 3,
+            'Comune': ['Bologna'] * 3,
+            'Quantita': [2, 4, -1],
+            'PrezzoUnitario': [1.5, 1.5, 100.0],
+            'PrezzoTotale': [3.0, 6.0, 100.0],
+        }), cessionario='CSSMRA80A01A944X')
+        riga = aggregati.leggi('fornitore_mese', IdFiscaleIVA='babd58f0c450').iloc[0]
+    finally:
+        aggregati.chiudi()
+    assert riga['righe'] == 3
+    assert riga['spesa'] == 109.0
+    assert riga['quantita'] == 6
+    # La linea senza Quantita resta nella spesa ma non nel prezzo medio
+    assert riga['prezzo_medio'] == 1.5
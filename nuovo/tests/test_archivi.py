@@ -0,0 +1,76 @@
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+import archivi
+from corpus_sintetico import fattura_sintetica
+from accumulatore import AccumulatoreLinee
+from creazione_df import accumula_linee_batch, accumula_linee_parallelo, file_batch
+
+N_FILE = 24
+
+
+@pytest.fixture
+def fatture(tmp_path):
+    cartella = tmp_path / 'fatture'
+    cartella.mkdir()
+    for i in range(N_FILE):
+        (cartella / f'f{i:02d}.xml').write_bytes(fattura_sintetica(n_linee=i % 5 + 1, numero=i))
+    return cartella
+
+
+def _tar(fatture, tmp_path):
+    percorso = tmp_path / 'consegna.tar.gz'
+    with tarfile.open(percorso, 'w:gz') as tf:
+        for nome in sorted(os.listdir(fatture)):
+            tf.add(fatture / nome, arcname=nome)
+    return str(percorso)
+
+
+def _zip(fatture, tmp_path):
+    percorso = tmp_path / 'consegna.zip'
+    with zipfile.ZipFile(percorso, 'w') as zf:
+        for nome in sorted(os.listdir(fatture)):
+            zf.write(fatture / nome, arcname=nome)
+    return str(percorso)
+
+
+@pytest.mark.parametrize('crea', [_tar, _zip])
+def test_parallelo_come_seriale(fatture, tmp_path, monkeypatch, crea):
+    archivio = crea(fatture, tmp_path)
+    paths = file_batch(archivio)
+    assert len(paths) == N_FILE
+    seriale = AccumulatoreLinee()
+    assert accumula_linee_batch(paths, seriale) == []
+    archivi.chiudi()
+
+    principale = os.getpid()
+    aperture = []
+    apri_tar = tarfile.open
+
+    def apri_solo_nel_principale(*args, **kwargs):
+        # I worker (fork) ereditano il patch: un tar aperto lì diventa un errore del file
+        if os.getpid() != principale:
+            raise RuntimeError("tar aperto in un worker")
+        aperture.append(args[0])
+        return apri_tar(*args, **kwargs)
+
+    monkeypatch.setattr(archivi.tarfile, 'open', apri_solo_nel_principale)
+    parallelo = AccumulatoreLinee()
+    assert accumula_linee_parallelo(paths, parallelo, workers=2) == []
+    assert parallelo.to_dataframe().equals(seriale.to_dataframe())
+    if archivio.endswith('.tar.gz'):
+        # Una sola decompressione, nel processo principale
+        assert aperture == [archivio]
+    assert not archivi._APERTI
+
+
+def test_membro_illeggibile_e_un_errore_del_file(fatture, tmp_path):
+    paths = file_batch(_tar(fatture, tmp_path))
+    mancante = archivi.membro(paths[0].partition(archivi.SEPARATORE)[0], 'mancante.xml')
+    acc = AccumulatoreLinee()
+    errori = accumula_linee_parallelo(paths[:4] + [mancante] + paths[4:], acc, workers=2)
+    assert [path for path, _ in errori] == [mancante]
+    assert acc.n_fatture == N_FILE
@@ -0,0 +1,101 @@
+import base64
+
+import pytest
+
+from decodifica_cms import MAX_PROFONDITA, ErroreCMS, estrai_contenuto_cms
+from estrai_p7m_python_v2 import estrai_xml_bytes_da_p7m, estrai_xml_da_p7m_bytes
+
+XML = (b'<?xml version="1.0" encoding="UTF-8"?><p:FatturaElettronica versione="FPR12" '
+       b'xmlns:p="http://ivaservizi.agenziaentrate.gov.it/docs/xsd/fatture/v1.2">'
+       + b''.join(b'<DettaglioLinee><NumeroLinea>%d</NumeroLinea></DettaglioLinee>' % i for i in range(50))
+       + b'</p:FatturaElettronica>')
+OID_SIGNED_DATA = bytes.fromhex('06092a864886f70d010702')
+OID_DATA = bytes.fromhex('06092a864886f70d010701')
+
+
+def _der(tag, contenuto):
+    n = len(contenuto)
+    if n < 0x80:
+        lunghezza = bytes([n])
+    else:
+        byte_lunghezza = n.to_bytes((n.bit_length() + 7) // 8, 'big')
+        lunghezza = bytes([0x80 | len(byte_lunghezza)]) + byte_lunghezza
+    return bytes([tag]) + lunghezza + contenuto
+
+
+def _a_chunk(dati, chunk):
+    """OCTET STRING costruito a lunghezza indefinita, in pezzi da `chunk` byte"""
+    pezzi = b''.join(_der(0x04, dati[i:i + chunk]) for i in range(0, len(dati), chunk))
+    return b'\x24\x80' + pezzi + b'\x00\x00'
+
+
+def _signed_data(e_content):
+    """Busta con un eContent già codificato (tag e lunghezza inclusi) e una firma fittizia"""
+    encap = _der(0x30, OID_DATA + _der(0xA0, e_content))
+    firma = _der(0x31, _der(0x30, _der(0x02, b'\x01') + bytes(range(256))))
+    signed_data = _der(0x30, _der(0x02, b'\x01') + _der(0x31, b'') + encap + firma)
+    return _der(0x30, OID_SIGNED_DATA + _der(0xA0, signed_data))
+
+
+@pytest.mark.parametrize('busta', [
+    _signed_data(_der(0x04, XML)),
+    _signed_data(_a_chunk(XML, 1000)),
+    base64.encodebytes(_signed_data(_der(0x04, XML))),
+    b'-----BEGIN PKCS7-----\n' + base64.encodebytes(_signed_data(_der(0x04, XML))) + b'-----END PKCS7-----\n',
+], ids=['der', 'ber', 'base64', 'pem'])
+def test_formati(busta):
+    assert bytes(estrai_contenuto_cms(busta)) == XML
+
+
+@pytest.mark.parametrize('chunk', [1, 7, 1000, len(XML)])
+def test_chunk_ber_lunghezza_indefinita(chunk):
+    assert bytes(estrai_contenuto_cms(_signed_data(_a_chunk(XML, chunk)))) == XML
+
+
+def test_chunk_ber_lunghezza_definita_e_annidati():
+    meta = len(XML) // 2
+    interno = b'\x24\x80' + _der(0x04, XML[meta:meta + 10]) + _der(0x04, XML[meta + 10:]) + b'\x00\x00'
+    e_content = _der(0x24, _der(0x04, XML[:meta]) + interno)
+    assert bytes(estrai_contenuto_cms(_signed_data(e_content))) == XML
+
+
+def test_doppia_firma():
+    interna = _signed_data(_a_chunk(XML, 100))
+    assert bytes(estrai_contenuto_cms(_signed_data(_der(0x04, interna)))) == XML
+
+
+@pytest.mark.parametrize('dati', [b'', XML, _signed_data(_der(0x04, XML))[:40]])
+def test_non_cms(dati):
+    with pytest.raises(ErroreCMS):
+        estrai_contenuto_cms(dati)
+
+
+def test_der_senza_copie():
+    p7m = _signed_data(_der(0x04, XML))
+    contenuto = estrai_contenuto_cms(p7m)
+    assert isinstance(contenuto, memoryview)
+    assert contenuto.obj is p7m
+
+
+def test_annidamento_entro_il_limite():
+    e_content = b'\x24\x80' * MAX_PROFONDITA + _der(0x04, XML) + b'\x00\x00' * MAX_PROFONDITA
+    assert bytes(estrai_contenuto_cms(_signed_data(e_content))) == XML
+
+
+def test_annidamento_eccessivo():
+    e_content = b'\x24\x80' * 5000 + _der(0x04, XML) + b'\x00\x00' * 5000
+    with pytest.raises(ErroreCMS):
+        estrai_contenuto_cms(_signed_data(e_content))
+
+
+@pytest.mark.parametrize('xml', [
+    XML,
+    XML.replace(b'<NumeroLinea>1<', '<NumeroLinea>1 caffè €<'.encode()),
+    # Byte non UTF-8: scartati come nella decodifica in testo
+    XML.replace(b'<NumeroLinea>1<', b'<NumeroLinea>1 caff\xe8<'),
+], ids=['ascii', 'utf8', 'non_utf8'])
+def test_xml_in_byte_come_il_testo(xml):
+    p7m = _signed_data(_der(0x04, b'\r\n' + xml + b'\n'))
+    xml_bytes = estrai_xml_bytes_da_p7m(p7m)
+    assert isinstance(xml_bytes, bytes)
+    assert xml_bytes == estrai_xml_da_p7m_bytes(p7m).encode('utf-8')
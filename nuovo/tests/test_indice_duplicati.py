@@ -0,0 +1,91 @@
+import os
+
+import pandas as pd
+import pytest
+
+from corpus_sintetico import fattura_sintetica
+from creazione_df import dataframe_linee_batch_incrementale
+from indice_duplicati import IndiceDuplicati, identita_fattura, normalizza_xml
+from manifest import ManifestFile
+
+
+@pytest.fixture
+def indice(tmp_path):
+    i = IndiceDuplicati(tmp_path / 'duplicati.db')
+    yield i
+    i.chiudi()
+
+
+def test_identita_ignora_formattazione():
+    xml = fattura_sintetica(n_linee=3)
+    riformattato = b'\xef\xbb\xbf' + xml.replace(b'><', b'>\r\n  <')
+    assert normalizza_xml(riformattato) == normalizza_xml(xml)
+    assert identita_fattura(riformattato) == identita_fattura(xml)
+    id_fiscale, numero, data, _ = identita_fattura(xml)
+    assert (id_fiscale, numero, data) == ('IT01234567890', '1', '2023-06-30')
+    assert identita_fattura(fattura_sintetica(n_linee=4)) != identita_fattura(xml)
+
+
+def test_registra_duplicato(indice):
+    identita = identita_fattura(fattura_sintetica(n_linee=3))
+    assert indice.registra(identita, 'a.xml') is None
+    assert indice.registra(identita, 'b.xml.p7m') == 'a.xml'
+    # Lo stesso file rielaborato non è un duplicato di sé stesso
+    assert indice.registra(identita, 'a.xml') is None
+    assert len(indice) == 1
+
+
+def test_svuota(indice):
+    identita = identita_fattura(fattura_sintetica(n_linee=3))
+    indice.registra(identita, 'a.xml')
+    indice.svuota()
+    assert len(indice) == 0
+    # Dopo una riscrittura completa la fattura appartiene al primo path che la registra
+    assert indice.registra(identita, 'b.xml') is None
+
+
+def test_rimuovi_restituisce_le_copie(indice):
+    identita = identita_fattura(fattura_sintetica(n_linee=3))
+    indice.registra(identita, 'a.xml')
+    indice.registra(identita, 'c.xml')
+    indice.registra(identita, 'b.xml')
+
+    assert indice.rimuovi(['a.xml']) == ['b.xml', 'c.xml']
+    assert indice.originale(identita) is None
+    # La prima copia rielaborata diventa il nuovo originale
+    assert indice.registra(identita, 'b.xml') is None
+    assert indice.registra(identita, 'c.xml') == 'b.xml'
+    # Originale e copia tolti insieme: nessuno da rielaborare
+    assert indice.rimuovi(['b.xml', 'c.xml']) == []
+
+
+def test_copia_modificata_non_resta_annotata(indice):
+    identita = identita_fattura(fattura_sintetica(n_linee=3))
+    indice.registra(identita, 'a.xml')
+    indice.registra(identita, 'b.xml')
+    # b.xml ora contiene un'altra fattura
+    assert indice.registra(identita_fattura(fattura_sintetica(n_linee=5)), 'b.xml') is None
+    assert indice.rimuovi(['a.xml']) == []
+
+
+def test_incrementale_rielabora_la_copia(tmp_path, indice):
+    cartella = tmp_path / 'fatture'
+    cartella.mkdir()
+    xml = fattura_sintetica(n_linee=4)
+    (cartella / 'a.xml').write_bytes(xml)
+    (cartella / 'b.xml').write_bytes(xml)
+    output = tmp_path / 'linee.csv'
+    manifest = ManifestFile(tmp_path / 'manifest.db')
+    try:
+        dataframe_linee_batch_incrementale(str(cartella), str(output), manifest, duplicati=indice)
+        assert len(pd.read_csv(output)) == 4
+
+        originale = indice.originale(identita_fattura(xml))
+        copia = ({str(cartella / 'a.xml'), str(cartella / 'b.xml')} - {originale}).pop()
+        os.remove(originale)
+        aggiunte = dataframe_linee_batch_incrementale(str(cartella), str(output), manifest, duplicati=indice)
+        assert len(aggiunte) == 4
+        assert len(pd.read_csv(output)) == 4
+        assert indice.originale(identita_fattura(xml)) == copia
+    finally:
+        manifest.chiudi()
@@ -0,0 +1,203 @@
+import csv
+
+import pandas as pd
+import pytest
+
+from corpus_sintetico import fattura_sintetica
+from creazione_df import dataframe_linee_batch_incrementale
+from manifest import ManifestFile, rimuovi_righe_csv
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    m = ManifestFile(tmp_path / 'manifest.db')
+    yield m
+    m.chiudi()
+
+
+def _registra(manifest, tmp_path, nome, righe):
+    path = tmp_path / nome
+    path.write_text(nome)
+    manifest.registra(str(path), righe)
+    return str(path)
+
+
+def _inizi(manifest, output):
+    return manifest.conn.execute(
+        "SELECT path, inizio, n FROM righe WHERE output = ? ORDER BY inizio", (output,)).fetchall()
+
+
+def test_rimuovi_compatta_le_posizioni(manifest, tmp_path):
+    a = _registra(manifest, tmp_path, 'a.xml', {'linee.csv': (0, 2)})
+    b = _registra(manifest, tmp_path, 'b.xml', {'linee.csv': (2, 3)})
+    c = _registra(manifest, tmp_path, 'c.xml', {'linee.csv': (5, 1)})
+    d = _registra(manifest, tmp_path, 'd.xml', {'linee.csv': (6, 4)})
+
+    assert manifest.rimuovi([c, a]) == {'linee.csv': [(0, 2), (5, 1)]}
+    assert _inizi(manifest, 'linee.csv') == [(b, 0, 3), (d, 3, 4)]
+    assert manifest.righe_output('linee.csv') == 7
+    assert manifest.conn.execute("SELECT path FROM file ORDER BY path").fetchall() == [(b,), (d,)]
+
+
+def test_rimuovi_tocca_solo_l_output_del_file(manifest, tmp_path):
+    a = _registra(manifest, tmp_path, 'a.xml', {'linee.csv': (0, 2), 'altro.csv': (0, 1)})
+    b = _registra(manifest, tmp_path, 'b.xml', {'linee.csv': (2, 3)})
+    c = _registra(manifest, tmp_path, 'c.xml', {'altro.csv': (1, 5)})
+
+    assert manifest.rimuovi([a]) == {'linee.csv': [(0, 2)], 'altro.csv': [(0, 1)]}
+    assert _inizi(manifest, 'linee.csv') == [(b, 0, 3)]
+    assert _inizi(manifest, 'altro.csv') == [(c, 0, 5)]
+
+
+def test_file_senza_righe_non_sposta_nulla(manifest, tmp_path):
+    vuoto = _registra(manifest, tmp_path, 'vuoto.xml', {'linee.csv': (0, 0)})
+    b = _registra(manifest, tmp_path, 'b.xml', {'linee.csv': (0, 3)})
+
+    assert manifest.rimuovi([vuoto]) == {}
+    assert _inizi(manifest, 'linee.csv') == [(b, 0, 3)]
+
+
+def test_confronta(manifest, tmp_path):
+    a = _registra(manifest, tmp_path, 'a.xml', {'linee.csv': (0, 1)})
+    b = _registra(manifest, tmp_path, 'b.xml', {'linee.csv': (1, 1)})
+    c = _registra(manifest, tmp_path, 'c.xml', {'linee.csv': (2, 1)})
+    nuovo = tmp_path / 'nuovo.xml'
+    nuovo.write_text('nuovo')
+    (tmp_path / 'a.xml').write_text('contenuto diverso')
+    # Riscritto con lo stesso contenuto: cambia lo stat ma non l'hash
+    (tmp_path / 'b.xml').write_text('b.xml')
+
+    assert manifest.confronta([a, b, str(nuovo)]) == ([str(nuovo)], [a], [c])
+
+
+def test_rimuovi_righe_csv(tmp_path):
+    percorso = tmp_path / 'linee.csv'
+    with open(percorso, 'w', newline='', encoding='utf-8') as f:
+        scrittore = csv.writer(f)
+        scrittore.writerow(['Descrizione', 'Quantita'])
+        scrittore.writerows([f'riga {i}', i] for i in range(6))
+
+    rimuovi_righe_csv(percorso, [(1, 2), (4, 1)])
+
+    with open(percorso, newline='', encoding='utf-8') as f:
+        righe = list(csv.reader(f))
+    assert righe == [['Descrizione', 'Quantita'], ['riga 0', '0'], ['riga 3', '3'], ['riga 5', '5']]
+
+
+def test_verifica_output(manifest, tmp_path):
+    output = tmp_path / 'linee.csv'
+    manifest.verifica_output([output])
+    output.write_text('Descrizione\nriga\n')
+    with pytest.raises(ValueError):
+        manifest.verifica_output([output])
+    _registra(manifest, tmp_path, 'a.xml', {'linee.csv': (0, 1)})
+    manifest.verifica_output([output])
+
+
+def test_svuota(manifest, tmp_path):
+    _registra(manifest, tmp_path, 'a.xml', {'linee.csv': (0, 2)})
+    manifest.svuota()
+    assert len(manifest) == 0
+    assert manifest.righe_output('linee.csv') == 0
+
+
+def _scrivi_csv(percorso, righe):
+    with open(percorso, 'w', newline='', encoding='utf-8') as f:
+        scrittore = csv.writer(f)
+        scrittore.writerow(['Descrizione'])
+        scrittore.writerows([riga] for riga in righe)
+
+
+def _leggi_csv(percorso):
+    with open(percorso, newline='', encoding='utf-8') as f:
+        return [riga[0] for riga in list(csv.reader(f))[1:]]
+
+
+def test_transazione_annullata(manifest, tmp_path):
+    with pytest.raises(RuntimeError):
+        with manifest.transazione():
+            _registra(manifest, tmp_path, 'a.xml', {'linee.csv': (0, 2)})
+            manifest.segna_dimensione('linee.csv', 100)
+            raise RuntimeError("interruzione")
+    assert len(manifest) == 0
+    assert manifest.dimensione('linee.csv') is None
+
+
+def test_riconcilia_tronca_le_righe_non_registrate(manifest, tmp_path):
+    output = tmp_path / 'linee.csv'
+    _scrivi_csv(output, ['a0', 'a1'])
+    with manifest.transazione():
+        _registra(manifest, tmp_path, 'a.xml', {'linee.csv': (0, 2)})
+        manifest.segna_dimensione('linee.csv', output.stat().st_size)
+    # Append di b.xml interrotto prima della registrazione, anche a metà riga
+    with open(output, 'a', encoding='utf-8') as f:
+        f.write('b0\nb1\nb')
+
+    assert manifest.riconcilia([output]) == [str(output)]
+    assert _leggi_csv(output) == ['a0', 'a1']
+    assert manifest.riconcilia([output]) == []
+
+
+def test_riconcilia_output_piu_corto(manifest, tmp_path):
+    output = tmp_path / 'linee.csv'
+    _scrivi_csv(output, ['a0'])
+    _registra(manifest, tmp_path, 'a.xml', {'linee.csv': (0, 1)})
+    manifest.segna_dimensione('linee.csv', output.stat().st_size + 10)
+    with pytest.raises(ValueError):
+        manifest.riconcilia([output])
+
+
+def test_rimuovi_dagli_output(manifest, tmp_path):
+    output = tmp_path / 'linee.csv'
+    _scrivi_csv(output, ['a0', 'a1', 'b0', 'c0'])
+    a = _registra(manifest, tmp_path, 'a.xml', {'linee.csv': (0, 2)})
+    c = _registra(manifest, tmp_path, 'c.xml', {'linee.csv': (3, 1)})
+    _registra(manifest, tmp_path, 'b.xml', {'linee.csv': (2, 1)})
+    manifest.segna_dimensione('linee.csv', output.stat().st_size)
+
+    assert manifest.rimuovi_dagli_output([a, c], tmp_path) == {'linee.csv': [(0, 2), (3, 1)]}
+    assert _leggi_csv(output) == ['b0']
+    assert manifest.dimensione('linee.csv') == output.stat().st_size
+    assert not (tmp_path / 'linee.csv.tmp').exists()
+
+
+def test_riconcilia_completa_la_sostituzione(manifest, tmp_path):
+    output = tmp_path / 'linee.csv'
+    temporaneo = tmp_path / 'linee.csv.tmp'
+    _scrivi_csv(output, ['a0', 'b0'])
+    _scrivi_csv(temporaneo, ['b0'])
+    _registra(manifest, tmp_path, 'b.xml', {'linee.csv': (0, 1)})
+
+    # Manifest registrato con la dimensione del temporaneo: la sostituzione va completata
+    manifest.segna_dimensione('linee.csv', temporaneo.stat().st_size)
+    manifest.riconcilia([output])
+    assert _leggi_csv(output) == ['b0']
+    assert not temporaneo.exists()
+
+    # Temporaneo di una riscrittura mai registrata: si scarta
+    _scrivi_csv(temporaneo, ['altro', 'altro'])
+    manifest.riconcilia([output])
+    assert _leggi_csv(output) == ['b0']
+    assert not temporaneo.exists()
+
+
+def test_incrementale_dopo_interruzione(tmp_path):
+    cartella = tmp_path / 'fatture'
+    cartella.mkdir()
+    for numero in range(1, 4):
+        (cartella / f'f{numero}.xml').write_bytes(fattura_sintetica(n_linee=numero, numero=numero))
+    output = tmp_path / 'linee.csv'
+    manifest = ManifestFile(tmp_path / 'manifest.db')
+    try:
+        dataframe_linee_batch_incrementale(str(cartella), str(output), manifest)
+        attese = pd.read_csv(output)
+        # Un'esecuzione appende le righe di f4.xml e si ferma prima di registrarle
+        (cartella / 'f4.xml').write_bytes(fattura_sintetica(n_linee=4, numero=4))
+        with open(output, 'a') as f:
+            f.write('2023-06-30,IT,01234567890,40127,Bologna,BO,Articolo 1,2,1.5,3.0\n')
+        dataframe_linee_batch_incrementale(str(cartella), str(output), manifest)
+    finally:
+        manifest.chiudi()
+    finale = pd.read_csv(output)
+    assert len(finale) == len(attese) + 4
+    assert finale.iloc[:len(attese)].equals(attese)
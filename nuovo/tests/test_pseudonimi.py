@@ -0,0 +1,24 @@
+import json
+
+from pseudonimi import RegistroPseudonimi, cifratura
+
+
+def test_esportazioni_del_registro(tmp_path):
+    registro = RegistroPseudonimi(tmp_path / 'pseudonimi.db')
+    try:
+        registro.aggiungi({cifratura('01234567890'): '01234567890', cifratura('98765432109'): '98765432109'})
+        registro.esporta_csv(tmp_path / 'cifratura.csv')
+        registro.esporta_json(tmp_path / 'dizionario.json')
+    finally:
+        registro.chiudi()
+    attese = {cifratura('01234567890'): '01234567890', cifratura('98765432109'): '98765432109'}
+    with open(tmp_path / 'dizionario.json') as f:
+        assert json.load(f) == attese
+    # Il CSV esportato si reimporta in un registro nuovo (esecuzioni incrementali)
+    ricaricato = RegistroPseudonimi(tmp_path / 'ricaricato.db')
+    try:
+        ricaricato.importa_csv(tmp_path / 'cifratura.csv')
+        assert len(ricaricato) == 2
+        assert ricaricato.valore(cifratura('98765432109')) == '98765432109'
+    finally:
+        ricaricato.chiudi()
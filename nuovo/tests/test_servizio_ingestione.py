@@ -0,0 +1,47 @@
+import os
+import time
+
+import pandas as pd
+
+import servizio_ingestione
+from corpus_sintetico import fattura_sintetica
+from servizio_ingestione import ServizioIngestione
+
+_ELABORA_FILE = servizio_ingestione._elabora_file
+
+
+def _elabora_o_cade(path, engine, duplicati):
+    """Come _elabora_file, ma il worker muore sui file 'crash'"""
+    if 'crash' in os.path.basename(path):
+        time.sleep(0.5)
+        os._exit(1)
+    return _ELABORA_FILE(path, engine, duplicati)
+
+
+def test_caduta_del_pool_non_perde_i_completati(tmp_path, monkeypatch):
+    monkeypatch.setattr(servizio_ingestione, '_elabora_file', _elabora_o_cade)
+    cartella = tmp_path / 'deposito'
+    cartella.mkdir()
+    (cartella / 'crash.xml').write_bytes(fattura_sintetica(n_linee=2, numero=99))
+    for numero in range(1, 4):
+        (cartella / f'f{numero}.xml').write_bytes(fattura_sintetica(n_linee=5, numero=numero))
+    output = tmp_path / 'linee.csv'
+    servizio = ServizioIngestione(str(cartella), output, workers=4, attesa_stabile=0)
+    try:
+        servizio.ciclo()
+        assert len(servizio.in_corso) == 4
+        time.sleep(1.5)
+        servizio._raccogli()
+        # I tre file completati sono scritti, solo crash.xml torna in coda
+        assert servizio.contatori['file'] == 3
+        assert servizio.sospetti == {str(cartella / 'crash.xml')}
+        assert servizio.tentativi == {str(cartella / 'crash.xml'): 1}
+
+        fine = time.time() + 30
+        while servizio.contatori['errori'] == 0 and time.time() < fine:
+            servizio.ciclo()
+            time.sleep(0.1)
+        assert servizio.contatori == {'file': 3, 'linee': 15, 'errori': 1}
+    finally:
+        servizio.chiudi()
+    assert len(pd.read_csv(output)) == 15
@@ -1,10 +1,16 @@
 import io
+import os
 import re
+import sys
 from lxml import objectify
 import pandas as pd
 import zlib
 import binascii
 import base64
+# Ricerca dei tag FatturaPA condivisa con nuovo/: in coda a sys.path, i
+# moduli omonimi di questa cartella restano quelli usati
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'nuovo'))
+import tag_fatturapa
 
 def estrai_xml_da_p7m_python_v2(p7m_path):
     """
@@ -238,87 +244,74 @@ def _is_valid_xml(xml_content):
 
 def find_child_by_tag(parent, tag):
     """Trova un elemento figlio per tag name (considera solo la parte finale del tag)"""
-    for child in parent.iterchildren():
-        if child.tag.endswith(tag):
-            return child
-    return None
+    return tag_fatturapa.trova(parent, tag)
 
-def get_cedente_info(header):
+def get_cedente_info(header, namespace=None):
     """Estrae informazioni del cedente/prestatore"""
-    cedente = find_child_by_tag(header, 'CedentePrestatore')
+    cedente = tag_fatturapa.trova(header, 'CedentePrestatore', namespace)
     if cedente is None:
         return '', '', '', '', ''
     
-    dati_anagrafici = find_child_by_tag(cedente, 'DatiAnagrafici')
-    id_fiscale_iva = find_child_by_tag(dati_anagrafici, 'IdFiscaleIVA') if dati_anagrafici else None
+    id_fiscale_iva = tag_fatturapa.trova(cedente, 'DatiAnagrafici/IdFiscaleIVA', namespace)
     
     id_paese = str(id_fiscale_iva.IdPaese) if id_fiscale_iva is not None and hasattr(id_fiscale_iva, 'IdPaese') else ''
     id_codice = str(id_fiscale_iva.IdCodice) if id_fiscale_iva is not None and hasattr(id_fiscale_iva, 'IdCodice') else ''
     
-    sede = find_child_by_tag(cedente, 'Sede')
+    sede = tag_fatturapa.trova(cedente, 'Sede', namespace)
     cap = str(sede.CAP) if sede is not None and hasattr(sede, 'CAP') else ''
     comune = str(sede.Comune) if sede is not None and hasattr(sede, 'Comune') else ''
     provincia = str(sede.Provincia) if sede is not None and hasattr(sede, 'Provincia') else ''
     
     return id_paese, id_codice, cap, comune, provincia
 
-def get_data_fattura(body):
+def get_data_fattura(body, namespace=None):
     """Estrae la data della fattura"""
-    dati_generali = find_child_by_tag(body, 'DatiGenerali')
-    if dati_generali is None:
-        return pd.NaT
-    
-    dati_doc = find_child_by_tag(dati_generali, 'DatiGeneraliDocumento')
-    if dati_doc is None or not hasattr(dati_doc, 'Data'):
+    data = tag_fatturapa.trova(body, tag_fatturapa.DATA_DOCUMENTO, namespace)
+    if data is None:
         return pd.NaT
     
-    return pd.to_datetime(str(dati_doc.Data))
+    return pd.to_datetime(str(data))
 
-def get_linee_dettaglio(body, cedente_info, data_fattura):
+def get_linee_dettaglio(body, cedente_info, data_fattura, namespace=None):
     """Estrae le linee di dettaglio della fattura"""
-    beni_servizi = find_child_by_tag(body, 'DatiBeniServizi')
-    if beni_servizi is None:
-        return []
-    
     id_paese, id_codice, cap, comune, provincia = cedente_info
     rows = []
     
-    for linea in beni_servizi.iterchildren():
-        if linea.tag.endswith('DettaglioLinee'):
-            # Gestione robusta della quantità
-            quantita = -1
-            if hasattr(linea, 'Quantita') and linea.Quantita is not None:
-                try:
-                    quantita = int(float(str(linea.Quantita)))
-                except (ValueError, TypeError):
-                    quantita = -1
-            
-            # Gestione robusta di altri campi
-            descrizione = str(linea.Descrizione) if hasattr(linea, 'Descrizione') else ''
-            
+    for linea in tag_fatturapa.trova_tutti(body, tag_fatturapa.DETTAGLIO_LINEE, namespace):
+        # Gestione robusta della quantità
+        quantita = -1
+        if hasattr(linea, 'Quantita') and linea.Quantita is not None:
             try:
-                prezzo_unitario = float(str(linea.PrezzoUnitario)) if hasattr(linea, 'PrezzoUnitario') else 0.0
+                quantita = int(float(str(linea.Quantita)))
             except (ValueError, TypeError):
-                prezzo_unitario = 0.0
-            
-            try:
-                prezzo_totale = float(str(linea.PrezzoTotale)) if hasattr(linea, 'PrezzoTotale') else 0.0
-            except (ValueError, TypeError):
-                prezzo_totale = 0.0
-            
-            row = {
-                'Data': data_fattura,
-                'IdPaese': id_paese,
-                'IdFiscaleIVA': id_codice,
-                'CAP': cap,
-                'Comune': comune,
-                'Provincia': provincia,
-                'Descrizione': descrizione,
-                'Quantita': quantita,
-                'PrezzoUnitario': prezzo_unitario,
-                'PrezzoTotale': prezzo_totale,
-            }
-            rows.append(row)
+                quantita = -1
+        
+        # Gestione robusta di altri campi
+        descrizione = str(linea.Descrizione) if hasattr(linea, 'Descrizione') else ''
+        
+        try:
+            prezzo_unitario = float(str(linea.PrezzoUnitario)) if hasattr(linea, 'PrezzoUnitario') else 0.0
+        except (ValueError, TypeError):
+            prezzo_unitario = 0.0
+        
+        try:
+            prezzo_totale = float(str(linea.PrezzoTotale)) if hasattr(linea, 'PrezzoTotale') else 0.0
+        except (ValueError, TypeError):
+            prezzo_totale = 0.0
+        
+        row = {
+            'Data': data_fattura,
+            'IdPaese': id_paese,
+            'IdFiscaleIVA': id_codice,
+            'CAP': cap,
+            'Comune': comune,
+            'Provincia': provincia,
+            'Descrizione': descrizione,
+            'Quantita': quantita,
+            'PrezzoUnitario': prezzo_unitario,
+            'PrezzoTotale': prezzo_totale,
+        }
+        rows.append(row)
     
     return rows
 
@@ -357,18 +350,19 @@ def dataframe_linee_da_p7m_python(p7m_path):
         xml_content = clean_xml_after_closing_tag(xml_content)
         # Parsa l'XML
         xml = objectify.fromstring(xml_content.encode('utf-8'))
+        namespace = tag_fatturapa.namespace_documento(xml)
         
         # Trova le sezioni principali
-        header = find_child_by_tag(xml, 'FatturaElettronicaHeader')
-        body = find_child_by_tag(xml, 'FatturaElettronicaBody')
+        header = tag_fatturapa.trova(xml, 'FatturaElettronicaHeader', namespace)
+        body = tag_fatturapa.trova(xml, 'FatturaElettronicaBody', namespace)
         
         if header is None or body is None:
             raise Exception("Struttura XML della fattura non valida")
         
         # Estrai informazioni
-        cedente_info = get_cedente_info(header)
-        data_fattura = get_data_fattura(body)
-        rows = get_linee_dettaglio(body, cedente_info, data_fattura)
+        cedente_info = get_cedente_info(header, namespace)
+        data_fattura = get_data_fattura(body, namespace)
+        rows = get_linee_dettaglio(body, cedente_info, data_fattura, namespace)
         
         return pd.DataFrame(rows)
         